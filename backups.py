@@ -0,0 +1,148 @@
+import os
+import glob
+import gzip
+import json
+import hashlib
+import datetime
+import tempfile
+
+from metrics import METRICS
+
+
+#------------------------------------------------------------------------------
+def write_atomic(fname, data):
+    #Writes to a temporary file first, a crash never leaves half a file
+    folder = os.path.dirname(fname)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, fname)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+#------------------------------------------------------------------------------
+class BackupStore:
+    '''
+    Daily backups of the boards, stored by content.
+
+    Every board is written as a gzip object named after the sha256 of its
+    JSON, under objects/, and a day is a manifest under manifests/ mapping
+    each key to its object. A board that didn't change since an earlier
+    backup is not written again, so the folder only grows with the boards
+    that actually moved.
+
+    All methods block, run them with offload().
+    '''
+    def __init__(self, folder='Backup'):
+        self.folder = folder
+        self.objects = os.path.join(folder, 'objects')
+        self.manifests = os.path.join(folder, 'manifests')
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:] + '.json.gz')
+
+    def manifest_path(self, day):
+        return os.path.join(self.manifests, day + '.json')
+
+    #--------------------------------------------------------------------------
+    def put(self, rows):
+        #Stores one board, returns (digest, bytes written), 0 if it was stored before
+        data = json.dumps(rows, default=list).encode()
+        digest = hashlib.sha256(data).hexdigest()
+        fname = self.object_path(digest)
+        if os.path.exists(fname):
+            return digest, 0
+        packed = gzip.compress(data, compresslevel=6, mtime=0)
+        write_atomic(fname, packed)
+        return digest, len(packed)
+
+    def get(self, digest):
+        with open(self.object_path(digest), 'rb') as f:
+            return json.loads(gzip.decompress(f.read()))
+
+    def snapshot(self, database, day):
+        #Backs up {key: board} as the given YYYY-MM-DD, returns (new boards,
+        #bytes written)
+        with METRICS.timer('backup_seconds'):
+            manifest = {}
+            new = written = 0
+            for key in sorted(database):
+                manifest[key], size = self.put(database[key])
+                new += bool(size)
+                written += size
+            #The manifest goes last, a day only shows up once all of its
+            #boards are there
+            write_atomic(self.manifest_path(day), json.dumps(manifest, indent=0).encode())
+        METRICS.inc('backup_bytes_total', written)
+        return new, written
+
+    #--------------------------------------------------------------------------
+    def days(self):
+        return sorted(
+            os.path.basename(f)[:-len('.json')]
+            for f in glob.glob(os.path.join(self.manifests, '*.json'))
+        )
+
+    def manifest(self, day):
+        #{key: digest} of the day, None if there's no backup of it
+        try:
+            with open(self.manifest_path(day), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load(self, day, keys=None):
+        #{key: rows} as they were backed up on the day
+        manifest = self.manifest(day)
+        if manifest is None:
+            return None
+        keys = manifest if keys is None else [k for k in keys if k in manifest]
+        return {key: self.get(manifest[key]) for key in keys}
+
+    def inspect(self, day):
+        #Summary of a backup, how many of its boards were new that day and
+        #how much they take on disk
+        manifest = self.manifest(day)
+        if manifest is None:
+            return None
+        days = self.days()
+        i = days.index(day)
+        previous = self.manifest(days[i - 1]) if i else {}
+        digests = set(manifest.values())
+        new = digests - set(previous.values())
+        return {
+            'boards': len(manifest),
+            'changed': len(new),
+            'new_bytes': sum(os.path.getsize(self.object_path(d)) for d in new),
+            'bytes': sum(os.path.getsize(self.object_path(d)) for d in digests),
+        }
+
+    def usage(self):
+        #(objects, bytes) of the whole store
+        files = glob.glob(os.path.join(self.objects, '*', '*.json.gz'))
+        return len(files), sum(os.path.getsize(f) for f in files)
+
+    #--------------------------------------------------------------------------
+    def import_legacy(self):
+        #Copies the old full-copy Backup/YYYY-MM-DD.json files into the store.
+        #The files are left where they are, days already in the store are
+        #skipped
+        imported = 0
+        for fname in sorted(glob.glob(os.path.join(self.folder, '*.json'))):
+            day = os.path.basename(fname)[:-len('.json')]
+            try:
+                datetime.datetime.strptime(day, '%Y-%m-%d')
+            except ValueError:
+                continue
+            if self.manifest(day) is not None:
+                continue
+            with open(fname, 'r') as f:
+                self.snapshot(json.load(f), day)
+            imported += 1
+        return imported
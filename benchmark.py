@@ -0,0 +1,360 @@
+import os
+import sys
+import glob
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+import contextlib
+import tracemalloc
+
+#python benchmark.py [--scales 1,10,100] [--repeat 200] [--output bench.jsonl]
+#Times the lookup, refresh and persistence hot paths of the bot against the
+#saved RANKING_DATA.json and Backup/ snapshots, and against scaled-up copies.
+#Every result is printed as one JSON line.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STUB_PORT = 8799
+QUERIES = ['', 'a', 'th', 'the', 'system', 'dungeon', 'reborn', 'zzq']
+
+
+#------------------------------------------------------------------------------
+def result(name, scale, samples, **extra):
+    ms = sorted(s*1000 for s in samples)
+    item = {
+        'name': name,
+        'scale': scale,
+        'n': len(ms),
+        'mean_ms': round(statistics.fmean(ms), 4),
+        'p50_ms': round(ms[len(ms)//2], 4),
+        'p95_ms': round(ms[min(len(ms) - 1, int(len(ms)*0.95))], 4),
+        'min_ms': round(ms[0], 4),
+    }
+    item.update(extra)
+    return item
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def atimed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+#------------------------------------------------------------------------------
+def scale_database(database, scale):
+    #Copies of every board with their own keys, bookIds and titles
+    scaled = {}
+    for i in range(scale):
+        for key, rows in database.items():
+            if not i:
+                scaled[key] = [list(r) for r in rows]
+                continue
+            scaled[f'{key}#{i}'] = [
+                [rankNo, f'{bookId}{i}', updateId, f'{bookName} ({i})', amount]
+                for rankNo, bookId, updateId, bookName, amount in rows
+            ]
+    return scaled
+
+
+def scale_tracking(database, count, now):
+    #Due tracked entries on boards of the database, 10 per channel
+    keys = sorted(database)
+    entries = []
+    for n in range(count):
+        key = keys[n % len(keys)]
+        rows = database[key]
+        title, book_id = (rows[n % len(rows)][3], rows[n % len(rows)][1]) if rows else ('Missing Title', None)
+        entries.append((now - 1, key.split('#')[0], 3600,
+                        [title, 1000 + n//10, 'bench', 'http://avatar', 0, None, book_id, None]))
+    return entries
+
+
+class FakeChannel:
+    def __init__(self, cid):
+        self.id = cid
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+
+class FakeChannels:
+    #Stands in for the ChannelCache so no Discord connection is needed
+    def __init__(self):
+        self.channels = {}
+
+    async def resolve(self, cid):
+        return self.channels.setdefault(cid, FakeChannel(cid))
+
+    def invalidate(self, cid):
+        self.channels.pop(cid, None)
+
+
+#------------------------------------------------------------------------------
+def load_bot(db_path):
+    #The bot reads its settings from the environment when imported
+    for name in ('AI_ID', 'OWNER_ID', 'SERVER_ID'):
+        os.environ.setdefault(name, '0')
+    os.environ.setdefault('CSRFTOKEN', 'bench')
+    os.environ['DB_PATH'] = db_path
+    os.environ['WN_BASE_URL'] = f'http://127.0.0.1:{STUB_PORT}'
+    sys.path.insert(0, HERE)
+    import new_wn_rankerbot
+    #Posts go to FakeChannels, the tracker tick times building and sending
+    #the embeds instead of failed channel lookups
+    new_wn_rankerbot.CHANNELS = FakeChannels()
+    return new_wn_rankerbot
+
+
+def set_database(bot, database):
+    bot.DATABASE.clear()
+    bot.DATABASE.update({k: bot.Board(v) for k, v in database.items()})
+    now = time.time()
+    for key in database:
+        bot.LAST_UPDATE[key] = now
+    bot.TITLE_INDEX.build(bot.DATABASE)
+    bot.BOOK_INDEX.build(bot.DATABASE)
+    bot.ALL_TITLES.build(bot.DATABASE)
+
+
+#------------------------------------------------------------------------------
+async def bench_scale(bot, base, scale, repeat):
+    results = []
+    database = scale_database(base, scale)
+    set_database(bot, database)
+    rows = [(key, row[3]) for key, v in database.items() for row in v]
+    random.seed(scale)
+    sample = random.sample(rows, min(len(rows), repeat))
+    boards = sum(len(v) for v in database.values())
+
+    #Rank lookups
+    pairs = iter(sample*2)
+    async def lookup():
+        key, title = next(pairs)
+        await bot.iterate_over_database(key.split('-')[0], title, key)
+    results.append(result('iterate_over_database', scale, await atimed(lookup, len(sample)), rows=boards))
+
+    #Title indexes, a full rebuild and the incremental patch of one board
+    def rebuild():
+        bot.TITLE_INDEX.build(bot.DATABASE)
+        bot.BOOK_INDEX.build(bot.DATABASE)
+        bot.ALL_TITLES.build(bot.DATABASE)
+    results.append(result('refresh_names_full', scale, timed(rebuild, max(3, repeat//50)), titles=len(bot.ALL_TITLES)))
+
+    keys = sorted(database)
+    async def refresh_one():
+        key = random.choice(keys)
+        new = [list(r) for r in bot.DATABASE[key]]
+        random.shuffle(new)
+        for n, r in enumerate(new):
+            r[0] = n + 1
+        await bot.update_board(key, new)
+    results.append(result('refresh_names_incremental', scale, await atimed(refresh_one, repeat)))
+
+    #Every placement of a book
+    titles = iter(sample*2)
+    def profile():
+        key, title = next(titles)
+        placements, cover_link = bot.book_placements(title)
+        #Scaled copies of a board are named key#n
+        placements = [(k.split('#')[0], rankNo, amount) for k, rankNo, amount in placements]
+        bot.build_profile_embed(title, placements, cover_link, 'bench', 'http://avatar')
+    results.append(result('book_profile', scale, timed(profile, len(sample))))
+
+    #Autocomplete
+    #Misspelled titles, resolved by edit distance
+    typos = iter([(key, title[:3] + title[4:]) for key, title in sample]*2)
+    def resolve():
+        key, title = next(typos)
+        bot.resolve_title(title)
+    results.append(result('resolve_title_typo', scale, timed(resolve, len(sample))))
+
+    queries = iter(QUERIES*repeat)
+    async def complete():
+        await bot.title_autocomplete(None, next(queries))
+    results.append(result('title_autocomplete', scale, await atimed(complete, repeat), titles=len(bot.ALL_TITLES)))
+
+    #Persistence of one refreshed board
+    async def persist():
+        key = random.choice(keys)
+        rows = bot.DATABASE[key].rows()
+        rows[0][4] = (rows[0][4] or 0) + 1
+        bot.DATABASE[key] = bot.Board(rows)
+        await bot.update_data_and_update_time(key)
+    results.append(result('update_data_and_update_time', scale, await atimed(persist, max(10, repeat//5))))
+
+    #One tracker tick with every entry due
+    count = 8*scale
+    async def tick():
+        bot.TRACKING_LIST = bot.TrackerQueue(scale_tracking(database, count, time.time()))
+        await bot.post_due_entries()
+    bot.CHANNELS = FakeChannels()
+    ticks = max(3, repeat//50)
+    samples = await atimed(tick, ticks)
+    sent = sum(c.sent for c in bot.CHANNELS.channels.values())
+    results.append(result('check_update_queue', scale, samples, tracked=count, messages=sent//ticks))
+    return results
+
+
+def bench_memory(bot, base, scale):
+    #Memory and decode time of the boards kept as lists and as Boards
+    text = json.dumps(scale_database(base, scale))
+    results = []
+    for name, load in [
+        ('boards_as_lists', json.loads),
+        ('boards_as_columns', lambda t: {k: bot.Board(v) for k, v in json.loads(t).items()}),
+    ]:
+        samples = timed(lambda: load(text), 3)
+        #Traced separately, tracemalloc slows down every allocation
+        tracemalloc.start()
+        boards = load(text)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.append(result(name, scale, samples, resident_kb=size//1024, boards=len(boards)))
+        del boards
+
+    #Boards read back from the database, with what Storage keeps to notice
+    #changes
+    from storage import Storage
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, 'memory.db'))
+        for key, rows in json.loads(text).items():
+            storage.save_board(key, rows)
+        storage.saved_boards.clear()
+        samples = timed(storage.load_boards, 3)
+        storage.saved_boards.clear()
+        tracemalloc.start()
+        boards = storage.load_boards()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.append(result('storage_load_boards', scale, samples, resident_kb=size//1024, boards=len(boards)))
+        del boards
+        storage.close()
+    return results
+
+
+async def bench_crawler(bot, base, repeat):
+    import stub_server
+    results = []
+    runner = await stub_server.start(base, port=STUB_PORT)
+    try:
+        keys = sorted(base)[:8]
+        async def full():
+            bot.DATABASE.clear()
+            bot.CRAWLER.page_counts.clear()
+            await asyncio.gather(*[bot.get_data(*k.split('-')) for k in keys])
+        before = dict(bot.CRAWLER.stats)
+        samples = await atimed(full, max(3, repeat//50))
+        pages = bot.CRAWLER.stats['pages_fetched'] - before['pages_fetched']
+        results.append(result('get_data_full', 1, samples, boards=len(keys), pages=pages))
+
+        set_database(bot, base)
+        async def adaptive():
+            await asyncio.gather(*[bot.get_data(*k.split('-')) for k in keys])
+        before = dict(bot.CRAWLER.stats)
+        samples = await atimed(adaptive, max(3, repeat//50))
+        pages = bot.CRAWLER.stats['pages_fetched'] - before['pages_fetched']
+        results.append(result('get_data_adaptive', 1, samples, boards=len(keys), pages=pages))
+    finally:
+        await bot.CRAWLER.close()
+        await runner.cleanup()
+    return results
+
+
+def saved_days():
+    #{day: path} of the old full-copy backups, or {day: None} when Backup/
+    #was already moved to a BackupStore
+    from backups import BackupStore
+    days = {}
+    for fname in glob.glob(os.path.join(HERE, 'Backup', '*.json')):
+        days[os.path.basename(fname)[:-len('.json')]] = fname
+    for day in BackupStore(os.path.join(HERE, 'Backup')).days():
+        days.setdefault(day, None)
+    return dict(sorted(days.items()))
+
+
+def bench_history(bot, repeat):
+    from history import RankHistory
+    from backups import BackupStore
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        #Backs up the saved days again in a fresh store, against the size of
+        #a full copy per day
+        saved = BackupStore(os.path.join(HERE, 'Backup'))
+        backups = BackupStore(os.path.join(tmp, 'Backup'))
+        samples = []
+        full = 0
+        for day, fname in saved_days().items():
+            if fname is None:
+                database = saved.load(day)
+            else:
+                with open(fname, 'r') as f:
+                    database = json.load(f)
+            full += len(json.dumps(database, default=list))
+            start = time.perf_counter()
+            backups.snapshot(database, day)
+            samples.append(time.perf_counter() - start)
+        objects, stored = backups.usage()
+        results.append(result(
+            'backup_snapshot', 1, samples,
+            full_copy_bytes=full, stored_bytes=stored, objects=objects,
+        ))
+
+        history = RankHistory(os.path.join(tmp, 'history.db'))
+        start = time.perf_counter()
+        days = history.import_backups(backups)
+        results.append(result('history_import', 1, [time.perf_counter() - start], days=days))
+
+        with history.lock:
+            books = [b for b, in history.conn.execute('SELECT book_id FROM history_titles')]
+        ids = iter(books*repeat)
+        samples = timed(lambda: history.query(next(ids), 0, 2**40), repeat)
+        results.append(result('history_query', 1, samples, books=len(books)))
+        history.close()
+    return results
+
+
+#------------------------------------------------------------------------------
+async def main(args):
+    os.chdir(HERE)
+    scales = [int(s) for s in args.scales.split(',')]
+    with tempfile.TemporaryDirectory() as tmp:
+        with contextlib.redirect_stdout(sys.stderr):
+            bot = load_bot(os.path.join(tmp, 'bench.db'))
+            base = {k: [list(r) for r in v] for k, v in bot.DATABASE.items()}
+            results = []
+            for scale in scales:
+                results += await bench_scale(bot, base, scale, args.repeat)
+                results += bench_memory(bot, base, scale)
+            results += await bench_crawler(bot, base, args.repeat)
+            results += bench_history(bot, args.repeat)
+            bot.STORAGE.close()
+
+    lines = [json.dumps(r) for r in results]
+    print('\n'.join(lines))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the bot hot paths.')
+    parser.add_argument('--scales', default='1,10,100', help='Comma separated scale factors.')
+    parser.add_argument('--repeat', type=int, default=200, help='Iterations per benchmark.')
+    parser.add_argument('--output', default='', help='Also write the JSON lines to this file.')
+    asyncio.run(main(parser.parse_args()))
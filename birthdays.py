@@ -0,0 +1,121 @@
+import calendar
+import datetime
+import zoneinfo
+from collections import Counter
+
+ANNOUNCE_HOUR = 6 #local time of the guild
+
+
+#------------------------------------------------------------------------------
+def get_timezone(name):
+    #tzinfo for an IANA name like 'Asia/Manila', None if it's not known
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+#------------------------------------------------------------------------------
+class BirthdayCalendar:
+    '''
+    Birthdays indexed by (month, day), each guild announcing at
+    ANNOUNCE_HOUR in its own timezone.
+
+    Entries keep the BIRTHDAY_LIST layout, (mm, dd, yyyy, name, id,
+    channel). Finding the next announcement only looks at the days and
+    timezones that have birthdays, and an announcement only touches the
+    entries of that day.
+    '''
+    def __init__(self, default_tz=None):
+        self.default_tz = default_tz or datetime.datetime.now().astimezone().tzinfo
+        self.entries = {} #(guild, member): entry
+        self.days = {} #(month, day): set of (guild, member)
+        self.guilds = Counter() #guild: number of birthdays
+        self.timezones = {} #guild: tz name
+        self.zones = {} #tz name: tzinfo
+
+    def build(self, birthday_list, timezones=None):
+        self.entries = {}
+        self.days = {}
+        self.guilds = Counter()
+        for guild, tz in (timezones or {}).items():
+            self.set_timezone(guild, tz)
+        for guild, entries in birthday_list.items():
+            for entry in entries:
+                self.add(guild, entry)
+
+    def add(self, guild, entry):
+        #Adds or replaces the birthday of a member
+        guild = str(guild)
+        member = entry[4]
+        self.remove(guild, member)
+        self.entries[(guild, member)] = entry
+        self.guilds[guild] += 1
+        self.days.setdefault((int(entry[0]), int(entry[1])), set()).add((guild, member))
+
+    def remove(self, guild, member):
+        entry = self.entries.pop((str(guild), member), None)
+        if entry is None:
+            return None
+        self.guilds[str(guild)] -= 1
+        if not self.guilds[str(guild)]:
+            del self.guilds[str(guild)]
+        day = (int(entry[0]), int(entry[1]))
+        ids = self.days[day]
+        ids.discard((str(guild), member))
+        if not ids:
+            del self.days[day]
+        return entry
+
+    def set_timezone(self, guild, name):
+        tz = get_timezone(name)
+        if tz is None:
+            raise ValueError(f"Unknown timezone: {name}")
+        self.zones[name] = tz
+        self.timezones[str(guild)] = name
+
+    def timezone(self, guild):
+        name = self.timezones.get(str(guild))
+        return self.default_tz if name is None else self.zones[name]
+
+    def __len__(self):
+        return len(self.entries)
+
+    #--------------------------------------------------------------------------
+    def on_day(self, date):
+        #(guild, entry) of the birthdays celebrated on the date, any timezone
+        ids = set(self.days.get((date.month, date.day), ()))
+        #Feb 29 birthdays are celebrated on Feb 28 in common years
+        if (date.month, date.day) == (2, 28) and not calendar.isleap(date.year):
+            ids |= self.days.get((2, 29), set())
+        return [(guild, self.entries[(guild, member)]) for guild, member in ids]
+
+    def next_announcement(self, now):
+        #(aware datetime, [(guild, entry)]) of the earliest announcement
+        #strictly after now, or None if there are no birthdays
+        if not self.entries:
+            return None
+        best = None
+        zones = {self.timezone(guild) for guild in self.guilds}
+        for tz in zones:
+            local = now.astimezone(tz)
+            date = local.date()
+            if local.replace(tzinfo=None) >= datetime.datetime.combine(date, datetime.time(ANNOUNCE_HOUR)):
+                date += datetime.timedelta(days=1)
+            #A year and a day covers Feb 29
+            for _ in range(367):
+                when = datetime.datetime.combine(date, datetime.time(ANNOUNCE_HOUR), tzinfo=tz)
+                if best is not None and when > best[0]:
+                    break
+                found = [
+                    (guild, entry) for guild, entry in self.on_day(date)
+                    if self.timezone(guild) == tz
+                ]
+                if found:
+                    if best is not None and when == best[0]:
+                        best[1].extend(found)
+                    else:
+                        best = (when, found)
+                    break
+                date += datetime.timedelta(days=1)
+        return best
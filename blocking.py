@@ -0,0 +1,84 @@
+import sys
+import time
+import asyncio
+import datetime
+import functools
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import METRICS
+
+#Threads for the file, SQLite and other calls that would block the loop
+BLOCKING_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='blocking')
+
+
+#------------------------------------------------------------------------------
+async def offload(fn, *args, **kwargs):
+    #Runs a blocking call in BLOCKING_POOL and waits for it without blocking
+    #the event loop
+    loop = asyncio.get_running_loop()
+    with METRICS.timer('offload_seconds', call=fn.__name__):
+        return await loop.run_in_executor(
+            BLOCKING_POOL, functools.partial(fn, *args, **kwargs)
+        )
+
+
+#------------------------------------------------------------------------------
+class StallWatchdog:
+    '''
+    Detects event loop stalls from outside the loop.
+
+    A task on the loop writes a heartbeat every interval, a daemon thread
+    checks it and when the heartbeat is older than threshold, logs the
+    stack of the loop thread, i.e. whatever call is blocking it.
+    '''
+    def __init__(self, threshold=0.5, interval=0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.beat = time.monotonic()
+        self.loop_thread = None
+        self.stalls = 0
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        #Must be called from a coroutine running on the watched loop
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, name='stall-watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def heartbeat(self):
+        while True:
+            self.beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def watch(self):
+        reported = None #heartbeat of the stall that was already logged
+        while not self.stopped.wait(self.interval):
+            beat = self.beat
+            lag = time.monotonic() - beat
+            if lag < self.threshold:
+                if reported is not None:
+                    self.log(f"Event loop resumed after {time.monotonic() - reported:.2f}s")
+                    reported = None
+                continue
+            if reported == beat:
+                continue
+            reported = beat
+            self.stalls += 1
+            METRICS.inc('event_loop_stalls_total')
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame else 'No stack\n'
+            self.log(f"Event loop blocked for {lag:.2f}s in:\n{stack}")
+
+    def log(self, msg):
+        print(datetime.datetime.now(), msg, flush=True)
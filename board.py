@@ -0,0 +1,110 @@
+import threading
+from array import array
+
+MISSING = -2**63 #stored in place of None in the numeric columns
+
+
+#------------------------------------------------------------------------------
+class Interner:
+    #Table of values shared by every board, a value is stored once and the
+    #boards only keep its index
+    def __init__(self):
+        self.index = {} #value: index
+        self.values = []
+        self.lock = threading.Lock() #boards are also decoded in threads
+
+    def add(self, value):
+        i = self.index.get(value)
+        if i is None:
+            with self.lock:
+                i = self.index.get(value)
+                if i is None:
+                    self.values.append(value)
+                    i = self.index[value] = len(self.values) - 1
+        return i
+
+    def __len__(self):
+        return len(self.values)
+
+
+BOOK_IDS = Interner()
+TITLES = Interner()
+
+
+def numbers(values):
+    try:
+        return array('q', values)
+    except TypeError:
+        return array('q', [MISSING if v is None else v for v in values])
+
+
+#------------------------------------------------------------------------------
+class Board:
+    '''
+    Compact snapshot of a ranking board.
+
+    Rows are kept as columns, rankNo/coverUpdateTime/amount as arrays of
+    machine integers, and bookId/bookName as indexes into the shared
+    BOOK_IDS and TITLES tables. Reading it still gives rows in the JSON
+    layout, [rankNo, bookId, coverUpdateTime, bookName, amount], so
+    json.dumps(board, default=list) writes the same text as the list did.
+    Boards are never changed in place, a refresh makes a new one.
+    '''
+    __slots__ = ('ranks', 'books', 'covers', 'titles', 'amounts')
+
+    def __init__(self, rows=()):
+        if isinstance(rows, Board):
+            for name in self.__slots__:
+                setattr(self, name, getattr(rows, name))
+            return
+        #One column at a time is much faster than appending row by row
+        ranks, books, covers, titles, amounts = list(zip(*rows)) or [()]*5
+        self.ranks = numbers(ranks)
+        self.books = array('i', map(BOOK_IDS.add, books))
+        self.covers = numbers(covers)
+        self.titles = array('i', map(TITLES.add, titles))
+        self.amounts = numbers(amounts)
+
+    def row(self, i):
+        rankNo, updateId, amount = self.ranks[i], self.covers[i], self.amounts[i]
+        return [
+            None if rankNo == MISSING else rankNo,
+            BOOK_IDS.values[self.books[i]],
+            None if updateId == MISSING else updateId,
+            TITLES.values[self.titles[i]],
+            None if amount == MISSING else amount,
+        ]
+
+    def rows(self):
+        #The board in the JSON layout
+        return [self.row(i) for i in range(len(self.ranks))]
+
+    def __len__(self):
+        return len(self.ranks)
+
+    def __iter__(self):
+        for i in range(len(self.ranks)):
+            yield self.row(i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(n) for n in range(*i.indices(len(self.ranks)))]
+        if i < 0:
+            i += len(self.ranks)
+        if not 0 <= i < len(self.ranks):
+            raise IndexError('board row out of range')
+        return self.row(i)
+
+    def __eq__(self, other):
+        if isinstance(other, Board):
+            return all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+        if isinstance(other, list):
+            return self.rows() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f'Board({len(self)} rows)'
+
+    def nbytes(self):
+        #Memory held by the columns, the shared tables are not counted
+        return sum(a.itemsize*len(a) for a in (getattr(self, n) for n in self.__slots__))
@@ -0,0 +1,109 @@
+import time
+import itertools
+
+#Values of each part of a board key,
+#category-time_type-time_range-content-contract-sex
+LIST_TYPES = ('5', '4', '3', '2', '0') #monthly, season, bi-annual, annual, all time
+TIME_RANGES = ('5', '3', '4', '1') #24h, weekly, monthly, overall
+CONTENTS = ('0', '1', '2') #all, translated, original
+CONTRACTS = ('1', '0') #contracted, all
+SEXES = ('1', '2') #male, female
+DEAD_RECHECK = 24*3600 #boards that came back empty are only tried again after this
+
+
+#------------------------------------------------------------------------------
+def canonical(category, time_type, time_range, content, contract, sex):
+    #The key of the board Webnovel really serves for these options, the
+    #options a board doesn't have are folded into the one it uses
+    if category == 'power_rank':
+        #Power has no 24h range
+        if time_range == '5':
+            time_range = '3'
+    else:
+        #signStatus is only sent for Power, the rest are always contracted
+        contract = '1'
+        if category != 'best_sellers':
+            #Only Trending has the time types and the 24h range
+            time_type = '0'
+            if time_range not in TIME_RANGES or time_range == '5':
+                time_range = '3'
+    return f"{category}-{time_type}-{time_range}-{content}-{contract}-{sex}"
+
+
+#------------------------------------------------------------------------------
+class CatalogEntry:
+    __slots__ = ('key', 'category', 'rank_name', 'pages', 'refreshed')
+
+    def __init__(self, key, rank_name):
+        self.key = key
+        self.category = key.split('-')[0]
+        self.rank_name = rank_name
+        self.pages = None #non-empty pages at the last crawl, None if never crawled
+        self.refreshed = 0 #timestamp of the last refresh
+
+    def __repr__(self):
+        return f'CatalogEntry({self.key}, pages={self.pages})'
+
+
+class BoardCatalog:
+    '''
+    Every valid board key, enumerated once.
+
+    A key is valid when it's the canonical() form of its options, so the
+    combinations that only repeat another board (or that Webnovel doesn't
+    have) are never crawled. Each entry keeps the rank name, the number of
+    pages of its last crawl and when it was refreshed. Boards that came back
+    empty are skipped until DEAD_RECHECK has passed.
+    '''
+    def __init__(self, rank_names):
+        self.entries = {}
+        for category, rank_name in rank_names.items():
+            for options in itertools.product(LIST_TYPES, TIME_RANGES, CONTENTS, CONTRACTS, SEXES):
+                key = canonical(category, *options)
+                if key not in self.entries:
+                    self.entries[key] = CatalogEntry(key, rank_name)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def note_refresh(self, key, pages=None, timestamp=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry.refreshed = time.time() if timestamp is None else timestamp
+        if pages is not None:
+            entry.pages = pages
+
+    def dead(self, key, now=None):
+        #Came back empty on its last crawl, not long ago
+        entry = self.entries.get(key)
+        if entry is None or entry.pages != 0:
+            return False
+        now = time.time() if now is None else now
+        return now - entry.refreshed < DEAD_RECHECK
+
+    def schedulable(self, keys, now=None):
+        #The keys the refresher should look at, invalid and dead ones dropped
+        now = time.time() if now is None else now
+        return {k for k in keys if k in self.entries and not self.dead(k, now)}
+
+    def counts(self, now=None):
+        #(valid, crawled, dead) boards
+        now = time.time() if now is None else now
+        crawled = sum(e.pages is not None for e in self.entries.values())
+        dead = sum(self.dead(k, now) for k in self.entries)
+        return len(self.entries), crawled, dead
+
+    def search(self, current, limit=25):
+        #Keys containing the typed text, for autocomplete
+        current = current.lower()
+        return [k for k in self.entries if current in k][:limit]
@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+
+import discord
+
+
+#------------------------------------------------------------------------------
+class ChannelCache:
+    '''
+    Resolves channel ids without a REST call whenever possible.
+
+    The gateway cache (client.get_channel) is tried first, then a TTL/LRU
+    cache of channels fetched before, and only then client.fetch_channel.
+    Channels that were deleted or hidden from the bot are remembered for
+    `missing_ttl` seconds, so a dead channel costs one REST call instead
+    of one per tick.
+    '''
+    def __init__(self, client, ttl=3600, maxsize=1024, missing_ttl=600):
+        self.client = client
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.missing_ttl = missing_ttl
+        self.cache = OrderedDict() #channel id: (fetch timestamp, channel)
+        self.missing = OrderedDict() #channel id: (fetch timestamp, NotFound/Forbidden)
+        self.stats = {'hits': 0, 'misses': 0, 'api_calls': 0}
+
+    async def resolve(self, cid):
+        cid = int(cid)
+        channel = self.client.get_channel(cid)
+        if channel is not None:
+            self.stats['hits'] += 1
+            return channel
+
+        item = self.cache.get(cid)
+        if item is not None:
+            fetched, channel = item
+            if time.time() - fetched < self.ttl:
+                self.cache.move_to_end(cid)
+                self.stats['hits'] += 1
+                return channel
+            del self.cache[cid]
+
+        item = self.missing.get(cid)
+        if item is not None:
+            fetched, error = item
+            if time.time() - fetched < self.missing_ttl:
+                self.stats['hits'] += 1
+                raise error.with_traceback(None)
+            del self.missing[cid]
+
+        self.stats['misses'] += 1
+        self.stats['api_calls'] += 1
+        try:
+            channel = await self.client.fetch_channel(cid)
+        except (discord.NotFound, discord.Forbidden) as e:
+            self.missing[cid] = (time.time(), e)
+            if len(self.missing) > self.maxsize:
+                self.missing.popitem(last=False)
+            raise
+        self.cache[cid] = (time.time(), channel)
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return channel
+
+    def invalidate(self, cid):
+        self.cache.pop(int(cid), None)
@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import tempfile
+
+#python cluster.py [--shards 3] [--seconds 60]
+#Runs the sharded layout locally without Discord: stub_server.py as the
+#ranking endpoint, one ROLE=crawler process and --shards ROLE=shard
+#processes sharing one SQLite file. The shard processes post to printing
+#stand-ins for the Discord channels, shard n owns the tracked channels with
+#channel % shards == n. Rows of the stub boards are shuffled every few
+#seconds so there's something to publish.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STUB_PORT = 8798
+
+
+#------------------------------------------------------------------------------
+class PrintChannel:
+    def __init__(self, shard, cid):
+        self.shard = shard
+        self.id = cid
+
+    async def send(self, *args, embeds=(), **kwargs):
+        titles = [e.description.split('\n')[0] for e in embeds]
+        print(f"shard {self.shard} -> channel {self.id}:", ', '.join(titles), flush=True)
+
+
+class PrintChannels:
+    #Stands in for the ChannelCache so no Discord connection is needed
+    def __init__(self, shard):
+        self.shard = shard
+
+    async def resolve(self, cid):
+        return PrintChannel(self.shard, cid)
+
+    def invalidate(self, cid):
+        pass
+
+
+async def run_shard(shard, shards):
+    #Child process, a ROLE=shard bot without the Discord login
+    sys.path.insert(0, HERE)
+    import new_wn_rankerbot as bot
+    bot.CHANNELS = PrintChannels(shard)
+    bot.owns_entry = lambda values: values[1] % shards == shard
+    bot.follow_boards.start()
+    bot.check_update_queue.start()
+    await bot.start_background()
+    if shard == 0:
+        #A board nobody stored yet, it has to come from the crawler
+        key = bot.build_key('power_rank', '0', '1', '2', '1', '2')
+        board = await bot.refresh_board(key)
+        print(f"shard {shard} got {key} from the crawler:",
+              None if board is None else f"{len(board)} rows", flush=True)
+    await asyncio.Event().wait()
+
+
+#------------------------------------------------------------------------------
+async def relay(name, proc, ready=None):
+    #Prefixes the output of a child process
+    async for line in proc.stdout:
+        text = line.decode(errors='replace').rstrip()
+        print(f"[{name}] {text}", flush=True)
+        if ready is not None and 'Crawling for the shard processes' in text:
+            ready.set()
+
+
+async def shuffle_boards(database, every=3):
+    while True:
+        await asyncio.sleep(every)
+        rows = database[random.choice(sorted(database))]
+        moved = rows[:20]
+        random.shuffle(moved)
+        for n, row in enumerate(moved):
+            row[0] = n + 1
+        rows[:20] = moved
+
+
+async def main(args):
+    import stub_server
+    with open(os.path.join(HERE, 'RANKING_DATA.json'), 'r') as f:
+        database = json.load(f)
+    #power_rank-0-1-2-1-2 is only served, so the crawler has to fetch it
+    database['power_rank-0-1-2-1-2'] = [list(r) for r in database['power_rank-0-1-2-1-1']]
+    runner = await stub_server.start(database, port=STUB_PORT)
+    shuffler = asyncio.create_task(shuffle_boards(database))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        for name in ('AI_ID', 'OWNER_ID', 'SERVER_ID'):
+            env.setdefault(name, '0')
+        env.setdefault('CSRFTOKEN', 'cluster')
+        env.update(
+            DB_PATH=os.path.join(tmp, 'cluster.db'),
+            WN_BASE_URL=f'http://127.0.0.1:{STUB_PORT}',
+            UPDATE_DELAY=str(args.update_delay),
+            SHARD_COUNT=str(args.shards),
+            PYTHONUNBUFFERED='1',
+        )
+        procs = []
+        relays = []
+        ready = asyncio.Event()
+        crawler = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(HERE, 'new_wn_rankerbot.py'),
+            cwd=HERE, env=dict(env, ROLE='crawler'),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        )
+        procs.append(crawler)
+        relays.append(asyncio.create_task(relay('crawler', crawler, ready)))
+        await asyncio.wait_for(ready.wait(), timeout=60)
+
+        for shard in range(args.shards):
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__),
+                '--shard', str(shard), '--shards', str(args.shards),
+                cwd=HERE, env=dict(env, ROLE='shard', SHARD_IDS=str(shard)),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            )
+            procs.append(proc)
+            relays.append(asyncio.create_task(relay(f'shard {shard}', proc)))
+
+        try:
+            await asyncio.sleep(args.seconds)
+        finally:
+            for proc in procs:
+                if proc.returncode is None:
+                    proc.terminate()
+            await asyncio.gather(*[p.wait() for p in procs])
+            await asyncio.gather(*relays, return_exceptions=True)
+            shuffler.cancel()
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a crawler and shard processes locally.')
+    parser.add_argument('--shards', type=int, default=3, help='Number of shard processes.')
+    parser.add_argument('--seconds', type=float, default=60, help='How long to run.')
+    parser.add_argument('--update-delay', type=int, default=60, help='UPDATE_DELAY of the crawler.')
+    parser.add_argument('--shard', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.shard is not None:
+        asyncio.run(run_shard(args.shard, args.shards))
+    else:
+        asyncio.run(main(args))
@@ -0,0 +1,376 @@
+import os
+import time
+import random
+import asyncio
+import datetime
+import email.utils
+import urllib.parse
+
+import aiohttp
+
+from metrics import METRICS
+
+#Base url can be pointed to a local stub server for testing
+BASE_URL = os.getenv("WN_BASE_URL", 'https://www.webnovel.com')
+RANK_PATH = '/go/pcm/category/getRankList'
+KEEP_DATA = ['rankNo', 'bookId', 'coverUpdateTime', 'bookName', 'amount']
+MAX_PAGES = 10
+FULL_CRAWL_EVERY = 4 #Crawl every page after this many refreshes cut short
+BACKOFF_BASE = 1.0 #seconds, doubled on every retry
+BACKOFF_CAP = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+#------------------------------------------------------------------------------
+class CircuitOpen(Exception):
+    #Raised instead of sending requests to a host that keeps failing
+    pass
+
+
+#------------------------------------------------------------------------------
+def backoff(n, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    #Full jitter, a random wait of up to base*2**n seconds
+    return random.uniform(0, min(cap, base*2**n))
+
+
+def retry_after(value, cap=BACKOFF_CAP*10):
+    #Seconds asked for by a Retry-After header, either seconds or a date
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(cap, max(0.0, seconds))
+
+
+#------------------------------------------------------------------------------
+class CircuitBreaker:
+    '''
+    Stops requests to a host after `threshold` failures in a row, or at once
+    for failures that retrying can't fix (captcha). After `cooldown` seconds
+    a single request is let through, its success closes the breaker and its
+    failure opens it again for twice as long, up to `max_cooldown`.
+    '''
+    def __init__(self, host, threshold=5, cooldown=300, max_cooldown=3600):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.trips = 0 #times opened in a row
+        self.open_until = 0.0
+        self.probing = 0.0 #when the probe request started
+
+    @property
+    def state(self):
+        if self.open_until > time.time():
+            return 'open'
+        return 'half-open' if self.trips else 'closed'
+
+    def allow(self):
+        state = self.state
+        if state == 'open':
+            return False
+        if state == 'half-open':
+            #Only one request at a time probes the host, unless the probe
+            #never reported back
+            if time.time() - self.probing < 60:
+                return False
+            self.probing = time.time()
+        return True
+
+    def success(self):
+        if self.trips:
+            print(datetime.datetime.now(), "Circuit closed for", self.host)
+        self.failures = 0
+        self.trips = 0
+        self.probing = 0.0
+
+    def failure(self, trip=False, wait=None):
+        #trip opens the breaker right away, wait overrides the cooldown
+        self.failures += 1
+        self.probing = 0.0
+        if not (trip or self.trips or self.failures >= self.threshold):
+            return
+        if wait is None:
+            wait = min(self.max_cooldown, self.cooldown*2**self.trips)
+        self.trips += 1
+        self.failures = 0
+        self.open_until = max(self.open_until, time.time() + wait)
+        METRICS.inc('wn_breaker_trips_total', host=self.host)
+        print(datetime.datetime.now(), f"Circuit open for {self.host}, next try in {wait:.0f}s")
+
+
+#------------------------------------------------------------------------------
+def get_link(
+    csrfToken=None, #token used, probably refreshes after certain time passes
+    pageIndex=1, #Page index from 1 to 10
+    rankId='best_sellers', #Rank ID, specific to rankings
+    listType=0, #
+    noType=1, #Novel=1, Fanfic=4, or Comic=2
+    rankName='Trending', #Rank Name, specific to each RankId
+    timeType=3, #24hr=5, weekly=3, monthly=4, all-time=1
+    sourceType=2, #all=0, translated=1, original=2
+    sex=1, #male=1, female=2
+    signStatus=1, #Contracted or not
+    base_url=BASE_URL,
+    ):
+    items = [f'pageIndex={pageIndex}', f'rankId={rankId}', f'listType={listType}', f'type={noType}', f'rankName={rankName}',
+             f'timeType={timeType}', f'sourceType={sourceType}', f'sex={sex}']
+
+    if rankName == 'Power':
+        items += [f'signStatus={signStatus}',]
+
+    random.shuffle(items)
+    path = f"{RANK_PATH}?_csrfToken={csrfToken}&" + '&'.join(items)
+    url = base_url + path
+    headers = get_headers(path, csrfToken)
+    return url, headers
+
+
+#------------------------------------------------------------------------------
+def get_headers(path, csrfToken=None):
+    headers = {'authority': 'www.webnovel.com', 'method': 'GET', 'scheme': 'https', 'Accept': 'application/json, text/javascript, */*; q=0.01', 'Accept-Encoding': 'gzip, deflate, br, zstd', 'Accept-Language': 'en-US,en;q=0.9',
+               'Cookie': f'webnovel-language=en; webnovel-content-language=en; bookCitysex=1; show_gift_tip=1; para-comment-tip-show=1; show_lib_tip=1; QDReport_utm=utm_source%3DnoahActivity; __zlcmid=1LImeDfz2451vVV; NEXT_LOCALE=en; wn_show_first_charge_modal=; charge_selected_payments=paypal; _csrfToken={csrfToken}; uid=4300026489; ukey=uXnz1f67uhq; webnovel_uuid=1719526890_1946123745; _fsae=1719580024477; checkInTip=1; e2=%7B%22pid%22%3A%22bookstore%22%2C%22l1%22%3A%2299%22%7D; e1=%7B%22pid%22%3A%22bookstore%22%2C%22l1%22%3A%221%22%2C%22eid%22%3A%22qi_A_home_rankingshoverclick%22%7D',
+               'Priority': 'u=1, i', 'Referer': 'https://www.webnovel.com/ranking/novel/all_time/best_sellers', 'Sec-Ch-Ua': '"Not/A)Brand";v="8", "Chromium";v="126", "Google Chrome";v="126"', 'Sec-Ch-Ua-Mobile': '?0', 'Sec-Ch-Ua-Platform': '"Windows"', 'Sec-Fetch-Dest': 'empty', 'Sec-Fetch-Site': 'same-origin', 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36', 'X-Requested-With': 'XMLHttpRequest'}
+    headers['path'] = path
+
+    return headers
+
+
+#------------------------------------------------------------------------------
+class RankCrawler:
+    '''
+    Asynchronous crawler for the ranking boards.
+
+    A single keep-alive session is shared by every request, and the number
+    of requests in flight at any time is capped by `concurrency`. Failed
+    pages are retried with jittered exponential backoff, and a circuit
+    breaker per host stops crawling while the host keeps failing.
+
+    When the previous snapshot of a board is given, the first page is
+    compared with it and the crawl stops there if nothing moved. The number
+    of pages each board really has is learned so empty trailing pages are
+    not requested.
+    '''
+    def __init__(self, csrfToken=None, concurrency=4, base_url=BASE_URL,
+                 retries=3, timeout=30):
+        self.csrfToken = csrfToken
+        self.concurrency = concurrency
+        self.base_url = base_url
+        self.retries = retries
+        self.timeout = timeout
+        self.session = None
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.breakers = {} #host: CircuitBreaker
+        self.page_counts = {} #board: number of non-empty pages
+        self.short_crawls = {} #board: refreshes cut short since the last full crawl
+        #pages_baseline is what crawling pages 1-10 until the first empty
+        #page would have cost, to compare against pages_fetched
+        self.stats = {'refreshes': 0, 'stable': 0, 'pages_fetched': 0, 'pages_baseline': 0}
+
+    async def get_session(self):
+        #Create the pooled session lazily, it must be made inside the loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency, keepalive_timeout=60,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.session
+
+    def breaker(self, host=None):
+        host = host or urllib.parse.urlsplit(self.base_url).netloc
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(host)
+        return self.breakers[host]
+
+    def available(self):
+        #False while requests to the host are being held back
+        return self.breaker().state != 'open'
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def fetch_page(self, pageIndex, rankId, rankName, listType,
+                         timeType, sourceType, signStatus, sex):
+        #Returns the kept rows of a single page, an empty list means the
+        #board has no more pages, and None means the page failed.
+        #Raises CircuitOpen while the breaker holds requests back.
+        session = await self.get_session()
+        breaker = self.breaker()
+        for n in range(self.retries):
+            if not breaker.allow():
+                raise CircuitOpen(f"Not crawling {breaker.host} for now, serving saved data")
+            url, headers = get_link(
+                csrfToken=self.csrfToken,
+                listType=listType,
+                pageIndex=pageIndex,
+                rankId=rankId,
+                rankName=rankName,
+                timeType=timeType,
+                sourceType=sourceType,
+                sex=sex,
+                signStatus=signStatus,
+                base_url=self.base_url,
+            )
+            if n:
+                METRICS.inc('wn_page_retries_total')
+            wait = None
+            try:
+                async with self.semaphore:
+                    with METRICS.timer('wn_page_fetch_seconds'):
+                        async with session.get(url, headers=headers) as response:
+                            status = response.status
+                            METRICS.inc('wn_page_requests_total', status=status)
+                            if status == 200:
+                                try:
+                                    data = await response.json(content_type=None)
+                                except ValueError:
+                                    METRICS.inc('wn_captcha_failures_total')
+                                    breaker.failure(trip=True)
+                                    print("ERROR! Need Verification Captcha!", response)
+                                    raise ValueError("Crawler received a non-JSON status_code 200 response! Need verification!")
+                            else:
+                                wait = retry_after(response.headers.get('Retry-After'))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+                METRICS.inc('wn_page_requests_total', status=status)
+
+            if status == 200:
+                breaker.success()
+                return [[i[j] for j in KEEP_DATA] for i in data['data']['bookItems']]
+            print(f"Failed to fetch page {pageIndex}. Status code: {status}", "retries:", n)
+            if status == 429:
+                #Throttled, hold back every request to the host as asked
+                breaker.failure(trip=True, wait=wait)
+            else:
+                breaker.failure()
+            if status not in RETRY_STATUSES and isinstance(status, int):
+                break
+            if n + 1 < self.retries and breaker.state != 'open':
+                await asyncio.sleep(wait if wait is not None else backoff(n))
+        return None
+
+    async def fetch_board(self, rankId, rankName, listType, timeType,
+                          sourceType, signStatus, sex, pages=MAX_PAGES,
+                          previous=None):
+        key = '-'.join((rankId, listType, timeType, sourceType, signStatus, sex))
+        with METRICS.timer('wn_board_fetch_seconds', key=key):
+            return await self.crawl_board(
+                rankId, rankName, listType, timeType, sourceType, signStatus,
+                sex, pages, previous
+            )
+
+    async def crawl_board(self, rankId, rankName, listType, timeType,
+                          sourceType, signStatus, sex, pages, previous):
+        print(datetime.datetime.now(), "Getting new data!", rankId, listType, timeType, sourceType, sex, signStatus)
+        board = (rankId, listType, timeType, sourceType, signStatus, sex)
+        args = (rankId, rankName, listType, timeType, sourceType, signStatus, sex)
+        first = await self.fetch_page(1, *args)
+        if first is None:
+            return None
+        if not len(first):
+            self.learn(board, 0, 1)
+            return []
+
+        #Stop if the top page matches the previous snapshot
+        size = len(first)
+        short = self.short_crawls.get(board, 0)
+        if previous and short < FULL_CRAWL_EVERY and same_rows(first, previous[:size]):
+            self.short_crawls[board] = short + 1
+            self.stats['stable'] += 1
+            known = self.page_counts.get(board, -(-len(previous) // size))
+            self.learn(board, known, 1)
+            return previous
+        self.short_crawls[board] = 0
+
+        #Only ask for the pages the board is known to have, plus one more
+        #if the last of them was full
+        known = self.page_counts.get(board)
+        if known is None and previous:
+            known = -(-len(previous) // size)
+        if known is None:
+            last = pages
+        else:
+            last = known + (len(previous or []) >= known*size)
+        last = min(pages, max(1, last))
+
+        results = [first] + await asyncio.gather(*[
+            self.fetch_page(n, *args) for n in range(2, last + 1)
+        ])
+        #The board grew past the known pages, keep going one page at a time
+        while results[-1] and len(results[-1]) >= size and len(results) < pages:
+            results.append(await self.fetch_page(len(results) + 1, *args))
+
+        rank_data = []
+        count = 0
+        for page in results:
+            if page is None:
+                return None
+            #if page is blank, that means ranking list is complete
+            if not len(page):
+                break
+            rank_data += page
+            count += 1
+        self.learn(board, count, len(results))
+        return rank_data
+
+    def learn(self, board, count, fetched):
+        self.page_counts[board] = count
+        self.stats['refreshes'] += 1
+        self.stats['pages_fetched'] += fetched
+        self.stats['pages_baseline'] += min(MAX_PAGES, count + 1)
+        METRICS.inc('wn_pages_fetched_total', fetched)
+        METRICS.inc('wn_pages_baseline_total', min(MAX_PAGES, count + 1))
+        print(datetime.datetime.now(), "Pages fetched:", fetched,
+              "of", min(MAX_PAGES, count + 1), "| board:", '-'.join(board))
+
+    async def fetch_boards(self, boards):
+        #boards is a list of argument tuples accepted by fetch_board
+        return await asyncio.gather(
+            *[self.fetch_board(*b) for b in boards],
+            return_exceptions=True,
+        )
+
+
+#------------------------------------------------------------------------------
+def same_rows(page, rows):
+    #Same books in the same order with the same amounts
+    return len(page) == len(rows) and all(
+        a[1] == b[1] and a[4] == b[4] for a, b in zip(page, rows)
+    )
+
+
+#------------------------------------------------------------------------------
+class SingleFlight:
+    '''
+    Runs at most one fetch per key at a time. Callers asking for a key that
+    is already being fetched wait for that fetch and share its result.
+    '''
+    def __init__(self):
+        self.inflight = {} #key: task
+
+    def start(self, key, factory):
+        #Returns the running task for key, starting factory() if there's none
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.inflight[key] = task
+            task.add_done_callback(lambda t: self.inflight.pop(key, None))
+        return task
+
+    async def do(self, key, factory):
+        #shield so a cancelled caller doesn't cancel the shared fetch
+        return await asyncio.shield(self.start(key, factory))
+
+    def __contains__(self, key):
+        return key in self.inflight
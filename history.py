@@ -0,0 +1,165 @@
+import sqlite3
+import datetime
+import threading
+from array import array
+
+from indexes import normalize_title
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS history (
+    book_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    times BLOB NOT NULL,
+    ranks BLOB NOT NULL,
+    amounts BLOB NOT NULL,
+    PRIMARY KEY (book_id, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS history_titles (
+    book_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    norm TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_titles_norm ON history_titles (norm);
+CREATE TABLE IF NOT EXISTS history_days (
+    day TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS history_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+#------------------------------------------------------------------------------
+class Series:
+    #Points of one book on one board, stored as parallel arrays
+    def __init__(self, times=b'', ranks=b'', amounts=b''):
+        self.times = array('q', times)
+        self.ranks = array('i', ranks)
+        self.amounts = array('q', amounts)
+
+    def append(self, timestamp, rank, amount):
+        if self.times and timestamp <= self.times[-1]:
+            return False #already recorded
+        self.times.append(int(timestamp))
+        self.ranks.append(int(rank))
+        self.amounts.append(int(amount or 0))
+        return True
+
+    def between(self, start, end):
+        return [
+            (t, r, a) for t, r, a in zip(self.times, self.ranks, self.amounts)
+            if start <= t <= end
+        ]
+
+    def blobs(self):
+        return self.times.tobytes(), self.ranks.tobytes(), self.amounts.tobytes()
+
+
+#------------------------------------------------------------------------------
+class RankHistory:
+    '''
+    Time-series of (timestamp, rankNo, amount) points keyed by (bookId, key).
+
+    Each series is a row of packed arrays, so a query only reads the rows of
+    the requested book instead of the daily snapshots.
+    '''
+    def __init__(self, path='rankings.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        #Titles recorded when norm was only lowercased are normalized once,
+        #later opens only read the marker
+        if not self.conn.execute("SELECT 1 FROM history_meta WHERE name='norm'").fetchone():
+            self.conn.executemany(
+                'UPDATE history_titles SET norm=? WHERE book_id=?',
+                [
+                    (normalize_title(t), b) for b, t, n in
+                    self.conn.execute('SELECT book_id, title, norm FROM history_titles')
+                    if n != normalize_title(t)
+                ]
+            )
+            self.conn.execute("INSERT INTO history_meta (name, value) VALUES ('norm', 'normalize_title')")
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def recorded_days(self):
+        with self.lock:
+            return {d for d, in self.conn.execute('SELECT day FROM history_days')}
+
+    def record(self, database, timestamp, day=None):
+        #Add a point for every row of every board in the snapshot
+        day = day or str(datetime.date.fromtimestamp(timestamp))
+        with self.lock, self.conn:
+            if self.conn.execute('SELECT 1 FROM history_days WHERE day=?', (day,)).fetchone():
+                return 0
+            count = self._record(database, timestamp)
+            self.conn.execute('INSERT INTO history_days (day) VALUES (?)', (day,))
+        return count
+
+    def _record(self, database, timestamp):
+        series = {}
+        titles = {}
+        for key, rows in database.items():
+            for rankNo, bookId, updateId, bookName, amount in rows:
+                series.setdefault((str(bookId), key), (rankNo, amount))
+                titles[str(bookId)] = bookName
+
+        count = 0
+        for (bookId, key), (rankNo, amount) in series.items():
+            row = self.conn.execute(
+                'SELECT times, ranks, amounts FROM history WHERE book_id=? AND key=?',
+                (bookId, key)
+            ).fetchone()
+            s = Series(*row) if row else Series()
+            if s.append(timestamp, rankNo, amount):
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO history (book_id, key, times, ranks, amounts) '
+                    'VALUES (?, ?, ?, ?, ?)', (bookId, key) + s.blobs()
+                )
+                count += 1
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO history_titles (book_id, title, norm) VALUES (?, ?, ?)',
+            [(b, t, normalize_title(t)) for b, t in titles.items()]
+        )
+        return count
+
+    def import_backups(self, backups):
+        #Import the daily snapshots of the BackupStore not recorded yet
+        done = self.recorded_days()
+        imported = 0
+        for day in backups.days():
+            try:
+                date = datetime.datetime.strptime(day, '%Y-%m-%d')
+            except ValueError:
+                continue
+            if day in done:
+                continue
+            self.record(backups.load(day), date.timestamp(), day)
+            imported += 1
+        return imported
+
+    def book_ids(self, title):
+        with self.lock:
+            return [b for b, in self.conn.execute(
+                'SELECT book_id FROM history_titles WHERE norm=?', (normalize_title(title),)
+            )]
+
+    def query(self, book_id, start, end, key_prefix=''):
+        #Returns {key: [(timestamp, rankNo, amount)]} between start and end
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT key, times, ranks, amounts FROM history '
+                'WHERE book_id=? AND key LIKE ?', (str(book_id), key_prefix + '%')
+            ).fetchall()
+        result = {}
+        for key, *blobs in rows:
+            points = Series(*blobs).between(start, end)
+            if points:
+                result[key] = points
+        return result
@@ -0,0 +1,369 @@
+import re
+import bisect
+import functools
+import unicodedata
+from collections import Counter
+
+APOSTROPHES = str.maketrans('', '', "'\u2018\u2019`")
+SEPARATORS = re.compile(r'[\W_]+')
+
+
+#------------------------------------------------------------------------------
+@functools.lru_cache(maxsize=65536)
+def normalize_title(title):
+    #Form of the title used for lookups. Compatibility characters are folded
+    #(full-width colons, non-breaking spaces...), accents, case and
+    #apostrophes dropped and any other punctuation is a space
+    text = unicodedata.normalize('NFKD', title).casefold()
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(SEPARATORS.sub(' ', text.translate(APOSTROPHES)).split())
+
+
+def edit_distance(a, b, bound):
+    #Levenshtein distance of a and b, or bound + 1 once it's over bound.
+    #Only the cells within bound of the diagonal can stay under it
+    over = bound + 1
+    if abs(len(a) - len(b)) > bound:
+        return over
+    if len(a) > len(b):
+        a, b = b, a
+    previous = [j if j <= bound else over for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        lo, hi = max(1, i - bound), min(len(b), i + bound)
+        current = [over]*(len(b) + 1)
+        current[0] = i if i <= bound else over
+        for j in range(lo, hi + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != b[j - 1]),
+            )
+        if min(current[lo - 1:hi + 1]) > bound:
+            return over
+        previous = current
+    return min(previous[-1], over)
+
+
+def deletions(token):
+    #The token and every way of dropping one character from it, two tokens
+    #one edit apart always share one of these
+    return {token} | {token[:i] + token[i+1:] for i in range(len(token))}
+
+
+#------------------------------------------------------------------------------
+class TitleIndex:
+    '''
+    Inverted index of the boards, normalized title -> {key: (rankNo, bookId,
+    coverUpdateTime, amount)}. Must be told whenever a board is replaced.
+
+    Lookups only take the exact normalized title. Titles that don't match
+    exactly can be suggested by their words: each word is also indexed by
+    its one-character deletions, so the words within one typo of a typed
+    word are found without scanning, and the titles sharing the most words
+    are ranked by a bounded edit distance. A suggestion may be another book
+    (a sequel is one edit away), so it's only ever offered, never used.
+    '''
+    def __init__(self, max_candidates=50):
+        self.max_candidates = max_candidates #titles compared per fuzzy match
+        self.common = 200 #words in more titles than this are skipped if possible
+        self.titles = {}
+        self.names = {} #normalized title: bookName as shown on the board
+        self.words = {} #word: set of normalized titles
+        self.variants = {} #deletion of a word: set of words
+
+    def build(self, database):
+        self.titles = {}
+        self.names = {}
+        self.words = {}
+        self.variants = {}
+        for key, rows in database.items():
+            self.add_rows(key, rows)
+
+    def add_rows(self, key, rows):
+        for rankNo, bookId, updateId, bookName, amount in rows:
+            norm = normalize_title(bookName)
+            boards = self.titles.get(norm)
+            if boards is None:
+                boards = self.titles[norm] = {}
+                self.add_words(norm)
+            #Keep the first (highest) row if the title shows up twice
+            if key not in boards:
+                boards[key] = (rankNo, bookId, updateId, amount)
+            self.names[norm] = bookName
+
+    def remove_rows(self, key, rows):
+        for row in rows:
+            norm = normalize_title(row[3])
+            boards = self.titles.get(norm)
+            if boards is None:
+                continue
+            boards.pop(key, None)
+            if not boards:
+                del self.titles[norm]
+                self.names.pop(norm, None)
+                self.remove_words(norm)
+
+    def add_words(self, norm):
+        for word in set(norm.split()):
+            titles = self.words.get(word)
+            if titles is None:
+                titles = self.words[word] = set()
+                for v in deletions(word):
+                    self.variants.setdefault(v, set()).add(word)
+            titles.add(norm)
+
+    def remove_words(self, norm):
+        for word in set(norm.split()):
+            titles = self.words.get(word)
+            if titles is None:
+                continue
+            titles.discard(norm)
+            if not titles:
+                del self.words[word]
+                for v in deletions(word):
+                    words = self.variants.get(v)
+                    if words is not None:
+                        words.discard(word)
+                        if not words:
+                            del self.variants[v]
+
+    def update_board(self, key, old_rows, new_rows):
+        self.remove_rows(key, old_rows or [])
+        self.add_rows(key, new_rows)
+
+    def near_words(self, word):
+        #Indexed words at most one edit away, short words only match exactly
+        if len(word) < 4:
+            return [word] if word in self.words else []
+        found = set()
+        for v in deletions(word):
+            found.update(self.variants.get(v, ()))
+        return [w for w in found if edit_distance(word, w, 1) <= 1]
+
+    def matches(self, title, limit=5, prefix=False):
+        #Normalized titles closest to title, best first. A title is allowed
+        #one edit per 8 characters. With prefix, title is compared with the
+        #start of the titles, for text still being typed
+        norm = normalize_title(title)
+        if norm in self.titles and not prefix:
+            return [norm]
+        bound = max(1, len(norm) // 8)
+        #Rare words narrow it down, words in most titles ('the', 'of') are
+        #only used when there's nothing else
+        near = sorted(
+            (len(self.words[w]), w)
+            for word in set(norm.split()) for w in self.near_words(word)
+        )
+        shared = Counter()
+        for n, word in near:
+            if shared and n > self.common:
+                break
+            shared.update(self.words[word])
+        found = []
+        for candidate, n in shared.most_common(self.max_candidates):
+            if prefix:
+                d = min(
+                    edit_distance(norm, candidate[:len(norm) + i], bound)
+                    for i in range(-bound, bound + 1)
+                )
+            else:
+                d = edit_distance(norm, candidate, bound)
+            if d <= bound:
+                found.append((d, -n, candidate))
+        return [candidate for d, n, candidate in sorted(found)[:limit]]
+
+    def match(self, title):
+        #The normalized title if it's on the boards, or None
+        norm = normalize_title(title)
+        return norm if norm in self.titles else None
+
+    def lookup(self, title, key):
+        #Returns (rankNo, bookId, coverUpdateTime, amount, bookName) or None
+        norm = normalize_title(title)
+        item = self.titles.get(norm, {}).get(key)
+        if item is None:
+            return None
+        return item + (self.names[norm],)
+
+    def boards(self, title):
+        #Every board the title is currently on, {key: (rankNo, bookId, ...)}
+        return dict(self.titles.get(self.match(title), {}))
+
+
+#------------------------------------------------------------------------------
+class BookIndex:
+    '''
+    Every placement of every book, bookId -> {key: (rankNo, amount)}. Like
+    TitleIndex, it's patched with the old and new rows of a replaced board.
+    '''
+    def __init__(self):
+        self.books = {}
+        self.info = {} #bookId: (coverUpdateTime, bookName) last seen
+
+    def build(self, database):
+        self.books = {}
+        self.info = {}
+        for key, rows in database.items():
+            self.add_rows(key, rows)
+
+    def add_rows(self, key, rows):
+        for rankNo, bookId, updateId, bookName, amount in rows:
+            self.books.setdefault(bookId, {}).setdefault(key, (rankNo, amount))
+            self.info[bookId] = (updateId, bookName)
+
+    def remove_rows(self, key, rows):
+        for row in rows:
+            boards = self.books.get(row[1])
+            if boards is None:
+                continue
+            boards.pop(key, None)
+            if not boards:
+                del self.books[row[1]]
+                self.info.pop(row[1], None)
+
+    def update_board(self, key, old_rows, new_rows):
+        self.remove_rows(key, old_rows or [])
+        self.add_rows(key, new_rows)
+
+    def lookup(self, bookId, key):
+        #Same as TitleIndex.lookup, by bookId
+        item = self.books.get(bookId, {}).get(key)
+        if item is None:
+            return None
+        rankNo, amount = item
+        updateId, bookName = self.info[bookId]
+        return rankNo, bookId, updateId, amount, bookName
+
+    def placements(self, bookId):
+        #[(key, rankNo, amount)] of the book, best rank first
+        return sorted(
+            ((key, rankNo, amount) for key, (rankNo, amount) in self.books.get(bookId, {}).items()),
+            key=lambda p: (p[1], p[0]),
+        )
+
+
+#------------------------------------------------------------------------------
+def trigrams(text):
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+class TitleCompleter:
+    '''
+    Autocomplete index over every title on the boards.
+
+    Titles are counted per board row so the index can be patched with the
+    difference between the old and new contents of a board. A presorted
+    normalized list answers prefix queries and a trigram index narrows down
+    substring queries, so a query never walks the whole title set.
+    '''
+    def __init__(self, limit=25):
+        self.limit = limit #Discord accepts at most 25 choices
+        self.titles = {} #title: number of board rows showing it
+        self.sorted = [] #(normalized title, title), kept sorted
+        self.pending = [] #added to sorted on the next query
+        self.grams = {} #trigram: set of titles
+
+    def build(self, database):
+        #Count everything first and sort once instead of inserting one by one
+        self.titles = dict(Counter(
+            row[3] for rows in database.values() for row in rows
+        ))
+        self.sorted = sorted((normalize_title(t), t) for t in self.titles)
+        self.pending = []
+        self.grams = {}
+        for low, title in self.sorted:
+            for g in trigrams(low):
+                self.grams.setdefault(g, set()).add(title)
+
+    def add(self, title):
+        self.add_many([title])
+
+    def add_many(self, titles):
+        #New titles wait in self.pending until the sorted list is needed
+        for title in titles:
+            count = self.titles.get(title, 0)
+            self.titles[title] = count + 1
+            if not count:
+                low = normalize_title(title)
+                self.pending.append((low, title))
+                for g in trigrams(low):
+                    self.grams.setdefault(g, set()).add(title)
+
+    def flush(self):
+        #Sorting a sorted list with a short tail is one linear merge
+        if self.pending:
+            self.pending.sort()
+            self.sorted += self.pending
+            self.sorted.sort()
+            self.pending = []
+
+    def discard(self, title):
+        count = self.titles.get(title, 0)
+        if count > 1:
+            self.titles[title] = count - 1
+            return
+        if not count:
+            return
+        del self.titles[title]
+        self.flush()
+        low = normalize_title(title)
+        i = bisect.bisect_left(self.sorted, (low, title))
+        if i < len(self.sorted) and self.sorted[i] == (low, title):
+            self.sorted.pop(i)
+        for g in trigrams(low):
+            items = self.grams.get(g)
+            if items is not None:
+                items.discard(title)
+                if not items:
+                    del self.grams[g]
+
+    def update_board(self, old_rows, new_rows):
+        #Only apply the titles that actually entered or left the board
+        old = Counter(row[3] for row in old_rows or [])
+        new = Counter(row[3] for row in new_rows)
+        self.add_many((new - old).elements())
+        for title, n in (old - new).items():
+            for _ in range(n):
+                self.discard(title)
+
+    def __contains__(self, title):
+        return title in self.titles
+
+    def __len__(self):
+        return len(self.titles)
+
+    def complete(self, current):
+        #Prefix matches first, then the other substring matches, in order
+        self.flush()
+        query = normalize_title(current)
+        limit = self.limit
+        i = bisect.bisect_left(self.sorted, (query,))
+        found = []
+        while i < len(self.sorted) and len(found) < limit:
+            low, title = self.sorted[i]
+            if not low.startswith(query):
+                break
+            found.append(title)
+            i += 1
+        #Queries too short for a trigram only get the prefix matches,
+        #finding them anywhere in a title would mean a scan of every title
+        if len(found) >= limit or len(query) < 3:
+            return found
+
+        grams = sorted(trigrams(query), key=lambda g: len(self.grams.get(g, ())))
+        candidates = set(self.grams.get(grams[0], ()))
+        for g in grams[1:]:
+            if not candidates:
+                break
+            candidates &= self.grams.get(g, set())
+        candidates = sorted(
+            (normalize_title(t), t) for t in candidates
+        )
+
+        seen = set(found)
+        for low, title in candidates:
+            if len(found) >= limit:
+                break
+            if query in low and title not in seen:
+                found.append(title)
+        return found
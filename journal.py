@@ -0,0 +1,80 @@
+import asyncio
+
+from blocking import offload
+from metrics import METRICS
+
+
+#------------------------------------------------------------------------------
+class Journal:
+    '''
+    Group commit of the tracker and birthday writes.
+
+    Writes are queued as (method, args) of the Storage and written
+    together, one transaction (and one fsync) per batch, after at most
+    delay seconds. A tracker tick that reschedules hundreds of entries
+    costs one commit instead of hundreds, and each write only touches its
+    own row. Waiting on write() returns once the batch it's in is on disk.
+
+    The SQLite WAL is the journal, a crash mid-commit leaves the last
+    complete batch and SQLite replays the WAL when it's opened again.
+    '''
+    def __init__(self, storage, delay=0.05):
+        self.storage = storage
+        self.delay = delay
+        self.ops = []
+        self.done = None #future of the batch being filled
+        self.task = None
+
+    def write(self, method, *args):
+        #Queues storage._<method>(*args), returns a future that's done when
+        #the write is committed
+        self.ops.append((method, args))
+        if self.done is None:
+            self.done = asyncio.get_running_loop().create_future()
+            self.task = asyncio.create_task(self.commit_later())
+        return self.done
+
+    def save_tracked(self, entry):
+        return self.write('save_tracked', entry)
+
+    def delete_tracked(self, entry):
+        return self.write('delete_tracked', entry)
+
+    def set_last_update(self, key, timestamp):
+        return self.write('set_last_update', key, timestamp)
+
+    def save_birthday(self, guild, entry):
+        return self.write('save_birthday', guild, entry)
+
+    def save_timezone(self, guild, timezone):
+        return self.write('save_timezone', guild, timezone)
+
+    async def commit_later(self):
+        await asyncio.sleep(self.delay)
+        await self.commit()
+
+    async def commit(self):
+        #Writes what's queued now, the next write starts a new batch
+        ops, done = self.ops, self.done
+        self.ops, self.done, self.task = [], None, None
+        if done is None:
+            return
+        METRICS.inc('journal_batches_total')
+        METRICS.inc('journal_writes_total', len(ops))
+        try:
+            await offload(self.storage.apply, ops)
+        except Exception as e:
+            print("Cannot save the batch!", len(ops), "writes")
+            print("Error!", e)
+            done.set_exception(e)
+            #Nobody may be waiting on it
+            done.exception()
+        else:
+            done.set_result(len(ops))
+
+    async def flush(self):
+        #Commits the batch being filled right away
+        task = self.task
+        if task is not None:
+            task.cancel()
+        await self.commit()
@@ -0,0 +1,135 @@
+import time
+import asyncio
+import contextlib
+
+#Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+#------------------------------------------------------------------------------
+class Histogram:
+    def __init__(self):
+        self.counts = [0]*(len(BUCKETS) + 1) #last one is +Inf
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        #Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        target = q*self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+
+#------------------------------------------------------------------------------
+class Metrics:
+    '''
+    Counters and latency histograms, each keyed by name and a sorted tuple
+    of (label, value) pairs. Can be rendered as Prometheus text.
+    '''
+    def __init__(self):
+        self.counters = {} #name: {labels: value}
+        self.histograms = {} #name: {labels: Histogram}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        series = self.counters.setdefault(name, {})
+        labels = tuple(sorted(labels.items()))
+        series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        series = self.histograms.setdefault(name, {})
+        labels = tuple(sorted(labels.items()))
+        if labels not in series:
+            series[labels] = Histogram()
+        series[labels].observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def total(self, name):
+        return sum(self.counters.get(name, {}).values())
+
+    def merged(self, name):
+        #One histogram of every label combination of the name
+        merged = Histogram()
+        for h in self.histograms.get(name, {}).values():
+            merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+            merged.total += h.total
+            merged.count += h.count
+            merged.max = max(merged.max, h.max)
+        return merged
+
+    def render(self):
+        #Prometheus text exposition format
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f'# TYPE {name} counter')
+            for labels, value in series.items():
+                lines.append(f'{name}{fmt(labels)} {value}')
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f'# TYPE {name} histogram')
+            for labels, h in series.items():
+                seen = 0
+                for bound, n in zip(BUCKETS + ('+Inf',), h.counts):
+                    seen += n
+                    lines.append(f'{name}_bucket{fmt(labels, [("le", bound)])} {seen}')
+                lines.append(f'{name}_sum{fmt(labels)} {h.total}')
+                lines.append(f'{name}_count{fmt(labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+#------------------------------------------------------------------------------
+async def measure_loop_lag(interval=1.0):
+    #How late the loop wakes a sleeping task is the time it was blocked
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        METRICS.observe('event_loop_lag_seconds', lag)
+
+
+async def start_server(port, host='127.0.0.1'):
+    #Serves METRICS.render() on http://host:port/metrics
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=METRICS.render(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,14 +1,12 @@
 import os
 import sys
 import time
-import json
-import pickle
+STARTED = time.perf_counter()
 import string
-import shutil
-import random
 import asyncio
+import zoneinfo
+import logging
 import datetime
-import requests
 
 import discord
 from discord import app_commands
@@ -16,6 +14,23 @@ from discord.ext import tasks
 
 from dotenv import load_dotenv
 
+from crawler import RankCrawler, SingleFlight, CircuitOpen
+from refresher import RefreshScheduler
+from board import Board
+from indexes import TitleIndex, TitleCompleter, BookIndex, normalize_title
+from storage import Storage, LazyBoards
+from history import RankHistory
+from tracker import TrackerQueue
+from channels import ChannelCache
+from rank_diff import diff_boards, rank_changed
+from birthdays import BirthdayCalendar, ANNOUNCE_HOUR, get_timezone
+import metrics
+from metrics import METRICS
+from blocking import StallWatchdog, offload
+from journal import Journal
+from backups import BackupStore
+from catalog import BoardCatalog, canonical
+
 load_dotenv()
 
 #Constants to be used by the bot
@@ -28,6 +43,7 @@ rankNames = {
         "engagement_rank":"Active",
         "fandom_rank":"Fandom",
     }
+CATALOG = BoardCatalog(rankNames) #every valid board key, with its pages and last refresh
 category_list = ['power_rank', 'best_sellers', 'collection_rank', 'popular_rank', 'update_rank', 'engagement_rank', 'fandom_rank']
 rank_id_list = {
     '5':'monthly',
@@ -58,59 +74,231 @@ def build_key(category, time_type, time_range, content, contract, sex):
     return f"{category}-{time_type}-{time_range}-{content}-{contract}-{sex}"
 
 #Global variables
-DATABASE = {}
+DATABASE = {} #build_key: Board, read from STORAGE on first use (see LazyBoards)
 LAST_UPDATE = {} #key:val == build_key:timestamp of last update
-TRACKING_LIST = [] #(timestamp, build_key, interval, [title, channel, name, avatar])
+TRACKING_LIST = TrackerQueue() #(timestamp, build_key, interval, [title, channel, name, avatar, threshold, last_rank, book_id, guild])
 BIRTHDAY_LIST = {} #Birthdays grouped per guild, (mm, dd, yyyy, name, id, channel)
+BIRTHDAYS = BirthdayCalendar() #BIRTHDAY_LIST indexed by (month, day), with the guild timezones
+BIRTHDAY_WAKE = asyncio.Event() #set when a birthday or timezone changes
 CSRFTOKEN = os.getenv("CSRFTOKEN")
-UPDATE_DELAY = 1800
-ALL_TITLES = set()
-
-#Load saved data
-try:
-    with open('RANKING_DATA.json', 'r') as f:
-        DATABASE = json.load(f)
-except:
-    with open('RANKING_DATA.json', 'w') as f:
-        json.dump(DATABASE, f)
-
-try:
-    with open('tracking_list_backup.pkl', 'rb') as f:
-        TRACKING_LIST = pickle.load(f)
-        print(datetime.datetime.now(), "Loaded tracking list from backup!")
-except:
-    print(datetime.datetime.now(), "No tracking list backup!")
-
-try:
-    with open('last_update_times.pkl', 'rb') as f:
-        LAST_UPDATE = pickle.load(f)
-        print(datetime.datetime.now(), "Loaded last update times from backup!")
-except:
-    print(datetime.datetime.now(), "No last update times backup!")
-
-try:
-    with open('birthday_tracker.json', 'r') as f:
-        BIRTHDAY_LIST = json.load(f)
-        print(datetime.datetime.now(), "Loaded birthday list from backup!")
-except:
-    print(datetime.datetime.now(), "No birthday list backup!")
-
-
-async def update_data_and_update_time():
+UPDATE_DELAY = int(os.getenv("UPDATE_DELAY", 1800))
+CRAWL_ALL = os.getenv("CRAWL_ALL", "") not in ("", "0") #keep every catalog board fresh, not only the known ones
+#all: one process does everything, crawler: only crawls and publishes the
+#boards, shard: only talks to Discord and reads the boards of the crawler
+ROLE = os.getenv("ROLE", "all")
+SHARD_COUNT = os.getenv("SHARD_COUNT") #total number of shards, if sharded
+SHARD_IDS = os.getenv("SHARD_IDS") #comma separated shards run by this process
+
+
+def check_sharding():
+    #Settings that don't fit together stop the bot at startup instead of
+    #failing inside the loops, returns the shards run by this process
+    if ROLE not in ('all', 'crawler', 'shard'):
+        sys.exit(f"ROLE must be all, crawler or shard, not {ROLE!r}")
+    if SHARD_IDS and not SHARD_COUNT:
+        sys.exit("SHARD_IDS is set without SHARD_COUNT")
+    try:
+        count = int(SHARD_COUNT) if SHARD_COUNT else 1
+        own = {int(i) for i in SHARD_IDS.split(',')} if SHARD_IDS else set()
+    except ValueError:
+        sys.exit(f"SHARD_COUNT and SHARD_IDS must be numbers, not {SHARD_COUNT!r} and {SHARD_IDS!r}")
+    if count < 1 or any(not 0 <= i < count for i in own):
+        sys.exit(f"SHARD_IDS {SHARD_IDS} must be between 0 and SHARD_COUNT-1 ({count - 1})")
+    return own
+
+OWN_SHARDS = check_sharding() #empty when this process has every guild
+PUBLISHED = {} #build_key: Event set when the crawler publishes the board
+FEED = {'seq': 0} #last board change read from the shared database
+PUBLISHING = set() #publish_board tasks of the crawler in progress
+TRACKER_WAKE = asyncio.Event() #set to make the tracker look at the queue early
+SEND_SEMAPHORE = asyncio.Semaphore(int(os.getenv("SEND_CONCURRENCY", 5))) #channels posted to at once
+METRICS_PORT = os.getenv("METRICS_PORT") #serve Prometheus text on localhost if set
+BACKGROUND = {} #name: background task started on the first on_ready
+#Logs the stack of any call that blocks the event loop longer than this
+WATCHDOG = StallWatchdog(threshold=float(os.getenv("STALL_THRESHOLD", 0.5)))
+ALL_TITLES = TitleCompleter() #every title on the boards, used for autocomplete
+CRAWLER = RankCrawler(CSRFTOKEN, concurrency=int(os.getenv("CRAWL_CONCURRENCY", 4)))
+REFRESHER = RefreshScheduler(UPDATE_DELAY)
+FLIGHTS = SingleFlight() #board fetches in progress, shared by every caller
+BOARD_DIFFS = {} #build_key: BoardDiff of the latest refresh
+DIFF_LISTENERS = [] #called with (build_key, BoardDiff) after every refresh
+TITLE_INDEX = TitleIndex() #normalized title: {key: (rankNo, bookId, coverUpdateTime, amount)}
+BOOK_INDEX = BookIndex() #bookId: {key: (rankNo, amount)}, every placement of a book
+STARTUP = {} #startup phase: seconds taken
+
+
+def startup_phase(name, since):
+    #Records how long a startup phase took, returns the start of the next
+    now = time.perf_counter()
+    STARTUP[name] = now - since
+    METRICS.observe('startup_seconds', now - since, phase=name)
+    return now
+
+
+def index_board(key, board):
+    #Boards are indexed as they're read from the database
+    TITLE_INDEX.add_rows(key, board)
+    BOOK_INDEX.add_rows(key, board)
+    ALL_TITLES.update_board(None, board)
+
+
+#Load saved data, the old JSON/pickle files are imported on first run.
+#Only the board keys are read here, boards are decoded when first used
+#and the rest are read in the background once connected
+since = STARTED
+STORAGE = Storage(os.getenv("DB_PATH", 'rankings.db'))
+STORAGE.migrate()
+JOURNAL = Journal(STORAGE) #batches the tracker and birthday writes
+HISTORY = RankHistory(os.getenv("DB_PATH", 'rankings.db'))
+BACKUPS = BackupStore('Backup') #nightly board backups, stored by content
+since = startup_phase('open_database', since)
+
+DATABASE = LazyBoards(STORAGE, on_load=index_board)
+since = startup_phase('board_keys', since)
+TRACKING_LIST = TrackerQueue(STORAGE.load_tracking())
+since = startup_phase('tracking_list', since)
+LAST_UPDATE = STORAGE.load_last_update()
+for key, timestamp in LAST_UPDATE.items():
+    CATALOG.note_refresh(key, timestamp=timestamp)
+since = startup_phase('last_update', since)
+BIRTHDAY_LIST = STORAGE.load_birthdays()
+BIRTHDAYS.build(BIRTHDAY_LIST, STORAGE.load_timezones())
+since = startup_phase('birthdays', since)
+FEED['seq'] = STORAGE.last_change() #boards read from here on are current
+print(datetime.datetime.now(), f"Loaded {len(DATABASE)} board keys, {len(TRACKING_LIST)} tracked books, " +\
+      f"{sum(map(len, BIRTHDAY_LIST.values()))} birthdays! " +\
+      ', '.join(f'{k}: {1000*v:.1f}ms' for k, v in STARTUP.items()))
+
+
+async def load_remaining_boards(chunk=16):
+    #Reads and decodes the boards in a thread, a few at a time, and only
+    #indexes them on the loop
+    start = time.perf_counter()
+    keys = DATABASE.pending()
+    for i in range(0, len(keys), chunk):
+        boards = await offload(STORAGE.load_boards, keys[i:i + chunk])
+        DATABASE.fill(boards)
+    startup_phase('load_boards', start)
+    print(datetime.datetime.now(), f"Loaded {len(keys)} boards in the background " +\
+          f"in {STARTUP['load_boards']:.2f}s!")
+
+
+async def update_data_and_update_time(key):
+    #Only the board that changed is written
     print("Updating both data and last update time...", end=' ')
-    with open('RANKING_DATA.json', 'w') as f:
-        json.dump(DATABASE, f)
-        
-    with open('last_update_times.pkl', 'wb') as f:
-        pickle.dump(LAST_UPDATE, f)
+    if key in DATABASE:
+        await offload(STORAGE.save_board, key, DATABASE[key], LAST_UPDATE.get(key))
+    else:
+        await offload(STORAGE.set_last_update, key, LAST_UPDATE.get(key, 0))
     print("Done!")
     
 
-async def refresh_names():
-    #Try to initialize ALL_TITLES
-    for k, v in DATABASE.items():
-        for _, _, _, n, _ in v:
-            ALL_TITLES.add(n)
+async def update_board(key, data, timestamp=None):
+    #Store freshly fetched board data, None means there's no new data and
+    #the board is left as it was, not even marked as refreshed
+    if data is None:
+        return
+    old, data = set_board(key, data)
+    if old is not None:
+        diff = diff_boards(old, data)
+        BOARD_DIFFS[key] = diff
+        for listener in DIFF_LISTENERS:
+            listener(key, diff)
+    LAST_UPDATE[key] = time.time() if timestamp is None else timestamp
+    CATALOG.note_refresh(key, CRAWLER.page_counts.get(tuple(key.split('-'))), LAST_UPDATE[key])
+
+
+def set_board(key, data):
+    #Puts the board in DATABASE and patches the title indexes, returns
+    #(old board, new board)
+    data = Board(data)
+    old = DATABASE.get(key)
+    TITLE_INDEX.update_board(key, old, data)
+    BOOK_INDEX.update_board(key, old, data)
+    ALL_TITLES.update_board(old, data)
+    DATABASE[key] = data
+    return old, data
+
+
+async def restore_board(key, data):
+    #Puts back a board from a backup. It isn't diffed, trackers aren't woken
+    #on old data, and it's stamped now so it's served for UPDATE_DELAY
+    #before a crawl replaces it
+    set_board(key, data)
+    BOARD_DIFFS.pop(key, None)
+    LAST_UPDATE[key] = time.time()
+    await update_data_and_update_time(key)
+
+
+def wake_changed_trackers(key, diff):
+    #Entries that only post on rank changes are checked as soon as their
+    #book moves instead of waiting for their interval
+    if not diff:
+        return
+    titles = {normalize_title(t) for t in diff.titles.values()}
+    now = time.time()
+    woken = 0
+    for eid, (timestamp, _, delay, values) in TRACKING_LIST.tracking(key):
+        if values[4] and (values[6] in diff.titles or normalize_title(values[0]) in titles):
+            woken += TRACKING_LIST.make_due(eid, now)
+    if woken:
+        TRACKER_WAKE.set()
+
+DIFF_LISTENERS.append(wake_changed_trackers)
+
+
+async def refresh_board(key):
+    #Fetches the board once even if several callers ask at the same time
+    return await FLIGHTS.do(key, lambda: load_board(key))
+
+
+def load_board(key):
+    #Shards ask the crawler process for boards instead of crawling them
+    if ROLE == 'shard':
+        return request_board(key)
+    return fetch_and_store_board(key)
+
+
+async def request_board(key, timeout=120):
+    event = PUBLISHED.setdefault(key, asyncio.Event())
+    event.clear()
+    await offload(STORAGE.request_refresh, key)
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        print(datetime.datetime.now(), "The crawler didn't publish", key)
+    return DATABASE.get(key)
+
+
+async def fetch_and_store_board(key):
+    print(datetime.datetime.now(), "Refreshing board:", key)
+    try:
+        data = await get_data(*key.split('-'))
+    except CircuitOpen as e:
+        #The saved board is kept and served until the host recovers
+        print("Skipped refreshing", key, e)
+        data = None
+    except Exception as e:
+        print("Error refreshing", key, e)
+        data = None
+    if data is None:
+        #Nothing is stamped, the board is still due once the host is back
+        return DATABASE.get(key)
+    await update_board(key, data)
+    await update_data_and_update_time(key)
+    return DATABASE.get(key)
+
+
+async def ensure_board(key):
+    #Stale-while-revalidate, answer from the stored board and refresh it in
+    #the background if it's outdated, only wait if there's no board yet
+    #An empty board is still a fetched board, and one that came back empty
+    #recently isn't tried again before CATALOG says so
+    if key in DATABASE:
+        if time.time() - LAST_UPDATE.get(key, 0) > UPDATE_DELAY and not CATALOG.dead(key):
+            FLIGHTS.start(key, lambda: load_board(key))
+        return DATABASE[key]
+    return await refresh_board(key)
 
 #Initial Setup
 TOKEN = os.getenv('TOKEN')
@@ -120,20 +308,116 @@ AI_ID = int(os.getenv("AI_ID"))
 OWNER_ID = int(os.getenv("OWNER_ID"))
 SERVER_ID = int(os.getenv("SERVER_ID"))
 
-client=discord.Client(intents=intents)
+class RateLimitCounter(logging.Handler):
+    #discord.py retries 429s by itself and only logs them
+    def emit(self, record):
+        if 'rate limit' in record.getMessage().lower():
+            METRICS.inc('discord_rate_limits_total')
+
+logging.getLogger('discord.http').addHandler(RateLimitCounter(logging.WARNING))
+
+if SHARD_COUNT:
+    #One gateway connection per shard, SHARD_IDS splits them over processes
+    client = discord.AutoShardedClient(
+        intents=intents,
+        shard_count=int(SHARD_COUNT),
+        shard_ids=[int(i) for i in SHARD_IDS.split(',')] if SHARD_IDS else None,
+    )
+else:
+    client=discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
+CHANNELS = ChannelCache(client) #resolves channel ids, counts hits/misses/api calls
 
 #------------------------------------------------------------------------------
 @client.event
 async def on_ready():
-    print(datetime.datetime.now(), "Connected to Discord!")
+    if 'ready' not in STARTUP:
+        startup_phase('ready', STARTED)
+    print(datetime.datetime.now(), f"Connected to Discord! {STARTUP['ready']:.2f}s after start")
     check_update_queue.start()
-    await asyncio.sleep(1)
-    create_backup_data.start()
+    if ROLE == 'shard':
+        follow_boards.start()
+    else:
+        await asyncio.sleep(1)
+        refresh_boards.start()
+        await asyncio.sleep(1)
+        create_backup_data.start()
     await asyncio.sleep(1)
     check_birthdays.start()
-    await asyncio.sleep(1)
-    await refresh_names()
+    await start_background()
+    if ROLE != 'shard':
+        await import_backups()
+
+
+async def start_background():
+    if BACKGROUND:
+        return
+    BACKGROUND['boards'] = asyncio.create_task(load_remaining_boards())
+    BACKGROUND['loop_lag'] = asyncio.create_task(metrics.measure_loop_lag())
+    checkpoint_database.start()
+    WATCHDOG.start()
+    if METRICS_PORT:
+        BACKGROUND['metrics'] = await metrics.start_server(int(METRICS_PORT))
+        print(datetime.datetime.now(), f"Serving metrics on port {METRICS_PORT}!")
+
+
+async def run_crawler():
+    #ROLE=crawler, keeps the boards fresh for the shard processes without
+    #connecting to Discord
+    print(datetime.datetime.now(), "Crawling for the shard processes!")
+    await start_background()
+    refresh_boards.start()
+    answer_requests.start()
+    create_backup_data.start()
+    await import_backups()
+    await asyncio.Event().wait()
+
+
+async def import_backups():
+    #Copies the old full-copy backups into the store, then records the days
+    #missing from the rank history
+    n = await offload(BACKUPS.import_legacy)
+    if n:
+        print(datetime.datetime.now(), f"Copied {n} old backups into the backup store!")
+    n = await offload(HISTORY.import_backups, BACKUPS)
+    print(datetime.datetime.now(), f"Imported {n} daily backups to rank history!")
+
+
+def shard_of(gid):
+    #Discord puts a guild on shard (guild_id >> 22) % shard_count
+    return (int(gid) >> 22) % int(SHARD_COUNT)
+
+
+def owns_guild(gid):
+    #With the shards split over processes, each one only posts to the
+    #guilds of its own shards
+    return not OWN_SHARDS or shard_of(gid) in OWN_SHARDS
+
+
+def owns_entry(values):
+    #Entries tracked before the guild was kept get it from the channel, an
+    #entry whose channel isn't cached yet is left for now
+    if values[7] is None:
+        channel = client.get_channel(values[1])
+        if getattr(channel, 'guild', None) is None:
+            return not OWN_SHARDS
+        values[7] = channel.guild.id #saved with the reschedule
+    return owns_guild(values[7])
+
+
+@client.event
+async def on_guild_channel_delete(channel):
+    CHANNELS.invalidate(channel.id)
+
+
+#------------------------------------------------------------------------------
+@tasks.loop(seconds=3600)
+async def checkpoint_database():
+    #Folds the WAL back into the database file so it doesn't keep growing
+    #and there's less of it to replay after a crash
+    busy, pages, copied = await offload(STORAGE.checkpoint)
+    if busy:
+        print(datetime.datetime.now(), f"Checkpoint held back by a reader, {copied}/{pages} pages copied")
 
 
 #------------------------------------------------------------------------------
@@ -145,84 +429,250 @@ async def create_backup_data():
     if (h == 23 or h == 0):
         print(datetime.datetime.now(), 'Creating backup...', end='')
         fn = str(curr).split()[0]
-        shutil.copy('ranking_data.json', f'Backup/{fn}.json')
-        print('done!')
+        new, written = await offload(backup_boards, fn, curr.timestamp())
+        print(f'done! {new} changed boards, {written/1024:.0f}KB written')
+
+
+
+def backup_boards(day, timestamp):
+    #Runs in a thread, the boards not read yet are read from STORAGE there
+    #instead of being decoded on the loop
+    boards = DATABASE.read_all()
+    new, written = BACKUPS.snapshot(boards, day)
+    HISTORY.record(boards, timestamp, day)
+    return new, written
 
         
 #------------------------------------------------------------------------------
-@tasks.loop(seconds=60)
+def known_keys(tracked=()):
+    #Every board key that is stored, was requested before or is tracked
+    #(the whole catalog with CRAWL_ALL), minus the invalid and dead ones.
+    #Tracked boards that came back empty wait for DEAD_RECHECK like the rest
+    keys = set(CATALOG) if CRAWL_ALL else set(DATABASE) | set(LAST_UPDATE)
+    keys.update(tracked)
+    keys.update(key for _, key, _, _ in TRACKING_LIST)
+    return CATALOG.schedulable(keys)
+
+
+@tasks.loop(seconds=1)
+async def refresh_boards():
+    #Keeps every known board fresh in the background. A board is started
+    #every REFRESHER spacing without waiting for the previous one, so long
+    #crawls don't stretch the schedule past the window
+    if len(FLIGHTS.inflight) >= CRAWLER.concurrency:
+        return
+    if ROLE == 'crawler':
+        #Books are tracked through the shard processes
+        tracked = await offload(STORAGE.tracked_keys)
+    else:
+        tracked = {}
+        for _, key, _, _ in TRACKING_LIST:
+            tracked[key] = tracked.get(key, 0) + 1
+
+    if not CRAWLER.available():
+        return
+    keys = known_keys(tracked)
+    key = REFRESHER.next_key(keys, LAST_UPDATE, tracked, busy=FLIGHTS.inflight)
+    if key is None:
+        return
+    REFRESHER.mark_fetched(spacing=REFRESHER.spacing(len(keys)))
+    FLIGHTS.start(key, lambda: load_board(key))
+
+
+@tasks.loop(seconds=1)
+async def answer_requests():
+    #ROLE=crawler, boards the shards asked for, a board that was never
+    #fetched is fetched right away, the others are refreshed sooner
+    for key in await offload(STORAGE.take_refresh_requests):
+        REFRESHER.note_request(key)
+        LAST_UPDATE.setdefault(key, 0)
+        if key not in DATABASE or (time.time() - LAST_UPDATE[key] > UPDATE_DELAY
+                                   and not CATALOG.dead(key)):
+            task = FLIGHTS.start(key, lambda key=key: fetch_and_store_board(key))
+        else:
+            task = None
+        #Kept until it's done, the loop only holds weak references to tasks
+        publish = asyncio.ensure_future(publish_board(key, task))
+        PUBLISHING.add(publish)
+        publish.add_done_callback(PUBLISHING.discard)
+
+
+async def publish_board(key, task):
+    #Published even if the refresh failed, the shard then reads the saved
+    #board instead of waiting for it to time out
+    if task is not None:
+        try:
+            await asyncio.shield(task)
+        except Exception as e:
+            print(datetime.datetime.now(), "Error refreshing", key, e)
+    try:
+        await offload(STORAGE.publish_board, key)
+    except Exception as e:
+        print(datetime.datetime.now(), "Cannot publish board!", key)
+        print("Error!", e)
+
+
+@tasks.loop(seconds=1)
+async def follow_boards():
+    #ROLE=shard, loads the boards the crawler process wrote since last time
+    changes = await offload(STORAGE.changes_since, FEED['seq'])
+    if not changes:
+        return
+    FEED['seq'] = changes[-1][0]
+    latest = {key: timestamp for seq, key, timestamp in changes}
+    print(datetime.datetime.now(), f"Loading {len(latest)} boards published by the crawler")
+    for key, timestamp in latest.items():
+        board = await offload(STORAGE.load_board, key)
+        await update_board(key, board, timestamp)
+        event = PUBLISHED.get(key)
+        if event is not None:
+            event.set()
+
+
+#------------------------------------------------------------------------------
+@tasks.loop(seconds=0)
 async def check_update_queue():
-    global TRACKING_LIST, DATABASE, LAST_UPDATE
+    #Posts the due entries, then sleeps until the earliest entry is due or
+    #the queue is changed by a command
+    TRACKER_WAKE.clear()
+    with METRICS.timer('tracker_tick_seconds'):
+        await post_due_entries()
+    next_due = TRACKING_LIST.next_due()
+    timeout = 3600 if next_due is None else min(3600, max(0, next_due - time.time()))
+    try:
+        await asyncio.wait_for(TRACKER_WAKE.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def post_due_entries():
+    current = time.time()
+    due = TRACKING_LIST.pop_due(current)
+    #Entries posting to the guilds of another process are left to it, here
+    #they only move on to their next time
+    owned = []
+    for eid, entry in due:
+        if owns_entry(entry[3]):
+            owned.append((eid, entry))
+        else:
+            TRACKING_LIST.reschedule(eid, entry, next_time(entry, current))
+    due = owned
+    if not due:
+        return
     print(datetime.datetime.now(),
           "Timed task running!",
           "No. of tasks:", len(TRACKING_LIST),
+          "| Due:", len(due),
           "    | No. of guilds:", len(client.guilds)
     )
-    queue = sorted(TRACKING_LIST)
-    checked = []
-    current = time.time()
-    #Iterate over the list
-    for q, (timestamp, key, delay, values) in enumerate(queue):
-        #Check if item is past its next update time
-        category, time_type, time_range, source, contract, sex = key.split('-')
-        title, channel, name, avatar = values
-        channel = await client.fetch_channel(channel)
-        if timestamp <= current:
-            #check if last update time is within the past n-seconds
-            #check if LAST_UPDATE[key] exists
-            if not LAST_UPDATE.get(key, None):
-                LAST_UPDATE[key] = 0
-                
-            if current - LAST_UPDATE[key] > UPDATE_DELAY:
-                #If the last update is outdated, gather new data
-                data = get_data(
-                    category, time_type, time_range, source, contract, sex, CSRFTOKEN
-                )
-                if data is not None:
-                    DATABASE[key] = data
-
-                await refresh_names()
 
-                #update LAST_UPDATE
-                LAST_UPDATE[key] = current
-                
-                await update_data_and_update_time()
+    #Boards are kept fresh by refresh_boards, only gather the boards of
+    #due items that were never fetched before, all at once
+    missing = []
+    for eid, (timestamp, key, delay, values) in due:
+        if key not in DATABASE and key not in missing:
+            missing.append(key)
+    if missing:
+        await asyncio.gather(*[refresh_board(key) for key in missing])
+
+    #Group the embeds per channel, (kept embeds, embeds deleted after an hour)
+    posts = {}
+    for eid, entry in due:
+        timestamp, key, delay, values = entry
+        try:
+            emb, st, rank_no = await build_entry_embed(key, values)
+            threshold, last_rank = values[4], values[5]
+            #notify on change mode, skip if the rank didn't move enough since
+            #the last rank that was posted
+            if threshold and not rank_changed(last_rank, rank_no, threshold):
+                continue
+            values[5] = rank_no
+            kept, temporary = posts.setdefault(values[1], ([], []))
+            if st:
+                kept.append(emb)
+            else:
+                temporary.append(emb)
+        except Exception as e:
+            print("Cannot post tracked book!", key, values[0])
+            print("Error!", e)
+        finally:
+            entry = TRACKING_LIST.reschedule(eid, entry, next_time(entry, current))
+            if entry is not None:
+                JOURNAL.save_tracked(entry) #committed with the rest of the tick
+
+    await JOURNAL.flush()
+    await asyncio.gather(*[
+        send_embeds(cid, kept, temporary)
+        for cid, (kept, temporary) in posts.items()
+    ])
+
+
+def next_time(entry, current):
+    #update timestamp until it's over the current time
+    timestamp, key, delay, values = entry
+    while timestamp < current:
+        timestamp += delay
+    return timestamp
+
+
+async def build_entry_embed(key, values):
+    category = key.split('-')[0]
+    title, channel, name, avatar = values[:4]
+    rank, cover_link, n_title = await iterate_over_database(
+        category, title, key, values[6]
+    )
+    if n_title is not None:
+        title = n_title
+    if values[6] is None:
+        #Entries tracked before bookIds were kept, saved with the reschedule.
+        #Only bound when the title is exactly on the boards
+        values[6] = resolve_title(title)[0]
+    emb, st = build_rank_embed(
+        category, title, rank, cover_link, name, avatar
+    )
+    return emb, st, (rank[0] if rank is not None else None)
 
-            #build the embed
-            rank, cover_link, n_title = await iterate_over_database(
-                category, title, key
-            )
-            if n_title is not None:
-                title = n_title
-            
-            try:
-                emb, st = build_rank_embed(
-                    category, title, rank, cover_link, name, avatar
-                )
-                if st:
-                    await channel.send(embed=emb)
-                else:
-                    await channel.send(embed=emb, delete_after=3600)
-                
-            except Exception as e:
-                print("Cannot send to channel!")
-                print("Error!", e)
 
-            #update timestamp until it's over the current time
-            while timestamp < current:
-                timestamp += delay
+def chunk_embeds(embeds):
+    #Discord allows 10 embeds and 6000 characters per message
+    chunk, size = [], 0
+    for emb in embeds:
+        if chunk and (len(chunk) == 10 or size + len(emb) > 6000):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(emb)
+        size += len(emb)
+    if chunk:
+        yield chunk
 
-            checked.append((timestamp, key, delay, values))
-            
-        else:
-            checked.append((timestamp, key, delay, values))
 
-    if q + 1 == len(checked):
-        TRACKING_LIST = checked.copy()
-        with open('tracking_list_backup.pkl', 'wb') as f:
-            pickle.dump(TRACKING_LIST, f)
-    else:
-        print("ERROR! Tracking list length changed!")
+async def send_embeds(cid, kept, temporary):
+    async with SEND_SEMAPHORE:
+        try:
+            channel = await CHANNELS.resolve(cid)
+            for chunk in chunk_embeds(kept):
+                with METRICS.timer('discord_send_seconds'):
+                    await channel.send(embeds=chunk)
+                METRICS.inc('discord_sends_total', kind='tracker')
+            for chunk in chunk_embeds(temporary):
+                with METRICS.timer('discord_send_seconds'):
+                    await channel.send(embeds=chunk, delete_after=3600)
+                METRICS.inc('discord_sends_total', kind='tracker')
+
+        except (discord.Forbidden, discord.NotFound) as e:
+            CHANNELS.invalidate(cid)
+            METRICS.inc('discord_send_errors_total', status=e.status)
+            print("Cannot send to channel!")
+            print("Error!", e)
+        except discord.HTTPException as e:
+            METRICS.inc('discord_send_errors_total', status=e.status)
+            if e.status == 429:
+                METRICS.inc('discord_rate_limits_total')
+            print("Cannot send to channel!")
+            print("Error!", e)
+        except Exception as e:
+            print("Cannot send to channel!")
+            print("Error!", e)
 
 
 #------------------------------------------------------------------------------
@@ -230,10 +680,15 @@ async def title_autocomplete(
     interaction: discord.Interaction,
     current: str,
 ):
-    titles = sorted(ALL_TITLES)
+    titles = ALL_TITLES.complete(current)
+    #Nothing contains what was typed, offer the titles it's a typo of
+    if len(titles) < ALL_TITLES.limit and len(current) >= 4:
+        for norm in TITLE_INDEX.matches(current, ALL_TITLES.limit - len(titles), prefix=True):
+            if TITLE_INDEX.names[norm] not in titles:
+                titles.append(TITLE_INDEX.names[norm])
     return [
         discord.app_commands.Choice(name=t, value=t)
-        for t in titles if current.lower() in t.lower()
+        for t in titles
     ]
 
 
@@ -299,7 +754,7 @@ async def ghost_ping_all_channels(interaction: discord.Interaction):
                 )
 
             for c in ch:
-                channel = await client.fetch_channel(c)
+                channel = await CHANNELS.resolve(c)
                 allowed_mentions = discord.AllowedMentions(everyone=True)
                 await channel.send(
                     "Keeping the channel alive!",
@@ -319,6 +774,75 @@ async def ghost_ping_all_channels(interaction: discord.Interaction):
         )
 
 
+#------------------------------------------------------------------------------
+@tree.command(
+    name='bot_stats',
+    description='Owner Only',
+)
+async def bot_stats(interaction: discord.Interaction):
+    if interaction.user.id == OWNER_ID:
+        emb = discord.Embed(
+            title='Bot Stats',
+            description=f'Up for {(time.time() - METRICS.started)/3600:.1f} hours',
+            colour=discord.Color.greyple(),
+            timestamp=datetime.datetime.now(),
+        )
+        latency = []
+        for name, label in [
+            ('wn_page_fetch_seconds', 'Page fetch'),
+            ('wn_board_fetch_seconds', 'Board fetch'),
+            ('tracker_tick_seconds', 'Tracker tick'),
+            ('event_loop_lag_seconds', 'Loop lag'),
+            ('discord_send_seconds', 'Discord send'),
+            ('storage_write_seconds', 'Storage write'),
+            ('offload_seconds', 'Offloaded call'),
+        ]:
+            h = METRICS.merged(name)
+            if h.count:
+                latency.append(
+                    f'{label:<14}n={h.count:<6} avg={1000*h.total/h.count:.1f}ms ' +\
+                    f'p95<={1000*h.quantile(0.95):.0f}ms max={1000*h.max:.0f}ms'
+                )
+        emb.add_field(
+            name='Latency',
+            value='```' + ('\n'.join(latency) or 'No data yet') + '```' +\
+            f'Loop stalls over {WATCHDOG.threshold}s: {WATCHDOG.stalls}',
+            inline=False,
+        )
+        stats = CRAWLER.stats
+        emb.add_field(
+            name='Crawler',
+            value=f'```Refreshes: {stats["refreshes"]} | Stable: {stats["stable"]}\n' +\
+            f'Pages: {stats["pages_fetched"]} of {stats["pages_baseline"]}\n' +\
+            f'Retries: {METRICS.total("wn_page_retries_total")} | ' +\
+            f'Captcha: {METRICS.total("wn_captcha_failures_total")}\n' +\
+            f'Circuit: {CRAWLER.breaker().state} | ' +\
+            f'Trips: {METRICS.total("wn_breaker_trips_total")}\n' +\
+            'Boards: {} valid, {} crawled, {} dead```'.format(*CATALOG.counts()),
+            inline=False,
+        )
+        emb.add_field(
+            name='Discord',
+            value=f'```Sends: {METRICS.total("discord_sends_total")} | ' +\
+            f'Errors: {METRICS.total("discord_send_errors_total")} | ' +\
+            f'Rate limits: {METRICS.total("discord_rate_limits_total")}\n' +\
+            f'Channels: {CHANNELS.stats["hits"]} hits, ' +\
+            f'{CHANNELS.stats["misses"]} misses, {CHANNELS.stats["api_calls"]} API calls```',
+            inline=False,
+        )
+        emb.add_field(
+            name='Startup',
+            value='```' + ', '.join(f'{k}: {v:.2f}s' for k, v in STARTUP.items()) + '```',
+            inline=False,
+        )
+        await interaction.response.send_message(embed=emb, ephemeral=True)
+    else:
+        await interaction.response.send_message(
+            'You must be the owner to use this command!',
+            ephemeral=True,
+        )
+
+
 #------------------------------------------------------------------------------
 @tree.command(
     name='help',
@@ -337,11 +861,15 @@ Below are this bot's commands:
 
 **get_rank(category, book_title)**
 **optional_parameters(time_range, content, contract)**
-Fetches the category ranking of a given book title. Using it without filling the optional parameters would return the book's ranking across all boards it could be seen on. I suggest using this first before adding the book to the tracker. ML or FL will automatically be detected.
+Fetches the category ranking of a given book title. I suggest using this first before adding the book to the tracker. ML or FL will automatically be detected.
+
+**book_profile(book_title)**
+Shows the book's ranking across all boards it could be seen on, in one go.
 
 **track_book(category, book_title, interval_hrs)**
 **optional_parameters(time_range, content, contract)**
 Adds the book under tracking and would repost the updated rank after every interval_hrs time elapsed. After adding it, the tracker would show run get_rank to check if the book's details were correct. For details of the optional_parameters, if you aren't sure, then just leave it to default.
+Set **notify_threshold** to only repost when the rank moved by at least that many places.
 
 **remove_from_tracker(category, book_title)**
 Removes a book from the tracker. You must use the command on the same channel that the current tracker is posting at, otherwise, it wouldn't be able to remove your book from tracker.
@@ -370,6 +898,8 @@ Removes a book from the tracker. You must use the command on the same channel th
     book_title='Enter the title of the book. Please be as accurate as possible.',
     interval_hrs='The amount of time before the bot will repost' +\
     ' your current rankings again.',
+    notify_threshold='Only repost when the rank moved by at least this many' +\
+    ' places. Leave at 0 to repost every interval.',
 )
 @discord.app_commands.choices(
     category=[
@@ -421,8 +951,8 @@ async def track_book(
     content: str,
     contract: str,
     sex: str,
+    notify_threshold: int = 0,
 ):
-    global TRACKING_LIST
     await interaction.response.defer() #wait for bot  to reply without timeout
     
     try: #overall try case
@@ -438,30 +968,21 @@ async def track_book(
             resp += "You entered an invalid interval! Defaulting to 1.0 hours! "
             interval_hrs = 1.0
 
-        time_range, time_type = filter_values(category, time_range, time_type)
-            
+        #Track the book by its bookId and the title as it is on the boards
+        book_id, name = resolve_title(book_title)
+        book_title = name or string.capwords(book_title)
 
         #Check if not duplicate:
-        rem = False
-        remo_i = None
-        own_key = build_key(category, time_type, time_range, content, contract, sex)
-        
-        for n, i in enumerate(TRACKING_LIST):
-            timestamp, key, delay, values = i
-            title, channel, name, avatar = values
-            if (category.lower() == key.split('-')[0].lower()) and (
-                title.lower() == book_title.lower()) and (
-                    interaction.channel.id == channel):
-                rem = True
-                remo_i = int(n)
-                break
-        if rem:
+        own_key = canonical(category, time_type, time_range, content, contract, sex)
+        old = TRACKING_LIST.remove(interaction.channel.id, category, book_title)
+        if old is not None:
             print("Popping!!")
-            TRACKING_LIST.pop(remo_i) #Remove old and renew
+            JOURNAL.delete_tracked(old) #Remove old and renew
             
         delay = int(3600*interval_hrs)
 
-        book_title = string.capwords(book_title)
+        if notify_threshold > 0:
+            resp += f'Posting only when the rank moves by {notify_threshold} or more! '
         try:
             await interaction.followup.send(
                 resp + f'Tracking the book **"{book_title}"** '+\
@@ -469,27 +990,32 @@ async def track_book(
                 f'every {interval_hrs:.1f} hours!',
             )
             
-            TRACKING_LIST.append(
-                (time.time(),
-                 own_key,
-                 delay,
-                 [book_title, interaction.channel.id,
-                  interaction.user.display_name,
-                  interaction.user.display_avatar.url],
-                 )
+            entry = (
+                time.time(),
+                own_key,
+                delay,
+                [book_title, interaction.channel.id,
+                 interaction.user.display_name,
+                 interaction.user.display_avatar.url,
+                 max(0, notify_threshold), None, book_id,
+                 interaction.guild_id],
             )
+            TRACKING_LIST.push(entry)
             #check if it's already on the LAST_UPDATE dictionary
             if not LAST_UPDATE.get(own_key, None):
-                LAST_UPDATE[own_key] = 0            
-                with open('last_update_times.pkl', 'wb') as f:
-                    pickle.dump(LAST_UPDATE, f)
+                LAST_UPDATE[own_key] = 0
+                if ROLE == 'shard':
+                    #last_update belongs to the crawler, ask it for the
+                    #board instead
+                    await offload(STORAGE.request_refresh, own_key)
+                else:
+                    JOURNAL.set_last_update(own_key, 0)
 
-            with open('tracking_list_backup.pkl', 'wb') as f:
-                pickle.dump(TRACKING_LIST, f)
+            await JOURNAL.save_tracked(entry)
                 
         except:
             print("Cannot track the book! No permission to send message!")
-        await check_update_queue() #call upon addition of new task
+        TRACKER_WAKE.set() #call upon addition of new task
         
     except Exception as e:
         await interaction.followup.send(
@@ -525,24 +1051,16 @@ async def remove_from_tracker(
     category: str,
     book_title: str,
 ):
-    global TRACKING_LIST
-    new_tracker = []
-    cnt = 0
-
-    for timestamp, key, delay, values in TRACKING_LIST:
-        title, channel, name, avatar = values
-        cat = key.split('-')[0]
-        if (category == cat) and (book_title.lower() == title.lower()) and (interaction.channel.id == channel):
-            cnt += 1
-        else:
-            new_tracker.append((timestamp, key, delay, values))
-            
-    TRACKING_LIST = new_tracker.copy()
+    old = TRACKING_LIST.remove(interaction.channel.id, category, book_title)
+    if old is None:
+        #Tracked under the title as it is on the boards
+        name = resolve_title(book_title)[1]
+        if name is not None:
+            old = TRACKING_LIST.remove(interaction.channel.id, category, name)
+    if old is not None:
+        await JOURNAL.delete_tracked(old)
     
-    with open('tracking_list_backup.pkl', 'wb') as f:
-        pickle.dump(TRACKING_LIST, f)
-    
-    if cnt:
+    if old is not None:
         msg = f'Successfully removed **{string.capwords(book_title)}** from **{category.capitalize()}** tracker!'
     else:
         msg = f"Book is not being tracked under **{category}**! Please check "+\
@@ -550,7 +1068,7 @@ async def remove_from_tracker(
 
     await interaction.response.send_message(msg)
     
-    await check_update_queue() #call upon addition of new task
+    TRACKER_WAKE.set() #call upon addition of new task
 
 
 #------------------------------------------------------------------------------
@@ -561,13 +1079,12 @@ async def remove_from_tracker(
 async def admin_check_tracked(
     interaction: discord.Interaction,
 ):
-    global TRACKING_LIST
     msg = 'ID: CATEGORY, TITLE, CHANNEL_ID\n'
     if interaction.user.id == OWNER_ID:
         items = []
         for n, i in enumerate(TRACKING_LIST):
             timestamp, key, delay, values = i
-            title, channel, name, avatar = values
+            title, channel = values[:2]
             items.append((n, key.split('-')[0], title, channel))
         msg += '\n'.join([f'**Item {n}**: {i} ({j} {k})' for n, i, j, k in items])
         await interaction.response.send_message(msg, ephemeral=True)
@@ -587,20 +1104,19 @@ async def admin_remove_tracked(
     interaction: discord.Interaction,
     d: str
 ):
-    global TRACKING_LIST
-    
     if interaction.user.id == OWNER_ID:
         d = int(d)
-        name = TRACKING_LIST[d][3][2]
-        category = TRACKING_LIST[d][1].split('-')[0]
+        timestamp, key, delay, values = list(TRACKING_LIST)[d]
+        name = values[2]
+        category = key.split('-')[0]
         
-        new_tracker = [i for n, i in enumerate(TRACKING_LIST) if n != d]
-        TRACKING_LIST = new_tracker.copy()
+        old = TRACKING_LIST.remove(values[1], category, values[0])
+        await JOURNAL.delete_tracked(old)
         
         msg = f'Successfully removed **{string.capwords(name)}** from **{category.capitalize()}** tracker!'
         await interaction.response.send_message(msg, ephemeral=True)
         
-        await check_update_queue() #call upon addition of new task
+        TRACKER_WAKE.set() #call upon addition of new task
     else:
         await interaction.response.send_message(
             'You must be the owner to use this command!',
@@ -608,6 +1124,108 @@ async def admin_remove_tracked(
         )
 
 
+#------------------------------------------------------------------------------
+async def backup_day_autocomplete(
+    interaction: discord.Interaction,
+    current: str,
+) -> list[app_commands.Choice[str]]:
+    days = await offload(BACKUPS.days)
+    return [
+        app_commands.Choice(name=day, value=day)
+        for day in reversed(days) if day.startswith(current)
+    ][:25]
+
+
+async def board_key_autocomplete(
+    interaction: discord.Interaction,
+    current: str,
+) -> list[app_commands.Choice[str]]:
+    return [
+        app_commands.Choice(name=key, value=key)
+        for key in CATALOG.search(current)
+    ]
+
+
+@tree.command(
+    name='admin_backup',
+    description='Owner Only',
+)
+@discord.app_commands.describe(
+    action='What to do with the backups.',
+    day='Day of the backup, as YYYY-MM-DD.',
+    key='Only this board, e.g. power_rank-0-1-2-1-1.',
+)
+@discord.app_commands.choices(
+    action=[
+        discord.app_commands.Choice(name='List', value='list'),
+        discord.app_commands.Choice(name='Inspect', value='inspect'),
+        discord.app_commands.Choice(name='Restore', value='restore'),
+    ],
+)
+@discord.app_commands.autocomplete(
+    day=backup_day_autocomplete,
+    key=board_key_autocomplete,
+)
+async def admin_backup(
+    interaction: discord.Interaction,
+    action: str,
+    day: str = '',
+    key: str = '',
+):
+    if interaction.user.id != OWNER_ID:
+        await interaction.response.send_message(
+            'You must be the owner to use this command!',
+            ephemeral=True,
+        )
+        return
+    await interaction.response.defer(ephemeral=True)
+    if action != 'list':
+        try:
+            datetime.datetime.strptime(day, '%Y-%m-%d')
+        except ValueError:
+            await interaction.followup.send(
+                f'Enter the day as YYYY-MM-DD, not **{day}**!', ephemeral=True,
+            )
+            return
+
+    try:
+        if action == 'list':
+            days = await offload(BACKUPS.days)
+            objects, size = await offload(BACKUPS.usage)
+            msg = f'{len(days)} backups, {objects} boards stored in {size/2**20:.1f}MB\n' +\
+                  ', '.join(days[-20:])
+        elif action == 'inspect':
+            info = await offload(BACKUPS.inspect, day)
+            if info is None:
+                msg = f'There is no backup of **{day}**!'
+            elif key:
+                boards = await offload(BACKUPS.load, day, [key])
+                if key in boards:
+                    msg = f'**{key}** on **{day}**:\n' + '\n'.join(
+                        f'{rankNo}. {bookName} ({amount})'
+                        for rankNo, bookId, updateId, bookName, amount in boards[key][:10]
+                    )
+                else:
+                    msg = f'There is no board **{key}** in the backup of **{day}**!'
+            else:
+                msg = f'**{day}**: {info["boards"]} boards, {info["changed"]} changed since ' +\
+                      f'the previous backup ({info["new_bytes"]/1024:.0f}KB new, ' +\
+                      f'{info["bytes"]/1024:.0f}KB in total)'
+        else:
+            boards = await offload(BACKUPS.load, day, [key] if key else None)
+            if not boards:
+                msg = f'There is nothing to restore from **{day}**!'
+            else:
+                for k, rows in boards.items():
+                    await restore_board(k, rows)
+                msg = f'Restored {len(boards)} boards from **{day}**!'
+        await interaction.followup.send(msg, ephemeral=True)
+    except Exception as e:
+        await interaction.followup.send(
+            'Sorry, some error occurred!\n'+str(e), ephemeral=True,
+        )
+
+
 #------------------------------------------------------------------------------
 @tree.command(
     name='get_rank',
@@ -669,9 +1287,8 @@ async def get_rank(
 ):
     await interaction.response.defer()
     try:
-        time_range, time_type = filter_values(category, time_range, time_type)
-                
-        key = build_key(category, time_type, time_range, content, contract, sex)
+        key = canonical(category, time_type, time_range, content, contract, sex)
+        REFRESHER.note_request(key)
         rank, cover_link, n_title = await iterate_over_database(
                     category, book_title, key
                 )
@@ -696,6 +1313,231 @@ async def get_rank(
             )
 
     
+#------------------------------------------------------------------------------
+@tree.command(
+    name='rank_history',
+    description='Show the rank trajectory of a book over a date range.',
+)
+@discord.app_commands.describe(
+    book_title='Enter the title of the book. Please be as accurate as possible.',
+    start='Start date as YYYY-MM-DD, defaults to 30 days ago.',
+    end='End date as YYYY-MM-DD, defaults to today.',
+)
+@discord.app_commands.choices(
+    category=[
+        discord.app_commands.Choice(name='Powerstone', value='power_rank'),
+        discord.app_commands.Choice(name='Trending', value='best_sellers'),
+        discord.app_commands.Choice(name='Collections', value='collection_rank'),
+        discord.app_commands.Choice(name='Popular', value='popular_rank'),
+        discord.app_commands.Choice(name='Update', value='update_rank'),
+        discord.app_commands.Choice(name='Active', value='engagement_rank'),
+        discord.app_commands.Choice(name='Fandom', value='fandom_rank'),
+    ],
+)
+@discord.app_commands.autocomplete(
+    book_title=title_autocomplete
+)
+async def rank_history(
+    interaction: discord.Interaction,
+    book_title: str,
+    category: str = '',
+    start: str = '',
+    end: str = '',
+):
+    await interaction.response.defer()
+    try:
+        try:
+            end_date = datetime.datetime.strptime(end, '%Y-%m-%d') if end else datetime.datetime.now()
+            start_date = datetime.datetime.strptime(start, '%Y-%m-%d') if start else end_date - datetime.timedelta(days=30)
+        except ValueError:
+            await interaction.followup.send(
+                "Sorry, you've entered an invalid date! Please use YYYY-MM-DD."
+            )
+            return
+        #Include the whole end day
+        end_date = end_date.replace(hour=23, minute=59, second=59)
+
+        book_ids = {str(v[1]) for v in TITLE_INDEX.boards(book_title).values()}
+        book_ids.update(await offload(HISTORY.book_ids, book_title))
+        points = {}
+        for book_id in book_ids:
+            points.update(await offload(
+                HISTORY.query,
+                book_id, start_date.timestamp(), end_date.timestamp(), category
+            ))
+
+        emb = build_history_embed(
+            book_title, points, start_date, end_date,
+            interaction.user.display_name,
+            interaction.user.display_avatar.url,
+        )
+        await interaction.followup.send(embed=emb)
+
+    except Exception as e:
+        await interaction.followup.send(
+                'Sorry, some error occurred!\n'+str(e),
+            )
+
+
+#------------------------------------------------------------------------------
+@tree.command(
+    name='book_profile',
+    description='Show every board a book is currently placed on.',
+)
+@discord.app_commands.describe(
+    book_title='Enter the title of the book. Please be as accurate as possible.',
+)
+@discord.app_commands.autocomplete(
+    book_title=title_autocomplete
+)
+async def book_profile(
+    interaction: discord.Interaction,
+    book_title: str,
+):
+    #Answered from the indexes only, nothing is fetched
+    placements, cover_link = book_placements(book_title)
+    emb = build_profile_embed(
+        resolve_title(book_title)[1] or book_title,
+        placements,
+        cover_link,
+        interaction.user.display_name,
+        interaction.user.display_avatar.url,
+    )
+    await interaction.response.send_message(embed=emb)
+
+
+def book_placements(title):
+    #Every (key, rankNo, amount) of the books with this title, and a cover
+    boards = TITLE_INDEX.boards(title)
+    placements = []
+    for bookId in sorted({v[1] for v in boards.values()}):
+        placements += BOOK_INDEX.placements(bookId)
+    cover_link = None
+    if boards:
+        rankNo, bookId, updateId, amount = next(iter(boards.values()))
+        cover_link = f'https://book-pic.webnovel.com/bookcover/{bookId}?imageMogr2/thumbnail/150&imageId={updateId}'
+    return placements, cover_link
+
+
+#------------------------------------------------------------------------------
+def build_profile_embed(book_title, placements, cover_link, name, url):
+    #placements are (key, rankNo, amount), one field per category
+    emb = discord.Embed(
+        title='Book Profile',
+        description=f'**Title: {book_title}**\n' +
+        f'Placed on {len(placements)} boards\n',
+        colour=discord.Color.greyple(),
+        timestamp=datetime.datetime.now(),
+    )
+    emb.set_author(
+        name=name,
+        icon_url=url
+    )
+    if not placements:
+        emb.add_field(
+            name="Book not in any of the rankings!",
+            value='Please check the spelling of the book ' +\
+            f'title and try again: **{book_title}**',
+            inline=False,
+        )
+        return emb
+
+    categories = {}
+    for key, rankNo, amount in placements:
+        categories.setdefault(key.split('-')[0], []).append((key, rankNo, amount))
+    for category in category_list:
+        if category not in categories:
+            continue
+        lines = []
+        for key, rankNo, amount in categories[category]:
+            _, time_type, time_range, source, contract, sex = key.split('-')
+            line = f'#{rankNo:<4}' + ('' if category == 'best_sellers' else f'({amount}) ') +\
+                f'{TR[time_range]}/{rank_id_list[time_type]}/{SC[source]}/{SX[sex]}/{SG[contract]}'
+            lines.append(line)
+        #Fields hold at most 1024 characters
+        shown = []
+        for n, line in enumerate(lines):
+            if sum(len(l) + 1 for l in shown) + len(line) > 960:
+                shown.append(f'... and {len(lines) - n} more')
+                break
+            shown.append(line)
+        field_name = f'{rankNames[category]} ({len(lines)})'
+        value = '```' + '\n'.join(shown) + '```'
+        if len(emb) + len(field_name) + len(value) > 6000:
+            break
+        emb.add_field(
+            name=field_name,
+            value=value,
+            inline=False,
+        )
+    if cover_link:
+        emb.set_thumbnail(url=cover_link)
+    return emb
+
+
+#------------------------------------------------------------------------------
+def describe_key(key):
+    #Readable name of the board a key points to
+    category, time_type, time_range, source, contract, sex = key.split('-')
+    time_type = rank_id_list[time_type]
+    time_range = TR[time_range]
+    source = SC[source]
+    contract = SG[contract]
+    sex = SX[sex]
+    return f'| Release: {time_type.replace("_", " ").title()} |' +\
+        f'Range: {time_range.replace("_", " ").title()} |' +\
+        f'Sex: {sex.title()} | ' +\
+        f'Content: {source.title()} | ' +\
+        f'Status: {contract.title()} |'
+
+
+#------------------------------------------------------------------------------
+def build_history_embed(book_title, points, start_date, end_date, name, url):
+    emb = discord.Embed(
+        title='Rank History',
+        description=f'**Title: {book_title}**\n' +
+        f'From {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}\n',
+        colour=discord.Color.greyple(),
+        timestamp=datetime.datetime.now(),
+    )
+    emb.set_author(
+        name=name,
+        icon_url=url
+    )
+    if not points:
+        emb.add_field(
+            name="No rank history found!",
+            value='Please check the spelling of the book ' +\
+            f'title and the dates and try again: **{book_title}**',
+            inline=False,
+        )
+        return emb
+
+    #Discord allows at most 25 fields of 1024 characters each, and 6000
+    #characters for the whole embed
+    for key in sorted(points)[:25]:
+        series = points[key]
+        step = max(1, -(-len(series) // 15))
+        shown = series[::step]
+        if shown[-1] is not series[-1]:
+            shown.append(series[-1])
+        lines = [
+            f'{datetime.datetime.fromtimestamp(t):%m-%d}: #{r}' +
+            ('' if key.startswith('best_sellers') else f' ({a})')
+            for t, r, a in shown
+        ]
+        field_name = f"{rankNames[key.split('-')[0]]} {describe_key(key)}"
+        value = '```' + '\n'.join(lines) + '```'
+        if len(emb) + len(field_name) + len(value) > 6000:
+            break
+        emb.add_field(
+            name=field_name,
+            value=value,
+            inline=False,
+        )
+    return emb
+
+
 #------------------------------------------------------------------------------
 def build_rank_embed(category, book_title, rankings, cover_link, name, url):
     try:
@@ -726,12 +1568,7 @@ def build_rank_embed(category, book_title, rankings, cover_link, name, url):
 
     if rankings is not None:
         rank, key, value = rankings
-        category, time_type, time_range, source, contract, sex = key.split('-')
-        time_type = rank_id_list[time_type]
-        time_range = TR[time_range]
-        source = SC[source]
-        contract = SG[contract]
-        sex = SX[sex]
+        category = key.split('-')[0]
 
         value_str = f'```Rank: {rank}'
         if category == 'best_sellers':
@@ -740,11 +1577,7 @@ def build_rank_embed(category, book_title, rankings, cover_link, name, url):
             value_str += f' | Value: {value}```'
         
         emb.add_field(
-            name=f'| Release: {time_type.replace("_", " ").title()} |' +\
-            f'Range: {time_range.replace("_", " ").title()} |' +\
-            f'Sex: {sex.title()} | ' +\
-            f'Content: {source.title()} | ' +\
-            f'Status: {contract.title()} |',
+            name=describe_key(key),
             value=value_str,
             inline=False,
         )
@@ -769,132 +1602,39 @@ def build_rank_embed(category, book_title, rankings, cover_link, name, url):
 
 
 #------------------------------------------------------------------------------
-async def iterate_over_database(category, title, key):
-    #Check if the item was updated before, if not, add the key
-    if not LAST_UPDATE.get(key, None):
-        LAST_UPDATE[key] = 0
-        
-    if not DATABASE.get(key, None):
-        print("Fetching Data for category:", category)
-        rankId, listType, timeType, sourceType, signStatus, sex = key.split('-')
-        data = get_data(rankId, listType, timeType, sourceType, signStatus, sex)
-        if data is not None: DATABASE[key] = data
-        await refresh_names()
-        LAST_UPDATE[key] = time.time()
-        #update Database file
-        await update_data_and_update_time()
-
-    elif time.time() - LAST_UPDATE[key] > UPDATE_DELAY:
-        print("Updating Data for category:", category)
-        rankId, listType, timeType, sourceType, signStatus, sex = key.split('-')
-        data = get_data(rankId, listType, timeType, sourceType, signStatus, sex)
-        if data is not None: DATABASE[key] = data
-        await refresh_names()
-        LAST_UPDATE[key] = time.time()
-        #update Database file
-        await update_data_and_update_time()
-        
-    for rankNo, bookId, updateId, bookName, amount in DATABASE[key]:
-        if bookName.lower() == title.lower():
-            return (rankNo, key, amount), f'https://book-pic.webnovel.com/bookcover/{bookId}?imageMogr2/thumbnail/150&imageId={updateId}', bookName
+def resolve_title(title):
+    #(bookId, bookName) of the book on the boards with this title, case,
+    #accents and punctuation aside. Misspelled titles are (None, None), they
+    #are only suggested by title_autocomplete
+    norm = TITLE_INDEX.match(title)
+    if norm is None:
+        return None, None
+    rankNo, bookId, updateId, amount = next(iter(TITLE_INDEX.titles[norm].values()))
+    return bookId, TITLE_INDEX.names[norm]
+
+
+async def iterate_over_database(category, title, key, book_id=None):
+    #Outdated boards are refreshed in the background, only a board that was
+    #never fetched before is waited for
+    await ensure_board(key)
+
+    item = BOOK_INDEX.lookup(book_id, key) if book_id else None
+    if item is None:
+        item = TITLE_INDEX.lookup(title, key)
+    if item is not None:
+        rankNo, bookId, updateId, amount, bookName = item
+        return (rankNo, key, amount), f'https://book-pic.webnovel.com/bookcover/{bookId}?imageMogr2/thumbnail/150&imageId={updateId}', bookName
     return None, None, None
 
 
 #------------------------------------------------------------------------------
-def get_link(
-    csrfToken=CSRFTOKEN, #token used, probably refreshes after certain time passes
-    pageIndex=1, #Page index from 1 to 10
-    rankId='best_sellers', #Rank ID, specific to rankings
-    listType=0, #
-    noType=1, #Novel=1, Fanfic=4, or Comic=2
-    rankName='Trending', #Rank Name, specific to each RankId
-    timeType=3, #24hr=5, weekly=3, monthly=4, all-time=1
-    sourceType=2, #all=0, translated=1, original=2
-    sex=1, #male=1, female=2
-    signStatus=1, #Contracted or not
-    ):
-    items = [f'pageIndex={pageIndex}', f'rankId={rankId}', f'listType={listType}', f'type={noType}', f'rankName={rankName}',
-             f'timeType={timeType}', f'sourceType={sourceType}', f'sex={sex}']
-    
-    if rankName == 'Power':
-        items += [f'signStatus={signStatus}',]
-        
-    random.shuffle(items)
-    base_url = 'https://www.webnovel.com'
-    path = f"/go/pcm/category/getRankList?_csrfToken={csrfToken}&" + '&'.join(items)
-    url = base_url + path
-    headers = get_headers(path)
-    return url, headers
-
-
-#------------------------------------------------------------------------------
-def get_headers(path):
-    headers = {'authority': 'www.webnovel.com', 'method': 'GET', 'scheme': 'https', 'Accept': 'application/json, text/javascript, */*; q=0.01', 'Accept-Encoding': 'gzip, deflate, br, zstd', 'Accept-Language': 'en-US,en;q=0.9',
-               'Cookie': f'webnovel-language=en; webnovel-content-language=en; bookCitysex=1; show_gift_tip=1; para-comment-tip-show=1; show_lib_tip=1; QDReport_utm=utm_source%3DnoahActivity; __zlcmid=1LImeDfz2451vVV; NEXT_LOCALE=en; wn_show_first_charge_modal=; charge_selected_payments=paypal; _csrfToken={CSRFTOKEN}; uid=4300026489; ukey=uXnz1f67uhq; webnovel_uuid=1719526890_1946123745; _fsae=1719580024477; checkInTip=1; e2=%7B%22pid%22%3A%22bookstore%22%2C%22l1%22%3A%2299%22%7D; e1=%7B%22pid%22%3A%22bookstore%22%2C%22l1%22%3A%221%22%2C%22eid%22%3A%22qi_A_home_rankingshoverclick%22%7D',
-               'Priority': 'u=1, i', 'Referer': 'https://www.webnovel.com/ranking/novel/all_time/best_sellers', 'Sec-Ch-Ua': '"Not/A)Brand";v="8", "Chromium";v="126", "Google Chrome";v="126"', 'Sec-Ch-Ua-Mobile': '?0', 'Sec-Ch-Ua-Platform': '"Windows"', 'Sec-Fetch-Dest': 'empty', 'Sec-Fetch-Site': 'same-origin', 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36', 'X-Requested-With': 'XMLHttpRequest'}
-    headers['path'] = path
-    
-    return headers
-
-
-#------------------------------------------------------------------------------
-def get_data(rankId, listType, timeType, sourceType, signStatus, sex, csrfToken=CSRFTOKEN, error_count=0):
-    print(datetime.datetime.now(), "Getting new data!", rankId, listType,timeType, sourceType, sex, signStatus, "retries:", error_count)
-    keep_data = ['rankNo', 'bookId', 'coverUpdateTime', 'bookName', 'amount']
-    rankName = rankNames[rankId]
-    rank_data = []
-    for n in range(1, 11):
-        url, headers = get_link(
-            csrfToken=csrfToken,
-            listType=listType,
-            pageIndex=n,
-            rankId=rankId,
-            rankName=rankName,
-            timeType=timeType,
-            sourceType=sourceType,
-            sex=sex,
-            signStatus=signStatus,
-        )
-        session = requests.Session()
-        response = session.get(url, headers=headers)
-
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                #if data is blank, that means ranking list is complete, break immediately
-                if not len(data['data']['bookItems']):
-                    break
-                
-                keep = [[i[j] for j in keep_data] for i in data['data']['bookItems']]
-                rank_data += keep
-            except requests.exceptions.JSONDecodeError as e:
-                print("ERROR! Need Verification Captcha!", response)
-                raise ValueError("Crawler raised a requests.exceptions.JSONDecodeError with status_code 200 response! Need verification!")
-            
-        else:
-            print(f"Failed to fetch data. Status code: {response.status_code}")
-            #retry just in case
-            return get_data(rankId, listType, timeType, sourceType,
-                            signStatus, sex, csrfToken=csrfToken,
-                            error_count=error_count+1)
-    return rank_data
-
-def filter_values(category, tr, ty):
-    time_range, time_type = tr, ty
-    if category == 'best_sellers':
-        #should always be contracted
-        contract = '1'
-        
-    elif category == 'power_rank':
-        if time_range == '5':
-            time_range = '3'
-    else:
-        time_type='0'
-        
-        #Only Trending has the Daily ranking range
-        if time_range == '5' or ((time_range == '0') and (category in ['update_rank', 'engagement_rank'])):
-            time_range = '3'
-    return time_range, time_type
+async def get_data(rankId, listType, timeType, sourceType, signStatus, sex, csrfToken=CSRFTOKEN):
+    CRAWLER.csrfToken = csrfToken
+    key = build_key(rankId, listType, timeType, sourceType, signStatus, sex)
+    return await CRAWLER.fetch_board(
+        rankId, rankNames[rankId], listType, timeType, sourceType, signStatus, sex,
+        previous=DATABASE.get(key),
+    )
 
 
 #------------------------------------------------------------------------------
@@ -950,21 +1690,19 @@ async def add_birthday(
             exists = True
             break
         
+    entry = (
+        month, day, year,
+        member.name, member.id,
+        interaction.channel.id
+    )
     if not exists:
-        BIRTHDAY_LIST[guild_id].append((
-            month, day, year,
-            member.name, member.id,
-            interaction.channel.id
-        ))
+        BIRTHDAY_LIST[guild_id].append(entry)
     else:
-        BIRTHDAY_LIST[guild_id][q] = (
-            month, day, year,
-            member.name, member.id,
-            interaction.channel.id
-        )
+        BIRTHDAY_LIST[guild_id][q] = entry
+    BIRTHDAYS.add(guild_id, entry)
+    BIRTHDAY_WAKE.set()
             
-    with open('birthday_tracker.json', 'w') as f:
-        json.dump(BIRTHDAY_LIST, f)
+    await JOURNAL.save_birthday(guild_id, entry)
 
     await interaction.response.send_message(
         "Successfully added birthday!" +\
@@ -1005,36 +1743,113 @@ async def view_birthday(
 
     
 #------------------------------------------------------------------------------
-@tasks.loop(seconds=3600)
+async def timezone_autocomplete(
+    interaction: discord.Interaction,
+    current: str,
+) -> list[app_commands.Choice[str]]:
+    if not TIMEZONES:
+        TIMEZONES.extend(sorted(zoneinfo.available_timezones()))
+    current = current.lower()
+    return [
+        app_commands.Choice(name=tz, value=tz)
+        for tz in TIMEZONES if current in tz.lower()
+    ][:25]
+
+TIMEZONES = [] #every IANA timezone name, read on first use
+
+
+@tree.command(
+    name='birthday_timezone',
+    description='Sets the timezone the birthdays of this server are announced in.',
+)
+@discord.app_commands.describe(
+    timezone='Timezone name, like Asia/Manila or America/New_York.',
+)
+@discord.app_commands.autocomplete(
+    timezone=timezone_autocomplete
+)
+@discord.app_commands.default_permissions(manage_guild=True)
+async def birthday_timezone(
+    interaction: discord.Interaction,
+    timezone: str,
+):
+    if get_timezone(timezone) is None:
+        await interaction.response.send_message(
+            f"Sorry, I don't know the timezone **{timezone}**! " +\
+            "Please pick one from the list.",
+            ephemeral=True
+        )
+        return
+    guild_id = str(interaction.guild_id)
+    BIRTHDAYS.set_timezone(guild_id, timezone)
+    BIRTHDAY_WAKE.set()
+    await JOURNAL.save_timezone(guild_id, timezone)
+    await interaction.response.send_message(
+        f"Birthdays of this server will be announced at {ANNOUNCE_HOUR}:00 **{timezone}** time!"
+    )
+
+
+#------------------------------------------------------------------------------
+@tasks.loop(seconds=0)
 async def check_birthdays():
-    global BIRTHDAY_LIST
-    date = datetime.datetime.now()
-    mm, dd, yy, hh = date.month, date.day, date.year, date.hour
-    if (hh != 6):
+    #Sleeps until the next birthdays are due in their guild's timezone, or
+    #until a birthday or timezone is changed
+    BIRTHDAY_WAKE.clear()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    upcoming = BIRTHDAYS.next_announcement(now)
+    timeout = 86400 if upcoming is None else min(86400, (upcoming[0] - now).total_seconds())
+    try:
+        await asyncio.wait_for(BIRTHDAY_WAKE.wait(), timeout=max(0, timeout))
+        return #something changed, look again
+    except asyncio.TimeoutError:
+        pass
+    if upcoming is None or datetime.datetime.now(datetime.timezone.utc) < upcoming[0]:
         return
-    
-    print("Checking birthdays...", end=' ')
-    
-    for key in BIRTHDAY_LIST.keys():
-        for m, d, y, name, mid, cid in BIRTHDAY_LIST[key]:
-            channel = await client.fetch_channel(cid)
-            if (mm == int(m)) and (dd == int(d)) and (yy == int(y)):
-                #Birthday matches
-                try:
-                    allowed_mentions = discord.AllowedMentions(everyone=True)
-                    
-                    await channel.send(
-                        f"# @everyone wish <@{mid}> a verry happy birthday today!",
-                        allowed_mentions=allowed_mentions
-                    )
-                    
-                except Exception as e:
-                    print("Cannot send to channel!")
-                    print("Error!", e)
+    when, items = upcoming
+    #Birthdays changed while waiting are left out
+    items = [(g, e) for g, e in items if BIRTHDAYS.entries.get((g, e[4])) is e and owns_guild(g)]
+
+    channels = {}
+    for guild, (m, d, y, name, mid, cid) in items:
+        channels.setdefault(cid, []).append(mid)
+    print(datetime.datetime.now(), f"Announcing {len(items)} birthdays in {len(channels)} channels...")
+    await asyncio.gather(*[
+        send_birthdays(cid, members)
+        for cid, members in channels.items()
+    ])
     print("Complete!")
 
+
+async def send_birthdays(cid, members):
+    #One message per channel, split to stay under 2000 characters
+    async with SEND_SEMAPHORE:
+        try:
+            channel = await CHANNELS.resolve(cid)
+            allowed_mentions = discord.AllowedMentions(everyone=True)
+            for i in range(0, len(members), 50):
+                mentions = [f'<@{mid}>' for mid in members[i:i + 50]]
+                if len(mentions) > 1:
+                    mentions = ', '.join(mentions[:-1]) + ' and ' + mentions[-1]
+                else:
+                    mentions = mentions[0]
+                await channel.send(
+                    f"# @everyone wish {mentions} a verry happy birthday today!",
+                    allowed_mentions=allowed_mentions
+                )
+                METRICS.inc('discord_sends_total', kind='birthday')
+
+        except (discord.Forbidden, discord.NotFound) as e:
+            CHANNELS.invalidate(cid)
+            print("Cannot send to channel!")
+            print("Error!", e)
+        except Exception as e:
+            print("Cannot send to channel!")
+            print("Error!", e)
+
                     
 #------------------------------------------------------------------------------
 if __name__ == "__main__":
-    client.run(TOKEN)
-    pass
+    if ROLE == 'crawler':
+        asyncio.run(run_crawler())
+    else:
+        client.run(TOKEN)
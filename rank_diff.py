@@ -0,0 +1,62 @@
+#------------------------------------------------------------------------------
+class BoardDiff:
+    '''
+    Difference between two snapshots of a board, keyed by bookId.
+
+    moved: {bookId: (old rankNo, new rankNo)} for books whose rank changed
+    entered: {bookId: new rankNo} for books that are new on the board
+    dropped: {bookId: old rankNo} for books that left the board
+    titles: {bookId: bookName} of every book above
+    '''
+    def __init__(self):
+        self.moved = {}
+        self.entered = {}
+        self.dropped = {}
+        self.titles = {}
+
+    def __bool__(self):
+        return bool(self.moved or self.entered or self.dropped)
+
+    def delta(self, bookId):
+        #Places gained (positive) or lost (negative), None if not moved
+        if bookId in self.moved:
+            old, new = self.moved[bookId]
+            return old - new
+        return None
+
+    def summary(self):
+        return f'{len(self.moved)} moved, {len(self.entered)} new, {len(self.dropped)} dropped'
+
+
+def diff_boards(old_rows, new_rows):
+    #One pass over each list
+    diff = BoardDiff()
+    old = {}
+    for rankNo, bookId, updateId, bookName, amount in old_rows or []:
+        if bookId not in old:
+            old[bookId] = (rankNo, bookName)
+
+    seen = set()
+    for rankNo, bookId, updateId, bookName, amount in new_rows:
+        if bookId in seen:
+            continue
+        seen.add(bookId)
+        item = old.pop(bookId, None)
+        if item is None:
+            diff.entered[bookId] = rankNo
+            diff.titles[bookId] = bookName
+        elif item[0] != rankNo:
+            diff.moved[bookId] = (item[0], rankNo)
+            diff.titles[bookId] = bookName
+
+    for bookId, (rankNo, bookName) in old.items():
+        diff.dropped[bookId] = rankNo
+        diff.titles[bookId] = bookName
+    return diff
+
+
+def rank_changed(old_rank, new_rank, threshold):
+    #Whether a tracked book moved enough to be announced
+    if old_rank is None or new_rank is None:
+        return old_rank != new_rank
+    return abs(old_rank - new_rank) >= threshold
@@ -0,0 +1,85 @@
+import time
+from collections import deque
+
+TRACKED_WEIGHT = 5 #A tracked entry counts as this many recent get_rank calls
+RECENT_WINDOW = 6*3600 #get_rank calls older than this are forgotten
+
+
+#------------------------------------------------------------------------------
+class RefreshScheduler:
+    '''
+    Decides which board should be refreshed next.
+
+    Every known key is refreshed once per `window` seconds, and the fetches
+    are spaced evenly over the window instead of coming in bursts. When
+    several keys are due, the ones referenced by more tracked entries and
+    recent get_rank calls go first.
+    '''
+    def __init__(self, window=1800, recent_window=RECENT_WINDOW):
+        self.window = window
+        self.recent_window = recent_window
+        self.requests = {} #key: deque of get_rank call timestamps
+        self.last_fetch = 0
+        self.swept = 0 #when the keys nobody asked for lately were last dropped
+
+    def note_request(self, key, now=None):
+        #Calls are trimmed here too, keys that are never scored (a shard
+        #never picks a key, dead keys are never due) don't pile them up
+        now = time.time() if now is None else now
+        self.requests.setdefault(key, deque()).append(now)
+        self.recent_requests(key, now)
+        if now - self.swept > 60:
+            self.swept = now
+            for k in list(self.requests):
+                self.recent_requests(k, now)
+
+    def recent_requests(self, key, now):
+        calls = self.requests.get(key)
+        if calls is None:
+            return 0
+        while calls and now - calls[0] > self.recent_window:
+            calls.popleft()
+        if not calls:
+            del self.requests[key]
+        return len(calls)
+
+    def spacing(self, n_keys):
+        #Time between two fetches so that every key fits inside the window
+        return self.window / max(1, n_keys)
+
+    def priorities(self, keys, tracked, now=None):
+        #tracked is {key: number of tracking entries}
+        now = time.time() if now is None else now
+        return {
+            key: TRACKED_WEIGHT*tracked.get(key, 0) + self.recent_requests(key, now)
+            for key in keys
+        }
+
+    def next_key(self, keys, last_update, tracked, now=None, busy=()):
+        #Returns the key to fetch now, or None if it's not yet time to fetch.
+        #Keys in busy are being fetched already
+        now = time.time() if now is None else now
+        keys = list(keys)
+        spacing = self.spacing(len(keys))
+        if now - self.last_fetch < spacing:
+            return None
+
+        #Refresh a bit before the data goes stale so commands read warm data
+        due = [
+            k for k in keys
+            if k not in busy and now - last_update.get(k, 0) > self.window - spacing
+        ]
+        if not due:
+            return None
+        score = self.priorities(due, tracked, now)
+        return max(due, key=lambda k: (score[k], now - last_update.get(k, 0)))
+
+    def mark_fetched(self, now=None, spacing=0):
+        #With spacing, the next slot is counted from this one instead of from
+        #now, so checking once a second doesn't round every gap up. At most
+        #one slot of catching up is kept
+        now = time.time() if now is None else now
+        if spacing:
+            self.last_fetch = max(self.last_fetch + spacing, now - spacing)
+        else:
+            self.last_fetch = now
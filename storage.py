@@ -0,0 +1,471 @@
+import os
+import json
+import hashlib
+import time
+import pickle
+import sqlite3
+import datetime
+import threading
+from collections.abc import MutableMapping
+
+from board import Board
+from metrics import METRICS
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS boards (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS last_update (
+    key TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tracking (
+    key TEXT NOT NULL,
+    channel INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    delay INTEGER NOT NULL,
+    name TEXT,
+    avatar TEXT,
+    threshold INTEGER NOT NULL DEFAULT 0,
+    last_rank INTEGER,
+    book_id TEXT,
+    guild INTEGER,
+    PRIMARY KEY (key, channel, title)
+);
+CREATE TABLE IF NOT EXISTS birthdays (
+    guild TEXT NOT NULL,
+    member INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    name TEXT,
+    channel INTEGER NOT NULL,
+    PRIMARY KEY (guild, member)
+);
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild TEXT PRIMARY KEY,
+    timezone TEXT
+);
+CREATE TABLE IF NOT EXISTS board_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refresh_requests (
+    key TEXT PRIMARY KEY,
+    requested REAL NOT NULL
+);
+'''
+KEEP_CHANGES = 10000 #board_changes rows kept for the readers to catch up
+
+
+def digest(text):
+    #Stands in for a board's JSON when checking whether it changed
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+#------------------------------------------------------------------------------
+class Storage:
+    '''
+    SQLite (WAL mode) storage of the bot state.
+
+    Boards, last update times, the tracking list and birthdays each live in
+    their own table, and every save only writes the rows that changed.
+
+    Several processes can share the file, every board write is logged in
+    board_changes for the readers to follow, and readers ask the writer
+    for boards through refresh_requests.
+    '''
+    def __init__(self, path='rankings.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        #Every commit is synced to disk, the small writes are batched by
+        #journal.Journal so there are few of them
+        self.conn.execute('PRAGMA synchronous=FULL')
+        #Reads go through a memory map of the file instead of read() calls
+        self.conn.execute('PRAGMA mmap_size=268435456')
+        self.conn.executescript(SCHEMA)
+        #Databases made before the notify threshold was added
+        columns = [c[1] for c in self.conn.execute('PRAGMA table_info(tracking)')]
+        if 'threshold' not in columns:
+            self.conn.execute('ALTER TABLE tracking ADD COLUMN threshold INTEGER NOT NULL DEFAULT 0')
+            self.conn.execute('ALTER TABLE tracking ADD COLUMN last_rank INTEGER')
+        #and before tracking by bookId
+        if 'book_id' not in columns:
+            self.conn.execute('ALTER TABLE tracking ADD COLUMN book_id TEXT')
+        #and before the guild was kept for the shards
+        if 'guild' not in columns:
+            self.conn.execute('ALTER TABLE tracking ADD COLUMN guild INTEGER')
+        self.conn.commit()
+        self.saved_boards = {} #key: digest of the data last written
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def is_empty(self):
+        with self.lock:
+            for table in ('boards', 'last_update', 'tracking', 'birthdays'):
+                if self.conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+                    return False
+        return True
+
+    #--------------------------------------------------------------------------
+    def board_keys(self):
+        with self.lock:
+            return [k for k, in self.conn.execute('SELECT key FROM boards')]
+
+    def load_board(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT data FROM boards WHERE key=?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        self.saved_boards[key] = digest(row[0])
+        return Board(json.loads(row[0]))
+
+    def load_boards(self, keys=None):
+        #Every board, or only the given keys
+        with self.lock:
+            if keys is None:
+                rows = self.conn.execute('SELECT key, data FROM boards').fetchall()
+            else:
+                keys = list(keys)
+                rows = self.conn.execute(
+                    f'SELECT key, data FROM boards WHERE key IN ({",".join("?"*len(keys))})',
+                    keys
+                ).fetchall()
+        self.saved_boards.update((k, digest(v)) for k, v in rows)
+        return {k: Board(json.loads(v)) for k, v in rows}
+
+    def save_board(self, key, data, timestamp=None):
+        #Only writes the board if its content changed since the last save
+        text = json.dumps(data, default=list)
+        with METRICS.timer('storage_write_seconds', table='boards'), self.lock, self.conn:
+            self._save_board(key, text)
+            if timestamp is not None:
+                self._set_last_update(key, timestamp)
+
+    def _save_board(self, key, text):
+        text_digest = digest(text)
+        if self.saved_boards.get(key) != text_digest:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO boards (key, data) VALUES (?, ?)',
+                (key, text)
+            )
+            self.saved_boards[key] = text_digest
+            self._publish(key)
+
+    #--------------------------------------------------------------------------
+    def _publish(self, key):
+        seq = self.conn.execute(
+            'INSERT INTO board_changes (key, timestamp) VALUES (?, ?)',
+            (key, time.time())
+        ).lastrowid
+        if seq % 1000 == 0:
+            self.conn.execute('DELETE FROM board_changes WHERE seq <= ?', (seq - KEEP_CHANGES,))
+
+    def publish_board(self, key):
+        #Tells the readers to reload the board even if it didn't change
+        with self.lock, self.conn:
+            self._publish(key)
+
+    def last_change(self):
+        with self.lock:
+            return self.conn.execute('SELECT MAX(seq) FROM board_changes').fetchone()[0] or 0
+
+    def changes_since(self, seq):
+        #[(seq, key, timestamp)] of the board writes after seq, oldest first
+        with self.lock:
+            return self.conn.execute(
+                'SELECT seq, key, timestamp FROM board_changes WHERE seq > ? ORDER BY seq', (seq,)
+            ).fetchall()
+
+    def request_refresh(self, key):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO refresh_requests (key, requested) VALUES (?, ?)',
+                (key, time.time())
+            )
+
+    def take_refresh_requests(self):
+        #Keys asked for since the last call
+        with self.lock, self.conn:
+            keys = [k for k, in self.conn.execute('SELECT key FROM refresh_requests')]
+            self.conn.execute('DELETE FROM refresh_requests')
+        return keys
+
+    #--------------------------------------------------------------------------
+    def load_last_update(self):
+        with self.lock:
+            return dict(self.conn.execute('SELECT key, timestamp FROM last_update'))
+
+    def set_last_update(self, key, timestamp):
+        with METRICS.timer('storage_write_seconds', table='last_update'), self.lock, self.conn:
+            self._set_last_update(key, timestamp)
+
+    def _set_last_update(self, key, timestamp):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO last_update (key, timestamp) VALUES (?, ?)',
+            (key, timestamp)
+        )
+
+    #--------------------------------------------------------------------------
+    def load_tracking(self):
+        #Same layout as TRACKING_LIST, (timestamp, build_key, interval,
+        #[title, channel, name, avatar, threshold, last_rank, book_id, guild])
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT timestamp, key, delay, title, channel, name, avatar, '
+                'threshold, last_rank, book_id, guild FROM tracking ORDER BY timestamp'
+            ).fetchall()
+        return [(t, k, d, list(values)) for t, k, d, *values in rows]
+
+    def tracked_keys(self):
+        #{build_key: number of tracking entries}
+        with self.lock:
+            return dict(self.conn.execute('SELECT key, COUNT(*) FROM tracking GROUP BY key'))
+
+    def save_tracking(self, tracking_list):
+        #Diff the list against the stored rows and only write the changes
+        new = {}
+        for timestamp, key, delay, values in tracking_list:
+            #Entries saved before the notify threshold have 4 values
+            title, channel, name, avatar, threshold, last_rank, book_id, guild = \
+                list(values) + [0, None, None, None][len(values) - 4:]
+            new[(key, channel, title)] = (timestamp, delay, name, avatar, threshold, last_rank, book_id, guild)
+        with self.lock, self.conn:
+            old = {
+                (k, c, t): tuple(v) for k, c, t, *v in
+                self.conn.execute(
+                    'SELECT key, channel, title, timestamp, delay, name, avatar, '
+                    'threshold, last_rank, book_id, guild FROM tracking'
+                )
+            }
+            removed = [item for item in old if item not in new]
+            changed = [
+                item + value for item, value in new.items()
+                if old.get(item) != value
+            ]
+            self.conn.executemany(
+                'DELETE FROM tracking WHERE key=? AND channel=? AND title=?', removed
+            )
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO tracking '
+                '(key, channel, title, timestamp, delay, name, avatar, threshold, last_rank, book_id, guild) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', changed
+            )
+
+    def save_tracked(self, entry):
+        with METRICS.timer('storage_write_seconds', table='tracking'), self.lock, self.conn:
+            self._save_tracked(entry)
+
+    def _save_tracked(self, entry):
+        timestamp, key, delay, values = entry
+        #Entries saved before the notify threshold have 4 values
+        title, channel, name, avatar, threshold, last_rank, book_id, guild = \
+            list(values) + [0, None, None, None][len(values) - 4:]
+        self.conn.execute(
+            'INSERT OR REPLACE INTO tracking '
+            '(key, channel, title, timestamp, delay, name, avatar, threshold, last_rank, book_id, guild) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, channel, title, timestamp, delay, name, avatar, threshold, last_rank, book_id, guild)
+        )
+
+    def delete_tracked(self, entry):
+        with METRICS.timer('storage_write_seconds', table='tracking'), self.lock, self.conn:
+            self._delete_tracked(entry)
+
+    def _delete_tracked(self, entry):
+        timestamp, key, delay, values = entry
+        title, channel = values[0], values[1]
+        self.conn.execute(
+            'DELETE FROM tracking WHERE key=? AND channel=? AND title=?',
+            (key, channel, title)
+        )
+
+    #--------------------------------------------------------------------------
+    def load_birthdays(self):
+        #Same layout as BIRTHDAY_LIST, {guild: [(mm, dd, yyyy, name, id, channel)]}
+        birthdays = {}
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT guild, month, day, year, name, member, channel '
+                'FROM birthdays ORDER BY rowid'
+            ).fetchall()
+        for guild, *entry in rows:
+            birthdays.setdefault(guild, []).append(tuple(entry))
+        return birthdays
+
+    def save_birthday(self, guild, entry):
+        with METRICS.timer('storage_write_seconds', table='birthdays'), self.lock, self.conn:
+            self._save_birthday(guild, entry)
+
+    def _save_birthday(self, guild, entry):
+        month, day, year, name, member, channel = entry
+        self.conn.execute(
+            'INSERT INTO birthdays (guild, member, month, day, year, name, channel) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (guild, member) DO UPDATE SET '
+            'month=excluded.month, day=excluded.day, year=excluded.year, '
+            'name=excluded.name, channel=excluded.channel',
+            (str(guild), member, month, day, year, name, channel)
+        )
+
+    def load_timezones(self):
+        #{guild: IANA timezone name} of the guilds that set one
+        with self.lock:
+            return dict(self.conn.execute(
+                'SELECT guild, timezone FROM guild_settings WHERE timezone IS NOT NULL'
+            ))
+
+    def save_timezone(self, guild, timezone):
+        with METRICS.timer('storage_write_seconds', table='guild_settings'), self.lock, self.conn:
+            self._save_timezone(guild, timezone)
+
+    def _save_timezone(self, guild, timezone):
+        self.conn.execute(
+            'INSERT INTO guild_settings (guild, timezone) VALUES (?, ?) '
+            'ON CONFLICT (guild) DO UPDATE SET timezone=excluded.timezone',
+            (str(guild), timezone)
+        )
+
+    #--------------------------------------------------------------------------
+    def apply(self, ops):
+        #Writes a batch of (method, args), e.g. ('save_tracked', (entry,)),
+        #in one transaction. Either all of them are saved or none.
+        with METRICS.timer('storage_write_seconds', table='batch'), self.lock, self.conn:
+            for method, args in ops:
+                getattr(self, '_' + method)(*args)
+
+    def checkpoint(self):
+        #Copies the WAL into the database file and empties it, returns
+        #(busy, wal pages, pages copied), busy when a reader held it back
+        with METRICS.timer('storage_write_seconds', table='checkpoint'), self.lock:
+            return self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+
+    #--------------------------------------------------------------------------
+    def export_boards(self, fname):
+        #Writes every board in the old RANKING_DATA.json layout
+        with open(fname, 'w') as f:
+            json.dump(self.load_boards(), f, default=list)
+
+    def migrate(self, ranking_file='RANKING_DATA.json',
+                tracking_file='tracking_list_backup.pkl',
+                update_file='last_update_times.pkl',
+                birthday_file='birthday_tracker.json'):
+        #One-shot import of the old JSON/pickle files into an empty database.
+        #Everything is read first and written in one transaction, a crash
+        #halfway leaves the database empty and the import runs again.
+        if not self.is_empty():
+            return False
+        print(datetime.datetime.now(), "Migrating saved files to", self.path)
+        boards, updates, tracking, birthdays = {}, {}, [], {}
+        if os.path.exists(ranking_file):
+            with open(ranking_file, 'r') as f:
+                boards = json.load(f)
+        if os.path.exists(update_file):
+            with open(update_file, 'rb') as f:
+                updates = pickle.load(f)
+        if os.path.exists(tracking_file):
+            with open(tracking_file, 'rb') as f:
+                tracking = pickle.load(f)
+        if os.path.exists(birthday_file):
+            with open(birthday_file, 'r') as f:
+                birthdays = json.load(f)
+        try:
+            with self.lock, self.conn:
+                for key, data in boards.items():
+                    self._save_board(key, json.dumps(data, default=list))
+                for key, timestamp in updates.items():
+                    self._set_last_update(key, timestamp)
+                for entry in tracking:
+                    self._save_tracked(entry)
+                for guild, entries in birthdays.items():
+                    for entry in entries:
+                        self._save_birthday(guild, entry)
+        except BaseException:
+            #Nothing was written
+            self.saved_boards.clear()
+            raise
+        return True
+
+
+#------------------------------------------------------------------------------
+class LazyBoards(MutableMapping):
+    '''
+    The stored boards by key, each one is only read and decoded from the
+    database the first time it's used. Iterating and membership tests only
+    need the keys. `on_load(key, board)` is called for every board read
+    from the database, so indexes can be filled in as boards come in.
+    '''
+    def __init__(self, storage, on_load=None):
+        self.storage = storage
+        self.on_load = on_load
+        self.loaded = {}
+        self.stored = set(storage.board_keys()) #keys not read yet
+
+    def __getitem__(self, key):
+        board = self.loaded.get(key)
+        if board is not None:
+            return board
+        if key not in self.stored:
+            raise KeyError(key)
+        board = self.storage.load_board(key)
+        self.stored.discard(key)
+        if board is None:
+            raise KeyError(key)
+        self.add(key, board)
+        return board
+
+    def __setitem__(self, key, board):
+        self.stored.discard(key)
+        self.loaded[key] = board
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.stored.discard(key)
+        self.loaded.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.loaded or key in self.stored
+
+    def __iter__(self):
+        yield from list(self.loaded)
+        yield from [k for k in self.stored if k not in self.loaded]
+
+    def __len__(self):
+        return len(self.loaded) + len(self.stored)
+
+    def clear(self):
+        self.loaded.clear()
+        self.stored.clear()
+
+    def pending(self):
+        #Keys of the boards that haven't been read yet
+        return list(self.stored)
+
+    def fill(self, boards):
+        #Adds boards read ahead of time, unless they were replaced meanwhile
+        for key, board in boards.items():
+            if key in self.stored:
+                self.stored.discard(key)
+                self.add(key, board)
+
+    def read_all(self):
+        #{key: board} of every board, for the backups. Runs in a thread, the
+        #boards not read yet are decoded here but not kept or indexed
+        boards = dict(self.loaded)
+        pending = [k for k in list(self.stored) if k not in boards]
+        boards.update(self.storage.load_boards(pending))
+        return boards
+
+    def add(self, key, board):
+        self.loaded[key] = board
+        if self.on_load is not None:
+            self.on_load(key, board)
@@ -0,0 +1,66 @@
+import sys
+import json
+import asyncio
+
+from aiohttp import web
+
+from crawler import RANK_PATH, KEEP_DATA
+
+PAGE_SIZE = 20
+
+
+#------------------------------------------------------------------------------
+def make_app(database, delay=0.0):
+    '''
+    Local stand-in for the Webnovel ranking endpoint. Serves the boards of
+    a RANKING_DATA.json style dict, PAGE_SIZE rows per page.
+    '''
+    #signStatus is only sent for the Power board, so also index the boards
+    #without it
+    loose = {}
+    for key, rows in database.items():
+        category, time_type, time_range, source, contract, sex = key.split('-')
+        loose.setdefault((category, time_type, time_range, source, sex), rows)
+
+    async def get_rank_list(request):
+        q = request.query
+        rows = database.get('-'.join([
+            q.get('rankId', ''), q.get('listType', ''), q.get('timeType', ''),
+            q.get('sourceType', ''), q.get('signStatus', ''), q.get('sex', ''),
+        ]))
+        if rows is None:
+            rows = loose.get((
+                q.get('rankId'), q.get('listType'), q.get('timeType'),
+                q.get('sourceType'), q.get('sex'),
+            ), [])
+        page = int(q.get('pageIndex', 1))
+        items = [
+            dict(zip(KEEP_DATA, row))
+            for row in rows[(page - 1)*PAGE_SIZE:page*PAGE_SIZE]
+        ]
+        if delay:
+            await asyncio.sleep(delay)
+        return web.json_response({'code': 0, 'data': {'bookItems': items}})
+
+    app = web.Application()
+    app.router.add_get(RANK_PATH, get_rank_list)
+    return app
+
+
+async def start(database, host='127.0.0.1', port=8765, delay=0.0):
+    #Starts the server on the running loop, call runner.cleanup() to stop
+    runner = web.AppRunner(make_app(database, delay))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+#------------------------------------------------------------------------------
+if __name__ == "__main__":
+    #python stub_server.py [RANKING_DATA.json] [port]
+    fname = sys.argv[1] if len(sys.argv) > 1 else 'RANKING_DATA.json'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    with open(fname, 'r') as f:
+        data = json.load(f)
+    print(f"Serving {len(data)} boards on http://127.0.0.1:{port}{RANK_PATH}")
+    web.run_app(make_app(data), host='127.0.0.1', port=port)
@@ -0,0 +1,29 @@
+import json
+
+from backups import BackupStore
+
+BOARD = [[1, '100', 1, 'Genetic Ascension', 500]]
+OTHER = [[1, '200', 1, 'Atticus’s Odyssey', 400]]
+
+
+#------------------------------------------------------------------------------
+def test_unchanged_boards_are_stored_once(tmp_path):
+    store = BackupStore(str(tmp_path))
+    assert store.snapshot({'a': BOARD, 'b': OTHER}, '2024-01-01')[0] == 2
+    assert store.snapshot({'a': BOARD, 'b': BOARD}, '2024-01-02')[0] == 0
+    assert store.usage()[0] == 2
+    assert store.days() == ['2024-01-01', '2024-01-02']
+    assert store.load('2024-01-02') == {'a': BOARD, 'b': BOARD}
+    assert store.inspect('2024-01-02')['changed'] == 0
+
+
+def test_import_legacy_keeps_the_files(tmp_path):
+    legacy = tmp_path / '2024-01-01.json'
+    legacy.write_text(json.dumps({'a': BOARD}))
+    (tmp_path / 'notes.json').write_text('{}')
+    store = BackupStore(str(tmp_path))
+    assert store.import_legacy() == 1
+    assert legacy.exists()
+    assert store.load('2024-01-01') == {'a': BOARD}
+    #Already in the store the next time
+    assert store.import_legacy() == 0
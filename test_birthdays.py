@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+
+from birthdays import BirthdayCalendar, ANNOUNCE_HOUR
+
+UTC = datetime.timezone.utc
+
+
+def make_calendar():
+    calendar = BirthdayCalendar(default_tz=UTC)
+    calendar.build({
+        '1': [(3, 14, 1990, 'pi', 10, 100), (2, 29, 2000, 'leap', 11, 100)],
+        '2': [(3, 14, 1985, 'tokyo', 20, 200)],
+    }, {'2': 'Asia/Tokyo'})
+    return calendar
+
+
+#------------------------------------------------------------------------------
+def test_add_replaces_the_member():
+    calendar = make_calendar()
+    calendar.add('1', (7, 1, 1990, 'pi', 10, 100))
+    assert len(calendar) == 3
+    assert calendar.on_day(datetime.date(2024, 3, 14)) == [('2', (3, 14, 1985, 'tokyo', 20, 200))]
+    assert calendar.remove('1', 10) == (7, 1, 1990, 'pi', 10, 100)
+    assert calendar.remove('1', 10) is None
+    assert (7, 1) not in calendar.days
+
+
+def test_feb_29():
+    calendar = make_calendar()
+    leap = ('1', (2, 29, 2000, 'leap', 11, 100))
+    assert calendar.on_day(datetime.date(2024, 2, 29)) == [leap]
+    assert calendar.on_day(datetime.date(2024, 2, 28)) == []
+    #Celebrated on Feb 28 in common years
+    assert calendar.on_day(datetime.date(2023, 2, 28)) == [leap]
+
+    when, found = calendar.next_announcement(datetime.datetime(2023, 2, 1, tzinfo=UTC))
+    assert when == datetime.datetime(2023, 2, 28, ANNOUNCE_HOUR, tzinfo=UTC)
+    assert found == [leap]
+    when, found = calendar.next_announcement(datetime.datetime(2024, 2, 1, tzinfo=UTC))
+    assert when == datetime.datetime(2024, 2, 29, ANNOUNCE_HOUR, tzinfo=UTC)
+
+
+def test_next_announcement_per_timezone():
+    calendar = make_calendar()
+    #Tokyo reaches 06:00 on March 14 first
+    when, found = calendar.next_announcement(datetime.datetime(2024, 3, 10, tzinfo=UTC))
+    assert when.astimezone(UTC) == datetime.datetime(2024, 3, 13, 21, tzinfo=UTC)
+    assert found == [('2', (3, 14, 1985, 'tokyo', 20, 200))]
+    when, found = calendar.next_announcement(when)
+    assert when == datetime.datetime(2024, 3, 14, ANNOUNCE_HOUR, tzinfo=UTC)
+    assert found == [('1', (3, 14, 1990, 'pi', 10, 100))]
+    #Wraps around to the next year
+    when, found = calendar.next_announcement(when)
+    assert when.astimezone(UTC) == datetime.datetime(2025, 2, 28, ANNOUNCE_HOUR, tzinfo=UTC)
+
+
+def test_unknown_timezone():
+    calendar = make_calendar()
+    with pytest.raises(ValueError):
+        calendar.set_timezone('1', 'Mars/Olympus')
+    assert calendar.timezone('1') is UTC
+    assert BirthdayCalendar(default_tz=UTC).next_announcement(datetime.datetime.now(UTC)) is None
@@ -0,0 +1,58 @@
+import json
+import threading
+
+import pytest
+
+from board import Board, BOOK_IDS, TITLES, Interner
+
+ROWS = [
+    [1, '100', 1700000000000, 'Genetic Ascension', 500],
+    [2, '200', None, 'Atticus’s Odyssey', None],
+    [3, '100', 1700000000001, 'Genetic Ascension', 0],
+]
+
+
+#------------------------------------------------------------------------------
+def test_round_trip():
+    board = Board(ROWS)
+    assert board.rows() == ROWS
+    assert list(board) == ROWS
+    assert board == ROWS
+    assert board[1] == ROWS[1]
+    assert board[-1] == ROWS[-1]
+    assert board[:2] == ROWS[:2]
+    assert len(board) == 3
+    assert json.dumps(board, default=list) == json.dumps(ROWS)
+    assert Board(board) == board
+    assert Board([]).rows() == []
+
+
+def test_index_errors():
+    board = Board(ROWS)
+    for i in (3, -4):
+        with pytest.raises(IndexError):
+            board[i]
+
+
+def test_values_are_interned():
+    a, b = Board(ROWS), Board([row[:] for row in ROWS])
+    assert a.books[0] == a.books[2] == b.books[0]
+    assert TITLES.values[a.titles[1]] == 'Atticus’s Odyssey'
+    assert BOOK_IDS.index['200'] == a.books[1]
+    #Only the columns, 8 bytes a number and 4 an interned value
+    assert a.nbytes() == 3*(8*3 + 4*2)
+
+
+def test_interner_across_threads():
+    interner = Interner()
+    values = [str(n % 50) for n in range(1000)]
+    threads = [
+        threading.Thread(target=lambda: [interner.add(v) for v in values])
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(interner) == 50
+    assert all(interner.values[interner.index[v]] == v for v in values)
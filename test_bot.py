@@ -0,0 +1,172 @@
+import os
+import asyncio
+import tempfile
+
+#The bot reads its settings from the environment when imported, the legacy
+#files of the repo are migrated into a throwaway database
+for name in ('AI_ID', 'OWNER_ID', 'SERVER_ID'):
+    os.environ.setdefault(name, '0')
+os.environ.setdefault('CSRFTOKEN', 'test')
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'rankings.db')
+os.environ['WN_BASE_URL'] = 'http://127.0.0.1:9'
+
+import new_wn_rankerbot as bot
+
+KEY = 'power_rank-0-1-2-1-1'
+
+
+#------------------------------------------------------------------------------
+def test_open_breaker_keeps_the_board_stale():
+    board = bot.DATABASE[KEY]
+    bot.LAST_UPDATE[KEY] = 1000.0
+    stored = bot.STORAGE.load_last_update()[KEY]
+    refreshed = bot.CATALOG.get(KEY).refreshed
+    breaker = bot.CRAWLER.breaker()
+    breaker.failure(trip=True)
+
+    async def main():
+        #Served from the saved board, the refresh is skipped
+        assert await bot.ensure_board(KEY) is board
+        await bot.FLIGHTS.inflight[KEY]
+
+    try:
+        asyncio.run(main())
+    finally:
+        breaker.success()
+        breaker.open_until = 0
+    assert bot.DATABASE[KEY] is board
+    assert bot.LAST_UPDATE[KEY] == 1000.0
+    assert bot.CATALOG.get(KEY).refreshed == refreshed
+    assert bot.STORAGE.load_last_update()[KEY] == stored
+
+
+class FakeInteraction:
+    #Only what the owner commands use
+    class User:
+        id = bot.OWNER_ID
+
+    def __init__(self):
+        self.user = self.User()
+        self.response = self
+        self.followup = self
+        self.sent = []
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send(self, msg, **kwargs):
+        self.sent.append(msg)
+
+
+def admin_backup(*args):
+    interaction = FakeInteraction()
+    asyncio.run(bot.admin_backup.callback(interaction, *args))
+    return interaction.sent
+
+
+def test_restore_backup(tmp_path, monkeypatch):
+    rows = [[1, '1', 1, 'Restored Book', 10], [2, '2', 1, 'Another Book', 5]]
+    monkeypatch.setattr(bot, 'BACKUPS', bot.BackupStore(str(tmp_path)))
+    bot.BACKUPS.snapshot({KEY: rows}, '2024-01-01')
+    diffs = []
+    monkeypatch.setattr(bot, 'DIFF_LISTENERS', [lambda key, diff: diffs.append(key)])
+
+    assert admin_backup('restore', '2024-01-01', KEY) == ['Restored 1 boards from **2024-01-01**!']
+    assert bot.DATABASE[KEY].rows() == rows
+    assert bot.TITLE_INDEX.lookup('restored book', KEY) is not None
+    #Not diffed, and served until the next refresh is due
+    assert diffs == []
+    assert bot.time.time() - bot.LAST_UPDATE[KEY] < 60
+    assert bot.STORAGE.load_board(KEY).rows() == rows
+
+
+def test_admin_backup_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'BACKUPS', bot.BackupStore(str(tmp_path)))
+    assert admin_backup('restore', 'yesterday', '') == ['Enter the day as YYYY-MM-DD, not **yesterday**!']
+    assert admin_backup('inspect', '2024-01-01', '') == ['There is no backup of **2024-01-01**!']
+    #A corrupt object still answers the interaction
+    bot.BACKUPS.snapshot({KEY: [[1, '1', 1, 'Book', 10]]}, '2024-01-01')
+    [digest] = bot.BACKUPS.manifest('2024-01-01').values()
+    with open(bot.BACKUPS.object_path(digest), 'wb') as f:
+        f.write(b'not gzip')
+    [msg] = admin_backup('restore', '2024-01-01', KEY)
+    assert msg.startswith('Sorry, some error occurred!')
+
+
+def test_answer_requests_keeps_publish_tasks(monkeypatch, capsys):
+    def fail(key):
+        raise RuntimeError('database is locked')
+    monkeypatch.setattr(bot.STORAGE, 'take_refresh_requests', lambda: [KEY])
+    monkeypatch.setattr(bot.STORAGE, 'publish_board', fail)
+    bot.LAST_UPDATE[KEY] = bot.time.time()
+
+    async def main():
+        await bot.answer_requests.coro()
+        assert len(bot.PUBLISHING) == 1
+        await asyncio.gather(*bot.PUBLISHING)
+        assert not bot.PUBLISHING
+
+    asyncio.run(main())
+    assert 'Cannot publish board! ' + KEY in capsys.readouterr().out
+
+
+def test_tracked_dead_boards_are_not_scheduled(monkeypatch):
+    dead = 'power_rank-0-1-2-1-2'
+    monkeypatch.setattr(bot, 'TRACKING_LIST', bot.TrackerQueue([
+        (0, dead, 3600, ['Book', 1, 'name', 'avatar', 0, None, None, None]),
+    ]))
+    bot.CATALOG.note_refresh(dead, pages=0)
+    try:
+        keys = bot.known_keys({dead: 1, 'power_rank-0-5-2-1-1': 1})
+    finally:
+        bot.CATALOG.get(dead).pages = None
+    assert dead not in keys
+    #Power has no 24h board
+    assert 'power_rank-0-5-2-1-1' not in keys
+    assert KEY in keys
+
+
+def test_backup_boards(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'BACKUPS', bot.BackupStore(str(tmp_path)))
+    new, written = bot.backup_boards('2024-01-02', 1704153600)
+    assert set(bot.BACKUPS.manifest('2024-01-02')) == set(bot.DATABASE)
+    assert '2024-01-02' in bot.HISTORY.recorded_days()
+
+
+def test_ensure_board_serves_stale_and_refreshes(monkeypatch):
+    board = bot.DATABASE[KEY]
+    fetched = []
+
+    async def load(key):
+        fetched.append(key)
+        await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(bot, 'load_board', load)
+    monkeypatch.setitem(bot.LAST_UPDATE, KEY, 0)
+
+    async def main():
+        #Answered right away from the stored board, refreshed once behind it
+        results = await asyncio.gather(*[bot.ensure_board(KEY) for _ in range(3)])
+        assert all(b is board for b in results)
+        assert KEY in bot.FLIGHTS
+        await bot.FLIGHTS.inflight[KEY]
+        #Fresh boards aren't refreshed
+        bot.LAST_UPDATE[KEY] = bot.time.time()
+        await bot.ensure_board(KEY)
+        assert KEY not in bot.FLIGHTS
+
+    asyncio.run(main())
+    assert fetched == [KEY]
+
+
+def embeds(*sizes):
+    return [bot.discord.Embed(description='x'*n) for n in sizes]
+
+
+def test_chunk_embeds_limits():
+    #At most 10 embeds per message
+    assert [len(c) for c in bot.chunk_embeds(embeds(*[10]*23))] == [10, 10, 3]
+    #and 6000 characters
+    chunks = list(bot.chunk_embeds(embeds(2500, 2500, 1000, 1, 4096, 4096)))
+    assert [[len(e) for e in c] for c in chunks] == [[2500, 2500, 1000], [1, 4096], [4096]]
+    assert list(bot.chunk_embeds([])) == []
@@ -0,0 +1,59 @@
+from catalog import BoardCatalog, canonical, DEAD_RECHECK
+
+RANK_NAMES = {
+    'best_sellers': 'Trending',
+    'power_rank': 'Power',
+    'collection_rank': 'Collect',
+    'popular_rank': 'Popular',
+    'update_rank': 'Update',
+    'engagement_rank': 'Active',
+    'fandom_rank': 'Fandom',
+}
+
+
+#------------------------------------------------------------------------------
+def test_canonical():
+    #Power has no 24h range
+    assert canonical('power_rank', '5', '5', '0', '0', '1') == 'power_rank-5-3-0-0-1'
+    assert canonical('power_rank', '5', '1', '0', '0', '1') == 'power_rank-5-1-0-0-1'
+    #Trending keeps its time types and ranges, always contracted
+    assert canonical('best_sellers', '4', '5', '2', '0', '2') == 'best_sellers-4-5-2-1-2'
+    #The rest only have the ranges other than 24h
+    assert canonical('fandom_rank', '4', '5', '1', '0', '1') == 'fandom_rank-0-3-1-1-1'
+    assert canonical('update_rank', '2', '4', '1', '0', '1') == 'update_rank-0-4-1-1-1'
+
+
+def test_canonical_is_idempotent():
+    catalog = BoardCatalog(RANK_NAMES)
+    for key in catalog:
+        assert canonical(*key.split('-')) == key
+
+
+def test_catalog_keys():
+    catalog = BoardCatalog(RANK_NAMES)
+    #Trending 5*4*3*2, Power 5*3*3*2*2, and 3*3*2 for the other five
+    assert len(catalog) == 120 + 180 + 5*18
+    assert 'power_rank-0-1-2-1-1' in catalog
+    assert 'power_rank-0-5-2-1-1' not in catalog
+    assert catalog.get('fandom_rank-0-3-1-1-1').rank_name == 'Fandom'
+    assert catalog.search('FANDOM_RANK-0-3', limit=4) == [
+        'fandom_rank-0-3-0-1-1', 'fandom_rank-0-3-0-1-2',
+        'fandom_rank-0-3-1-1-1', 'fandom_rank-0-3-1-1-2',
+    ]
+
+
+def test_dead_boards():
+    catalog = BoardCatalog(RANK_NAMES)
+    key, other = 'power_rank-0-1-2-1-1', 'power_rank-0-1-2-1-2'
+    catalog.note_refresh(key, pages=0, timestamp=1000)
+    catalog.note_refresh(other, pages=3, timestamp=1000)
+    catalog.note_refresh('not-a-key', pages=0, timestamp=1000)
+    assert catalog.dead(key, now=1000)
+    assert not catalog.dead(other, now=1000)
+    assert catalog.schedulable([key, other, 'not-a-key'], now=1000) == {other}
+    assert catalog.counts(now=1000) == (len(catalog), 2, 1)
+    #Tried again after DEAD_RECHECK
+    assert not catalog.dead(key, now=1000 + DEAD_RECHECK)
+    #A refresh without a page count keeps the last one
+    catalog.note_refresh(key, timestamp=5000)
+    assert catalog.get(key).pages == 0
@@ -0,0 +1,94 @@
+import asyncio
+
+import discord
+import pytest
+
+import channels
+from channels import ChannelCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Response:
+    status = 404
+    reason = 'Not Found'
+
+
+class FakeClient:
+    #Channels 1-99 are in the gateway cache, the rest need a REST call and
+    #ids from 1000 up don't exist
+    def __init__(self):
+        self.fetched = []
+
+    def get_channel(self, cid):
+        return ('gateway', cid) if cid < 100 else None
+
+    async def fetch_channel(self, cid):
+        self.fetched.append(cid)
+        if cid >= 1000:
+            raise discord.NotFound(Response(), 'Unknown Channel')
+        return ('rest', cid)
+
+
+def resolve(cache, cid):
+    return asyncio.run(cache.resolve(cid))
+
+
+#------------------------------------------------------------------------------
+def test_gateway_first():
+    client = FakeClient()
+    cache = ChannelCache(client)
+    assert resolve(cache, '5') == ('gateway', 5)
+    assert client.fetched == []
+    assert cache.stats == {'hits': 1, 'misses': 0, 'api_calls': 0}
+
+
+def test_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(channels.time, 'time', clock)
+    client = FakeClient()
+    cache = ChannelCache(client, ttl=60)
+    assert resolve(cache, 500) == ('rest', 500)
+    clock.now += 59
+    assert resolve(cache, 500) == ('rest', 500)
+    assert client.fetched == [500]
+    clock.now += 1
+    resolve(cache, 500)
+    assert client.fetched == [500, 500]
+    assert cache.stats == {'hits': 1, 'misses': 2, 'api_calls': 2}
+    cache.invalidate(500)
+    resolve(cache, 500)
+    assert client.fetched == [500, 500, 500]
+
+
+def test_lru():
+    client = FakeClient()
+    cache = ChannelCache(client, maxsize=2)
+    for cid in (100, 101, 100, 102):
+        resolve(cache, cid)
+    #101 was used least recently
+    assert list(cache.cache) == [100, 102]
+    resolve(cache, 101)
+    assert client.fetched == [100, 101, 102, 101]
+
+
+def test_missing_channels_are_remembered(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(channels.time, 'time', clock)
+    client = FakeClient()
+    cache = ChannelCache(client, missing_ttl=600)
+    for _ in range(3):
+        with pytest.raises(discord.NotFound):
+            resolve(cache, 1000)
+    assert client.fetched == [1000]
+    assert cache.stats['api_calls'] == 1
+    clock.now += 600
+    with pytest.raises(discord.NotFound):
+        resolve(cache, 1000)
+    assert client.fetched == [1000, 1000]
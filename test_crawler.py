@@ -0,0 +1,157 @@
+import asyncio
+
+import crawler
+import stub_server
+from crawler import CircuitBreaker, RankCrawler, SingleFlight
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_board(n, offset=0):
+    return [[i + 1, str(1000 + i + offset), 1, f'Book {i + offset}', 100 - i] for i in range(n)]
+
+
+async def crawl(database, boards):
+    #Fetches each (rankId, listType, timeType, sourceType, signStatus, sex,
+    #previous) through a RankCrawler pointed at the stub server
+    runner = await stub_server.start(database, port=0)
+    host, port = runner.addresses[0][:2]
+    spider = RankCrawler('token', concurrency=2, base_url=f'http://{host}:{port}', retries=1)
+    try:
+        results = []
+        for *options, previous in boards:
+            results.append(await spider.fetch_board(
+                options[0], 'Power', *options[1:], previous=previous
+            ))
+        return results, spider
+    finally:
+        await spider.close()
+        await runner.cleanup()
+
+
+#------------------------------------------------------------------------------
+def test_crawl_stub_server():
+    board = make_board(45)
+    database = {'power_rank-0-1-2-1-1': board}
+    (full, stable, missing), spider = asyncio.run(crawl(database, [
+        ('power_rank', '0', '1', '2', '1', '1', None),
+        ('power_rank', '0', '1', '2', '1', '1', board),
+        ('power_rank', '0', '1', '2', '1', '2', None),
+    ]))
+    assert full == board
+    #The first page didn't move, the crawl stops there
+    assert stable is board
+    assert missing == []
+    assert spider.page_counts[('power_rank', '0', '1', '2', '1', '1')] == 3
+    #The pages of an unknown board are all asked for at once, after that
+    #only the first page
+    assert spider.stats['pages_fetched'] == 10 + 1 + 1
+    assert spider.breaker().state == 'closed'
+
+
+def test_crawl_stub_server_changed():
+    old = make_board(45)
+    new = make_board(45, offset=1)
+    database = {'power_rank-0-1-2-1-1': new}
+    [rows], spider = asyncio.run(crawl(database, [
+        ('power_rank', '0', '1', '2', '1', '1', old),
+    ]))
+    assert rows == new
+    #Pages 1-3 known from the previous snapshot, no empty page asked for
+    assert spider.stats['pages_fetched'] == 3
+
+
+def test_breaker_opens_after_threshold(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(crawler.time, 'time', clock)
+    breaker = CircuitBreaker('host', threshold=3, cooldown=100)
+    for _ in range(2):
+        breaker.failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    #One probe after the cooldown, it failing doubles the wait
+    clock.now += 100
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.open_until == clock.now + 200
+
+    clock.now += 200
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == 'closed' and breaker.allow() and breaker.allow()
+
+
+def test_breaker_trip_and_max_cooldown(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(crawler.time, 'time', clock)
+    breaker = CircuitBreaker('host', cooldown=100, max_cooldown=300)
+    #A captcha opens it at once
+    breaker.failure(trip=True)
+    assert breaker.open_until == clock.now + 100
+    for wait in (200, 300, 300):
+        clock.now = breaker.open_until
+        assert breaker.allow()
+        breaker.failure()
+        assert breaker.open_until == clock.now + wait
+    #Retry-After overrides the cooldown
+    clock.now = breaker.open_until
+    breaker.failure(wait=30)
+    assert breaker.open_until == clock.now + 30
+
+
+def test_breaker_stuck_probe(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(crawler.time, 'time', clock)
+    breaker = CircuitBreaker('host', threshold=1, cooldown=10)
+    breaker.failure()
+    clock.now += 10
+    assert breaker.allow()
+    #The probe never reported back
+    clock.now += 30
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_single_flight_coalesces():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        flights = SingleFlight()
+        results = await asyncio.gather(*[flights.do('key', fetch) for _ in range(5)])
+        assert 'key' not in flights
+        #A later call starts a new fetch
+        return results + [await flights.do('key', fetch)]
+
+    assert asyncio.run(main()) == [1, 1, 1, 1, 1, 2]
+
+
+def test_single_flight_survives_cancelled_callers():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        return 'board'
+
+    async def main():
+        flights = SingleFlight()
+        caller = asyncio.ensure_future(flights.do('key', fetch))
+        await asyncio.sleep(0)
+        caller.cancel()
+        #The shared fetch keeps going for the other callers
+        assert await flights.do('key', fetch) == 'board'
+
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+from history import RankHistory
+
+KEY = 'power_rank-0-1-2-1-1'
+BOARD = [
+    [1, '100', 1, 'Awakening：The Infinite Evolution', 500],
+    [2, '200', 1, 'Ragnarök, Eternal Tragedy.', 400],
+]
+
+
+#------------------------------------------------------------------------------
+def test_book_ids_are_normalized(tmp_path):
+    history = RankHistory(str(tmp_path / 'rankings.db'))
+    assert history.record({KEY: BOARD}, 1000, '2024-01-01') == 2
+    assert history.book_ids('awakening: the infinite evolution') == ['100']
+    assert history.book_ids('Ragnarok Eternal Tragedy') == ['200']
+    assert history.book_ids('Ragnarok Eternal Tragedy 2') == []
+    assert history.query('100', 0, 2000) == {KEY: [(1000, 1, 500)]}
+    history.close()
+
+
+def test_lowercased_titles_are_normalized_on_open(tmp_path):
+    path = str(tmp_path / 'rankings.db')
+    history = RankHistory(path)
+    history.record({KEY: BOARD}, 1000, '2024-01-01')
+    with history.conn:
+        history.conn.execute("UPDATE history_titles SET norm=lower(title)")
+        history.conn.execute("DELETE FROM history_meta")
+    history.close()
+
+    history = RankHistory(path)
+    assert history.book_ids('Ragnarok Eternal Tragedy') == ['200']
+    history.close()
+
+
+def test_titles_are_only_normalized_once(tmp_path, monkeypatch):
+    path = str(tmp_path / 'rankings.db')
+    RankHistory(path).close()
+    calls = []
+    monkeypatch.setattr('history.normalize_title', lambda t: calls.append(t) or t)
+    history = RankHistory(path)
+    with history.conn:
+        history.conn.execute("INSERT INTO history_titles VALUES ('1', 'Title', 'title')")
+    history.close()
+    RankHistory(path).close()
+    assert calls == []
@@ -0,0 +1,84 @@
+from indexes import TitleIndex, TitleCompleter, normalize_title, edit_distance
+
+BOARD = [
+    [1, '100', 1, 'Genetic Ascension', 500],
+    [2, '200', 1, 'Awakening：The Infinite Evolution', 400],
+    [3, '300', 1, 'Ragnarök, Eternal Tragedy.', 300],
+    [4, '400', 1, 'Atticus’s Odyssey', 200],
+]
+
+
+def make_index():
+    index = TitleIndex()
+    index.build({'power_rank-0-1-2-1-1': BOARD})
+    return index
+
+
+#------------------------------------------------------------------------------
+def test_normalize_title():
+    assert normalize_title('Awakening：The  Infinite') == 'awakening the infinite'
+    assert normalize_title('Ragnarök!') == 'ragnarok'
+    assert normalize_title("Atticus's") == normalize_title('Atticus’s') == 'atticuss'
+    assert normalize_title('Beloved\xa0One') == 'beloved one'
+
+
+def test_edit_distance():
+    assert edit_distance('kitten', 'sitting', 3) == 3
+    assert edit_distance('kitten', 'sitting', 2) == 3 #over the bound
+    assert edit_distance('abc', 'abc', 0) == 0
+    assert edit_distance('', 'ab', 1) == 2
+    assert edit_distance('ascension', 'ascensoin', 2) == 2
+
+
+def test_lookup_ignores_punctuation_and_case():
+    index = make_index()
+    key = 'power_rank-0-1-2-1-1'
+    assert index.lookup('awakening: the infinite evolution', key)[1] == '200'
+    assert index.lookup('Ragnarok Eternal Tragedy', key)[1] == '300'
+    assert index.lookup("atticus's odyssey", key)[1] == '400'
+
+
+def test_sequel_is_not_matched():
+    #One edit away, but another book, only ever suggested
+    index = make_index()
+    key = 'power_rank-0-1-2-1-1'
+    assert index.match('Genetic Ascension 2') is None
+    assert index.lookup('Genetic Ascension 2', key) is None
+    assert index.boards('Genetic Ascension 2') == {}
+    assert index.matches('Genetic Ascension 2') == ['genetic ascension']
+
+
+def test_typo_suggestions():
+    index = make_index()
+    assert index.lookup('Genetic Ascensoin', 'power_rank-0-1-2-1-1') is None
+    assert index.matches('Genetic Ascensoin') == ['genetic ascension']
+    assert index.matches('genetc ascen', prefix=True) == ['genetic ascension']
+    assert index.matches('zzzz qqq') == []
+
+
+def test_update_board_matches_rebuild():
+    index = make_index()
+    key = 'power_rank-0-1-2-1-1'
+    new = BOARD[1:] + [[5, '500', 1, 'Genetic Ascension 2', 100]]
+    index.update_board(key, BOARD, new)
+    fresh = TitleIndex()
+    fresh.build({key: new})
+    assert index.titles == fresh.titles
+    assert index.words == fresh.words
+    assert index.variants == fresh.variants
+
+
+def test_completer_normalizes_queries():
+    completer = TitleCompleter()
+    completer.build({'k': BOARD})
+    assert completer.complete('awakening:') == ['Awakening：The Infinite Evolution']
+    assert completer.complete('ragnarok') == ['Ragnarök, Eternal Tragedy.']
+
+
+def test_completer_short_queries_only_match_prefixes():
+    completer = TitleCompleter()
+    completer.build({'k': BOARD})
+    assert completer.complete('at') == ['Atticus’s Odyssey']
+    assert completer.complete('od') == []
+    assert completer.complete('ody') == ['Atticus’s Odyssey']
+    assert len(completer.complete('')) == len(BOARD)
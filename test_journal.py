@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from journal import Journal
+from storage import Storage
+
+KEY = 'power_rank-0-1-2-1-1'
+
+
+def entry(title, timestamp=1000.0):
+    return (timestamp, KEY, 3600, [title, 1, 'name', 'avatar', 0, None, None, None])
+
+
+class CountingStorage(Storage):
+    def __init__(self, path):
+        super().__init__(path)
+        self.batches = []
+
+    def apply(self, ops):
+        self.batches.append(len(ops))
+        super().apply(ops)
+
+
+#------------------------------------------------------------------------------
+def test_writes_are_committed_together(tmp_path):
+    storage = CountingStorage(str(tmp_path / 'rankings.db'))
+
+    async def main():
+        journal = Journal(storage, delay=0.01)
+        done = [journal.save_tracked(entry(t)) for t in 'abc']
+        journal.set_last_update(KEY, 500.0)
+        journal.save_birthday('7', (1, 2, 2000, 'name', 5, 6))
+        assert await done[0] == 5
+        assert all(d is done[0] for d in done)
+        #The next write starts another batch
+        await journal.delete_tracked(entry('b'))
+
+    asyncio.run(main())
+    assert storage.batches == [5, 1]
+    assert [e[3][0] for e in storage.load_tracking()] == ['a', 'c']
+    assert storage.load_last_update() == {KEY: 500.0}
+    assert storage.load_birthdays() == {'7': [(1, 2, 2000, 'name', 5, 6)]}
+    storage.close()
+
+
+def test_flush(tmp_path):
+    storage = CountingStorage(str(tmp_path / 'rankings.db'))
+
+    async def main():
+        journal = Journal(storage, delay=3600)
+        journal.save_tracked(entry('a'))
+        await journal.flush()
+        assert journal.task is None
+        #Nothing queued
+        await journal.flush()
+
+    asyncio.run(main())
+    assert storage.batches == [1]
+    assert len(storage.load_tracking()) == 1
+    storage.close()
+
+
+def test_failed_batch_writes_nothing(tmp_path):
+    storage = CountingStorage(str(tmp_path / 'rankings.db'))
+
+    async def main():
+        journal = Journal(storage, delay=0.01)
+        journal.save_tracked(entry('a'))
+        #Short a value
+        done = journal.save_birthday('7', (1, 2, 2000, 'name', 5))
+        with pytest.raises(ValueError):
+            await done
+
+    asyncio.run(main())
+    assert storage.load_tracking() == []
+    storage.close()
@@ -0,0 +1,63 @@
+from rank_diff import diff_boards, rank_changed
+
+OLD = [
+    [1, '100', 1, 'Genetic Ascension', 500],
+    [2, '200', 1, 'Atticus’s Odyssey', 400],
+    [3, '300', 1, 'Ragnarök', 300],
+]
+
+
+#------------------------------------------------------------------------------
+def test_diff_boards():
+    new = [
+        [1, '200', 1, 'Atticus’s Odyssey', 600],
+        [2, '100', 1, 'Genetic Ascension', 500],
+        [3, '400', 1, 'New Book', 100],
+    ]
+    diff = diff_boards(OLD, new)
+    assert diff.moved == {'200': (2, 1), '100': (1, 2)}
+    assert diff.entered == {'400': 3}
+    assert diff.dropped == {'300': 3}
+    assert diff.titles['300'] == 'Ragnarök'
+    assert diff.delta('200') == 1
+    assert diff.delta('100') == -1
+    assert diff.delta('400') is None
+    assert diff.summary() == '2 moved, 1 new, 1 dropped'
+
+
+def test_diff_boards_unchanged():
+    #Only the amounts changed
+    new = [row[:4] + [row[4] + 1] for row in OLD]
+    assert not diff_boards(OLD, new)
+
+
+def test_diff_boards_first_crawl():
+    diff = diff_boards(None, OLD)
+    assert diff.entered == {'100': 1, '200': 2, '300': 3}
+    assert not diff.moved and not diff.dropped
+
+
+def test_diff_boards_duplicate_rows():
+    #A book listed twice only counts with its first row
+    new = OLD + [[4, '100', 1, 'Genetic Ascension', 500]]
+    assert not diff_boards(OLD, new)
+
+
+def test_rank_changed():
+    assert rank_changed(10, 7, 3)
+    assert rank_changed(7, 10, 3)
+    assert not rank_changed(10, 8, 3)
+    assert rank_changed(None, 5, 3) #first post
+    assert rank_changed(5, None, 3) #left the board
+    assert not rank_changed(None, None, 3)
+
+
+def test_rank_changed_from_last_posted():
+    #One place per tick never drifts past the threshold unnoticed, the rank
+    #is compared with the last posted one
+    last_posted, posted = 10, []
+    for rank in (9, 8, 7, 6, 5, 4):
+        if rank_changed(last_posted, rank, 3):
+            last_posted = rank
+            posted.append(rank)
+    assert posted == [7, 4]
@@ -0,0 +1,42 @@
+from refresher import RefreshScheduler, TRACKED_WEIGHT
+
+
+#------------------------------------------------------------------------------
+def test_requests_are_trimmed_without_scoring():
+    scheduler = RefreshScheduler(window=1800, recent_window=100)
+    for n in range(1000):
+        scheduler.note_request('a', now=n)
+    assert len(scheduler.requests['a']) == 101
+    #Keys nobody asked for lately are dropped on the next sweep
+    scheduler.note_request('b', now=1000)
+    scheduler.note_request('c', now=1200)
+    assert set(scheduler.requests) == {'c'}
+    assert scheduler.recent_requests('a', 1200) == 0
+
+
+def test_next_key_priorities():
+    scheduler = RefreshScheduler(window=1800)
+    last_update = {'a': 0, 'b': 0, 'c': 0, 'fresh': 10000}
+    keys = list(last_update)
+    scheduler.note_request('b', now=9999)
+    tracked = {'c': 1}
+    assert scheduler.priorities(keys, tracked, now=10000)['c'] == TRACKED_WEIGHT
+    assert scheduler.next_key(keys, last_update, tracked, now=10000) == 'c'
+    assert scheduler.next_key(keys, last_update, tracked, now=10000, busy={'c'}) == 'b'
+    #Spaced over the window, after the slot of catching up
+    for _ in range(2):
+        scheduler.mark_fetched(now=10000, spacing=scheduler.spacing(len(keys)))
+    assert scheduler.next_key(keys, last_update, tracked, now=10001) is None
+    assert scheduler.next_key(keys, last_update, tracked, now=10450) == 'c'
+
+
+def test_mark_fetched_keeps_the_pace():
+    scheduler = RefreshScheduler(window=1800)
+    scheduler.mark_fetched(now=1000, spacing=4.5)
+    assert scheduler.last_fetch == 995.5
+    #Counted from the previous slot, not from when the tick came
+    scheduler.mark_fetched(now=1001, spacing=4.5)
+    assert scheduler.last_fetch == 1000
+    #At most one slot of catching up after a pause
+    scheduler.mark_fetched(now=2000, spacing=4.5)
+    assert scheduler.last_fetch == 1995.5
@@ -0,0 +1,123 @@
+import json
+import pickle
+
+import pytest
+
+from storage import Storage, LazyBoards
+
+KEY = 'power_rank-0-1-2-1-1'
+BOARD = [[1, '100', 1, 'Genetic Ascension', 500]]
+
+
+def write_legacy(tmp_path, birthdays):
+    files = {
+        'ranking_file': tmp_path / 'RANKING_DATA.json',
+        'tracking_file': tmp_path / 'tracking_list_backup.pkl',
+        'update_file': tmp_path / 'last_update_times.pkl',
+        'birthday_file': tmp_path / 'birthday_tracker.json',
+    }
+    files['ranking_file'].write_text(json.dumps({KEY: BOARD}))
+    #An entry from before the notify threshold, 4 values
+    files['tracking_file'].write_bytes(pickle.dumps([
+        (1000.0, KEY, 3600, ['Genetic Ascension', 42, 'name', 'avatar']),
+    ]))
+    files['update_file'].write_bytes(pickle.dumps({KEY: 900.0}))
+    files['birthday_file'].write_text(json.dumps(birthdays))
+    return {k: str(v) for k, v in files.items()}
+
+
+#------------------------------------------------------------------------------
+def test_migrate(tmp_path):
+    files = write_legacy(tmp_path, {'7': [[1, 2, 2000, 'name', 5, 6]]})
+    storage = Storage(str(tmp_path / 'rankings.db'))
+    assert storage.migrate(**files)
+    assert storage.load_boards() == {KEY: BOARD}
+    assert storage.load_last_update() == {KEY: 900.0}
+    assert storage.load_tracking() == [
+        (1000.0, KEY, 3600, ['Genetic Ascension', 42, 'name', 'avatar', 0, None, None, None]),
+    ]
+    assert storage.load_birthdays() == {'7': [(1, 2, 2000, 'name', 5, 6)]}
+    assert not storage.migrate(**files)
+    storage.close()
+
+
+def test_migrate_is_all_or_nothing(tmp_path):
+    #The birthday is short a value, the import fails after the boards
+    files = write_legacy(tmp_path, {'7': [[1, 2, 2000, 'name', 5]]})
+    storage = Storage(str(tmp_path / 'rankings.db'))
+    with pytest.raises(ValueError):
+        storage.migrate(**files)
+    assert storage.is_empty()
+
+    files = write_legacy(tmp_path, {'7': [[1, 2, 2000, 'name', 5, 6]]})
+    assert storage.migrate(**files)
+    assert storage.load_boards() == {KEY: BOARD}
+    storage.close()
+
+
+def test_save_board_skips_unchanged(tmp_path):
+    storage = Storage(str(tmp_path / 'rankings.db'))
+    storage.save_board(KEY, BOARD)
+    seq = storage.last_change()
+    storage.save_board(KEY, BOARD)
+    assert storage.last_change() == seq
+    storage.save_board(KEY, BOARD + [[2, '200', 1, 'Other', 400]])
+    assert storage.last_change() == seq + 1
+    storage.close()
+
+
+def test_read_all_leaves_the_lazy_boards_unread(tmp_path):
+    storage = Storage(str(tmp_path / 'rankings.db'))
+    other = 'power_rank-0-1-2-1-2'
+    storage.save_board(KEY, BOARD)
+    storage.save_board(other, BOARD)
+    loaded = []
+    boards = LazyBoards(storage, on_load=lambda key, board: loaded.append(key))
+    boards[KEY]
+    assert boards.read_all() == {KEY: BOARD, other: BOARD}
+    assert loaded == [KEY]
+    assert boards.pending() == [other]
+    storage.close()
+
+
+def test_lazy_boards(tmp_path):
+    storage = Storage(str(tmp_path / 'rankings.db'))
+    other = 'power_rank-0-1-2-1-2'
+    storage.save_board(KEY, BOARD)
+    storage.save_board(other, BOARD)
+    loaded = []
+    boards = LazyBoards(storage, on_load=lambda key, board: loaded.append(key))
+    #Only the keys are read up front
+    assert len(boards) == 2 and KEY in boards and 'missing' not in boards
+    assert loaded == []
+    #Read and indexed on the first use only
+    assert boards[KEY] == BOARD
+    assert boards[KEY] is boards[KEY]
+    assert loaded == [KEY]
+    with pytest.raises(KeyError):
+        boards['missing']
+    assert boards.get('missing') is None
+    storage.close()
+
+
+def test_lazy_boards_setitem_wins(tmp_path):
+    storage = Storage(str(tmp_path / 'rankings.db'))
+    other = 'power_rank-0-1-2-1-2'
+    new = [[1, '200', 1, 'Other', 1]]
+    storage.save_board(KEY, BOARD)
+    storage.save_board(other, BOARD)
+    boards = LazyBoards(storage)
+    #A refreshed board isn't replaced by the stored one, read now or later
+    boards[KEY] = new
+    boards.fill(storage.load_boards())
+    assert boards[KEY] == new
+    assert sorted(boards) == sorted([KEY, other])
+    assert boards.pending() == []
+    #and is read back once it's saved, the way update_data_and_update_time does
+    storage.save_board(KEY, boards[KEY])
+    assert LazyBoards(storage)[KEY] == new
+    del boards[KEY]
+    assert KEY not in boards and len(boards) == 1
+    with pytest.raises(KeyError):
+        del boards[KEY]
+    storage.close()
@@ -0,0 +1,71 @@
+from tracker import TrackerQueue
+
+KEY = 'power_rank-0-1-2-1-1'
+OTHER = 'best_sellers-0-3-2-1-1'
+
+
+def entry(timestamp, title, channel=1, key=KEY):
+    return (timestamp, key, 3600, [title, channel, 'name', 'avatar', 0, None, None, None])
+
+
+#------------------------------------------------------------------------------
+def test_pop_due_in_order():
+    queue = TrackerQueue([entry(30, 'c'), entry(10, 'a'), entry(20, 'b')])
+    assert queue.next_due() == 10
+    due = queue.pop_due(20)
+    assert [e[3][0] for eid, e in due] == ['a', 'b']
+    #Popped entries stay in the queue until rescheduled
+    assert len(queue) == 3
+    assert queue.next_due() == 30
+    assert queue.pop_due(25) == []
+
+
+def test_same_title_replaces():
+    queue = TrackerQueue([entry(10, 'Genetic Ascension')])
+    queue.push(entry(50, 'genetic ascension!'))
+    assert len(queue) == 1
+    assert queue.next_due() == 50
+    #Other channels and categories are other entries
+    queue.push(entry(10, 'Genetic Ascension', channel=2))
+    queue.push(entry(10, 'Genetic Ascension', key=OTHER))
+    assert len(queue) == 3
+
+
+def test_reschedule():
+    queue = TrackerQueue([entry(10, 'a')])
+    [(eid, old)] = queue.pop_due(10)
+    new = queue.reschedule(eid, old, 3610)
+    assert new[0] == 3610 and new[3] is old[3]
+    assert queue.next_due() == 3610
+
+
+def test_reschedule_after_remove_or_replace():
+    queue = TrackerQueue([entry(10, 'a'), entry(10, 'b')])
+    (a, old_a), (b, old_b) = sorted(queue.pop_due(10))
+    queue.remove(1, 'power_rank', 'A')
+    queue.push(entry(99, 'b'))
+    assert queue.reschedule(a, old_a, 3610) is None
+    assert queue.reschedule(b, old_b, 3610) is None
+    assert a not in queue
+    assert queue.next_due() == 99
+
+
+def test_tracking_and_make_due():
+    queue = TrackerQueue([entry(100, 'a'), entry(200, 'b'), entry(300, 'c', key=OTHER)])
+    assert sorted(e[3][0] for eid, e in queue.tracking(KEY)) == ['a', 'b']
+    [(eid, e)] = queue.tracking(OTHER)
+    assert queue.make_due(eid, 50)
+    assert queue.next_due() == 50
+    #Already due
+    assert not queue.make_due(eid, 60)
+    queue.remove(1, 'best_sellers', 'c')
+    assert queue.tracking(OTHER) == []
+    assert queue.next_due() == 100
+
+
+def test_dead_heap_items_are_dropped():
+    queue = TrackerQueue([entry(10, 'a')])
+    for n in range(1000):
+        queue.push(entry(n, 'a'))
+    assert len(queue.heap) <= 2*len(queue) + 65
+    assert queue.pop_due(10**6)[0][1][0] == 999
@@ -0,0 +1,117 @@
+import heapq
+import itertools
+
+from indexes import normalize_title
+
+
+#------------------------------------------------------------------------------
+class TrackerQueue:
+    '''
+    Priority queue of the tracked books keyed on their next due timestamp.
+
+    Entries keep the TRACKING_LIST layout, (timestamp, build_key, interval,
+    [title, channel, name, avatar, threshold, last_rank, book_id, guild]),
+    and are identified by (channel, category, normalized title). Removed or
+    rescheduled entries are dropped lazily from the heap.
+    '''
+    def __init__(self, entries=()):
+        self.entries = {} #id: entry
+        self.seqs = {} #id: sequence number of its live heap item
+        self.heap = [] #(timestamp, seq, id)
+        self.by_key = {} #build_key: set of ids tracking that board
+        self.counter = itertools.count()
+        for entry in entries:
+            self.push(entry)
+
+    @staticmethod
+    def entry_id(entry):
+        timestamp, key, delay, values = entry
+        return (values[1], key.split('-')[0], normalize_title(values[0]))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries.values()))
+
+    def __contains__(self, eid):
+        return eid in self.entries
+
+    def push(self, entry):
+        #Adds the entry, replacing the one with the same id
+        eid = self.entry_id(entry)
+        self._unlink(self.entries.pop(eid, None), eid)
+        self.entries[eid] = entry
+        self.by_key.setdefault(entry[1], set()).add(eid)
+        self._schedule(eid, entry[0])
+        return eid
+
+    def _schedule(self, eid, timestamp):
+        seq = next(self.counter)
+        self.seqs[eid] = seq
+        heapq.heappush(self.heap, (timestamp, seq, eid))
+        #Rebuild the heap when dead items pile up
+        if len(self.heap) > 2*len(self.entries) + 64:
+            self.heap = [(self.entries[i][0], s, i) for i, s in self.seqs.items()]
+            heapq.heapify(self.heap)
+
+    def remove(self, channel, category, title):
+        eid = (channel, category, normalize_title(title))
+        self.seqs.pop(eid, None)
+        entry = self.entries.pop(eid, None)
+        self._unlink(entry, eid)
+        return entry
+
+    def _unlink(self, entry, eid):
+        if entry is None:
+            return
+        ids = self.by_key.get(entry[1])
+        if ids is not None:
+            ids.discard(eid)
+            if not ids:
+                del self.by_key[entry[1]]
+
+    def tracking(self, key):
+        #Entries tracking the given board
+        return [(eid, self.entries[eid]) for eid in self.by_key.get(key, ())]
+
+    def make_due(self, eid, now):
+        #Moves a waiting entry to the front, entries being processed are left
+        if eid not in self.seqs:
+            return False
+        timestamp, key, delay, values = self.entries[eid]
+        if timestamp <= now:
+            return False
+        self.entries[eid] = (now, key, delay, values)
+        self._schedule(eid, now)
+        return True
+
+    def _clean(self):
+        while self.heap and self.seqs.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+
+    def next_due(self):
+        #Timestamp of the earliest entry, None if the queue is empty
+        self._clean()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        #Takes every entry due at `now` off the heap, they stay in the queue
+        #until they are rescheduled or removed
+        due = []
+        while self.next_due() is not None and self.heap[0][0] <= now:
+            timestamp, seq, eid = heapq.heappop(self.heap)
+            self.seqs.pop(eid, None)
+            due.append((eid, self.entries[eid]))
+        return due
+
+    def reschedule(self, eid, entry, timestamp):
+        #Puts a popped entry back with its next due time, unless it was
+        #replaced or removed while it was being processed
+        if self.entries.get(eid) is not entry:
+            return None
+        timestamp_, key, delay, values = entry
+        new = (timestamp, key, delay, values)
+        self.entries[eid] = new
+        self._schedule(eid, timestamp)
+        return new